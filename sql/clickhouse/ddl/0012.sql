@@ -0,0 +1,50 @@
+--- Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+---
+--- This Source Code Form is subject to the terms of the Mozilla Public
+--- License, v. 2.0. If a copy of the MPL was not distributed with this
+--- file, you can obtain one at https://mozilla.org/MPL/2.0/.
+---
+--- Developed by Sinodun IT (sinodun.com)
+---
+--- Table recording each job run by dsv-worker.
+--- NodeID is 0 if the node is not known. QueueWait is NULL if the
+--- time the job was queued is not known.
+---
+CREATE TABLE dsv.JobStatsShard
+(
+    Date Date,
+    DateTime DateTime,
+    Host String,
+    Queue String,
+    NodeID UInt16,
+    FileName String,
+    FileSize UInt64,
+    Rows UInt64,
+    ExitCode UInt8,
+    RetryCount UInt16,
+    QueueWait Nullable(Float32),
+    RunTime Float32
+)
+ENGINE = MergeTree()
+PARTITION BY toYearWeek(Date)
+ORDER BY (Date, DateTime, Queue, NodeID);
+
+---
+--- Create distributed table for job statistics.
+---
+CREATE TABLE dsv.JobStats
+(
+    Date Date,
+    DateTime DateTime,
+    Host String,
+    Queue String,
+    NodeID UInt16,
+    FileName String,
+    FileSize UInt64,
+    Rows UInt64,
+    ExitCode UInt8,
+    RetryCount UInt16,
+    QueueWait Nullable(Float32),
+    RunTime Float32
+)
+ENGINE = Distributed(dsv, dsv, JobStatsShard, rand());
@@ -0,0 +1,42 @@
+--- Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+---
+--- This Source Code Form is subject to the terms of the Mozilla Public
+--- License, v. 2.0. If a copy of the MPL was not distributed with this
+--- file, you can obtain one at https://mozilla.org/MPL/2.0/.
+---
+--- Developed by Sinodun IT (sinodun.com)
+---
+--- Ledger of C-DNS files whose query data has been imported.
+--- FileName is the name of the C-DNS file without any compression
+--- suffix. Date is the date from the file name, or the import date
+--- if the name has no date. Rows are ordered by node and file name,
+--- so checking whether a file is imported reads one granule in each
+--- partition, and the distributed table is sharded by node so only
+--- one shard need be asked.
+---
+CREATE TABLE dsv.ImportLedgerShard
+(
+    Date Date,
+    NodeID UInt16,
+    FileName String,
+    Rows UInt64,
+    Completed DateTime,
+    Host String
+)
+ENGINE = ReplacingMergeTree(Completed)
+PARTITION BY toYearWeek(Date)
+ORDER BY (NodeID, FileName);
+
+---
+--- Create distributed table for the import ledger.
+---
+CREATE TABLE dsv.ImportLedger
+(
+    Date Date,
+    NodeID UInt16,
+    FileName String,
+    Rows UInt64,
+    Completed DateTime,
+    Host String
+)
+ENGINE = Distributed(dsv, dsv, ImportLedgerShard, NodeID);
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Recompress archived C-DNS files into several xz blocks, so that
+# reprocessing them can decompress with several threads.
+#
+# Usage: dsv-cdns-recompress [--threads <n>] [--block-size <size>]
+#                            [--from <date>] [--to <date>] [<path>...]
+#
+
+import logging
+import pathlib
+import sys
+
+import dsv.common.DateTime as dd
+import dsv.common.Lock as dl
+import dsv.common.Path as dp
+import dsv.common.TimeIndex as dti
+import dsv.common.Xz as dxz
+
+description = 'recompress archived C-DNS files for multi-threaded decompression.'
+
+def cdns_files(paths, datastore, file_pattern, from_date, to_date):
+    """Generate the C-DNS files to recompress.
+
+       paths are files or directories. If there are none, use the
+       archived C-DNS directories of all nodes in the datastore."""
+    if not paths:
+        paths = sorted(pathlib.Path(datastore).glob('*/*/' + dp.CDNS_DIR))
+    for path in paths:
+        path = pathlib.Path(path)
+        if path.is_dir():
+            names = [f.name for f in path.glob(file_pattern)]
+            files = [path / name for name in dti.TimeIndex(path, names).select(from_date, to_date)]
+        else:
+            files = [path]
+        for f in files:
+            if f.suffix == '.xz':
+                yield f
+
+def add_args(parser):
+    parser.add_argument('paths',
+                        nargs='*',
+                        help='C-DNS files or directories to recompress, '
+                        'default all node C-DNS archive directories',
+                        metavar='PATH')
+    parser.add_argument('--threads',
+                        dest='threads', action='store', type=int,
+                        default=dxz.ALL_CPUS,
+                        help='threads to use compressing, 0 for one per CPU',
+                        metavar='THREADS')
+    parser.add_argument('--block-size',
+                        dest='block_size', action='store',
+                        default='16MiB',
+                        help='uncompressed size of each compressed block',
+                        metavar='SIZE')
+    parser.add_argument('--level',
+                        dest='level', action='store', type=int,
+                        choices=range(10), default=6,
+                        help='xz compression level',
+                        metavar='LEVEL')
+    parser.add_argument('--from',
+                        dest='from_date', action='store',
+                        type=dd.arg_valid_date_type,
+                        default=None,
+                        help='don\'t recompress data from before this date',
+                        metavar='DATE')
+    parser.add_argument('--to',
+                        dest='to_date', action='store',
+                        type=dd.arg_valid_date_type,
+                        default=None,
+                        help='don\'t recompress data from at or after this date',
+                        metavar='DATE')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='enable verbosity')
+    parser.add_argument('-n', '--dry-run',
+                        dest='dryrun', action='store_true', default=False,
+                        help='perform a trial run')
+
+def main(args, cfg):
+    datastore_cfg = cfg['datastore']
+
+    try:
+        user = dl.DSVUser(datastore_cfg['user'])
+        user.ensure_user()
+    except dl.WrongUserException as e:
+        logging.error(str(e))
+        print(str(e), file=sys.stderr)
+        return 1
+
+    done = 0
+    skipped = 0
+    failed = 0
+    for f in cdns_files(args.paths, datastore_cfg['path'], datastore_cfg['cdns_file_pattern'],
+                        args.from_date, args.to_date):
+        if args.dryrun:
+            blocks = dxz.block_count(f)
+            if blocks == 1:
+                print('{} will be recompressed.'.format(f))
+                done += 1
+            else:
+                skipped += 1
+            continue
+        try:
+            if dxz.recompress(f, args.threads, args.block_size, args.level):
+                done += 1
+                if args.verbose:
+                    print('{} recompressed.'.format(f))
+            else:
+                skipped += 1
+        except (dxz.XzError, OSError) as err:
+            failed += 1
+            logging.error(str(err))
+            print(str(err), file=sys.stderr)
+    print('{} files {}, {} already in blocks, {} failed.'.format(
+        done, 'to recompress' if args.dryrun else 'recompressed', skipped, failed))
+    if done and not args.dryrun:
+        logging.info('{} files recompressed'.format(done))
+    return 1 if failed else 0
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# Copyright 2018-2020 Internet Corporation for Assigned Names and Numbers.
+# Copyright 2018-2021 Internet Corporation for Assigned Names and Numbers.
 #
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
@@ -13,7 +13,7 @@
 # Usage: dsv-find-node-id <server-name> <node-name>
 #
 
-import psycopg2
+import dsv.common.NodeIds as dnid
 
 description = 'find node ID from Postgres.'
 
@@ -26,32 +26,11 @@ def add_args(parser):
                         metavar='NODENAME')
 
 def main(args, cfg):
-    conn = None
-
-    try:
-        pgcfg = cfg['postgres']
-        conn = psycopg2.connect(host=pgcfg['host'],
-                                dbname=pgcfg['database'],
-                                user=pgcfg['user'],
-                                password=pgcfg['password'])
-
-        with conn.cursor() as cur:
-            cur.execute('SELECT node.id FROM node '
-                        'INNER JOIN node_server ON node_server.id = node.server_id '
-                        'WHERE (node_server.name=%(server)s OR '
-                        '       node_server.altname=%(server)s) '
-                        'AND (node.name=%(node)s OR node.altname=%(node)s)',
-                        {'server': args.servername, 'node': args.nodename})
-            res = cur.fetchone()
-
-        conn.close()
-
-        if res:
-            print(res[0])
-            return 0
-        return 1
-    except Exception:
-        if conn is not None:
-            conn.rollback()
-            conn.close()
-        raise
+    # Node IDs are read from the snapshot if present, so there is
+    # usually no need to go to Postgres.
+    resolver = dnid.NodeIdResolver(cfg['postgres'], cfg['datastore']['node_ids'])
+    res = resolver.node_id(args.servername, args.nodename)
+    if res is not None:
+        print(res)
+        return 0
+    return 1
@@ -11,16 +11,27 @@
 # Scan Visualizer incoming directories looking for new C-DNS files (.cbor.xz)
 # that have not yet been added to the list for processing, and add them.
 
+import fnmatch
+import heapq
 import logging
 import os
 import os.path
 import pathlib
+import random
 import sys
 
+import clickhouse_driver
+
+import dsv.common.Backfill as dbf
 import dsv.common.DateTime as dd
+import dsv.common.ImportLedger as dil
+import dsv.common.Inotify as dinotify
 import dsv.common.Lock as dl
+import dsv.common.NodeIds as dnid
 import dsv.common.Path as dp
 import dsv.common.Queue as dq
+import dsv.common.ScanIndex as dsi
+import dsv.common.TimeIndex as dti
 
 description = 'check for files and add to processing queue.'
 
@@ -135,6 +146,32 @@ class Filter:
 
 server_filters = {}
 
+def ensure_server_filter(dsv_path):
+    if dsv_path.server not in server_filters:
+        server_filters[dsv_path.server] = Filter(dsv_path.server_dir_path)
+
+# Datastore scan index, if in use.
+scan_index = None
+
+# Filter for C-DNS files already imported, if in use.
+import_ledger = None
+
+def already_imported(fpath, verbose):
+    """Is the file at the DSVPath recorded in the import ledger?"""
+    if import_ledger and import_ledger.imported(fpath):
+        if verbose:
+            print('{} already imported'.format(fpath.path))
+        return True
+    return False
+
+def open_import_ledger(cfg):
+    """Return a filter for files recorded in the import ledger."""
+    chcfg = cfg['clickhouse']
+    client = clickhouse_driver.Client(host=random.choice(chcfg['import-server'].split(',')),
+                                      user=chcfg['user'], password=chcfg['password'])
+    resolver = dnid.NodeIdResolver(cfg['postgres'], cfg['datastore']['node_ids'])
+    return dil.LedgerFilter(client, chcfg['database'], resolver)
+
 def link(file_path, target_path):
     """Link file to the target name.
 
@@ -154,7 +191,98 @@ def link(file_path, target_path):
         logging.warning(err)
         return False
 
-def files_to_process(path, dir_pattern, file_pattern, from_date=None, to_date=None):
+def dir_file_names(dpath, file_pattern):
+    """Return the names of files in the directory matching file_pattern.
+
+       Use the scan index if available."""
+    if scan_index:
+        return scan_index.files(dpath, file_pattern)
+    return [f.name for f in dpath.glob(file_pattern)]
+
+class NodeFiles:
+    """The files to process from a single node directory.
+
+       The directory is not read until the files are first needed.
+       Files are returned in reverse name order - so in reverse date
+       order, most recent first.
+
+       To keep memory use down when a directory holds very many files,
+       the file names are held as a single newline-separated string
+       rather than as a list of separate strings."""
+    def __init__(self, dpath, file_pattern, from_date=None, to_date=None):
+        self._dpath = dpath
+        self._prefix = str(dpath) + os.sep
+        self._file_pattern = file_pattern
+        self._from_date = from_date
+        self._to_date = to_date
+        self._names = None
+        self._pos = 0
+        self._count = 0
+
+    def _load(self):
+        names = dir_file_names(self._dpath, self._file_pattern)
+        if self._from_date or self._to_date:
+            names = dti.TimeIndex(self._dpath, names).select(self._from_date, self._to_date)
+        names.sort(reverse=True)
+        self._count = len(names)
+        self._names = '\n'.join(names)
+        if names:
+            self._names += '\n'
+
+    @property
+    def backlog(self):
+        """Return the number of files remaining."""
+        if self._names is None:
+            self._load()
+        return self._count
+
+    @property
+    def backlog_bytes(self):
+        """Return the total size of the files remaining."""
+        if self._names is None:
+            self._load()
+        res = 0
+        pos = self._pos
+        while pos < len(self._names):
+            end = self._names.index('\n', pos)
+            try:
+                res += os.stat(self._prefix + self._names[pos:end]).st_size
+            except FileNotFoundError:
+                pass
+            pos = end + 1
+        return res
+
+    def next(self):
+        """Return the path of the next file, or None if there are no more."""
+        if self._names is None:
+            self._load()
+        if self._pos >= len(self._names):
+            return None
+        end = self._names.index('\n', self._pos)
+        res = self._prefix + self._names[self._pos:end]
+        self._pos = end + 1
+        self._count -= 1
+        if self._pos >= len(self._names):
+            # Done. Release the memory.
+            self._names = ''
+            self._pos = 0
+        return res
+
+# How to weight the share of files taken from each node. None gives
+# each node an equal share.
+WEIGHT_BACKLOG = 'backlog'
+WEIGHT_BYTES = 'bytes'
+node_weighting = None
+
+def node_weight(nodefiles):
+    if node_weighting == WEIGHT_BACKLOG:
+        return max(nodefiles.backlog, 1)
+    if node_weighting == WEIGHT_BYTES:
+        return max(nodefiles.backlog_bytes, 1)
+    return 1
+
+def files_to_process(path, dir_pattern, file_pattern, from_date=None, to_date=None,
+                     found=None):
     """Generate list of files in processing order.
 
        Files matching file_pattern are selected from directories
@@ -167,34 +295,45 @@ def files_to_process(path, dir_pattern, file_pattern, from_date=None, to_date=No
        For each server we encounter, ensure its filters are loaded.
 
        To prevent files from a single host blocking timely processing
-       of less busy hosts, take one file from each directory at a time."""
-    nodefiles = {}
-    for dpath in pathlib.Path(path).glob(dir_pattern):
+       of less busy hosts, take files from each directory in turn.
+       Turns are scheduled with a heap ordered on a per-node virtual
+       time, which advances by the inverse of the node weight each time
+       a file is taken from the node. With equal weights, this takes
+       one file from each directory at a time. With node weighting,
+       each node gets a share of turns proportional to its weight, but
+       no node is ever starved. A node is weighed when it first has a
+       turn, so directories are still only read as needed; by the end
+       of the first round of turns all have been read.
+
+       If found is given, it is called with the number of files in
+       each directory when the directory is read, and with None once
+       all directories have been read."""
+    heap = []
+    for seq, dpath in enumerate(pathlib.Path(path).glob(dir_pattern)):
         if dpath.is_dir():
             wompath = dp.DSVPath(dpath)
-            node = wompath.server + '|' + wompath.node
-            nodefiles[node] = []
-            for f in dpath.glob(file_pattern):
-                fpath = dp.DSVPath(f)
-                if fpath.server not in server_filters:
-                    server_filters[fpath.server] = Filter(fpath.server_dir_path)
-                if from_date or to_date:
-                    if from_date and fpath.datetime() < from_date:
-                        continue
-                    if to_date and fpath.datetime() >= to_date:
-                        continue
-                nodefiles[node].append(str(f))
-    # Put node files in reverse path order - so in reverse date order,
-    # most recent first.
-    for node in nodefiles:
-        nodefiles[node].sort(reverse=True)
-    more = True
-    while more:
-        more = False
-        for node in nodefiles:
-            if len(nodefiles[node]) > 0:
-                yield nodefiles[node].pop(0)
-                more = True
+            ensure_server_filter(wompath)
+            nodefiles = NodeFiles(dpath, file_pattern, from_date, to_date)
+            heap.append((0.0, seq, None, nodefiles))
+    heapq.heapify(heap)
+    unread = len(heap)
+    if found and not unread:
+        found(None)
+    while heap:
+        vtime, seq, stride, nodefiles = heap[0]
+        if stride is None:
+            stride = 1.0 / node_weight(nodefiles)
+            if found:
+                found(nodefiles.backlog)
+                unread -= 1
+                if not unread:
+                    found(None)
+        f = nodefiles.next()
+        if f is None:
+            heapq.heappop(heap)
+            continue
+        heapq.heapreplace(heap, (vtime + stride, seq, stride, nodefiles))
+        yield f
 
 def assess_pcap_filter(filt, dsv_file_path, check_time=True):
     if check_time and (filt.start or filt.end):
@@ -236,52 +375,271 @@ def do_import(dsv_file_path):
         global_filter.use_node_import(dsv_file_path.node) and \
         global_filter.use_server_import(dsv_file_path.server)
 
-def process_incoming(writer, path, file_pattern, verbose, dryrun):
-    """Process incoming jobs.
-
-       Run over C-DNS in */incoming and:
+def process_incoming_file(writer, f, verbose, dryrun):
+    """Process a single incoming job.
 
        1. Link to incoming/pending and submit convert to TSV job.
        2. If required, link to pcap/pending and submit convert PCAP job.
        3. Move file from incoming to cbor.
 
+       Return number of jobs queued.
+    """
+    res = 0
+    fpath = dp.DSVPath(f)
+    ensure_server_filter(fpath)
+    if do_import(fpath):
+        if verbose:
+            print('Add {} to cdns-to-tsv'.format(f))
+        if dryrun:
+            res += 1
+        else:
+            pendingpath = fpath.incoming_pending_file_path
+            if link(fpath.incoming_file_path, pendingpath):
+                writer.add('cdns-to-tsv', pendingpath)
+                res += 1
+
+    if generate_pcap_import(fpath):
+        if verbose:
+            print('Add {} to cdns-to-pcap'.format(f))
+        if dryrun:
+            res += 1
+        else:
+            pendingpath = fpath.pcap_pending_file_path
+            if link(fpath.incoming_file_path, pendingpath):
+                writer.add('cdns-to-pcap', pendingpath, dq.JobPrecedence.low)
+                res += 1
+
+    if not dryrun:
+        cdnspath = fpath.cdns_file_path
+        cdnspath.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            # If origin file has been deleted between assembling the list
+            # and actioning it, this will fail.
+            fpath.incoming_file_path.rename(cdnspath)
+        except FileNotFoundError as err:
+            logging.warning(err)
+    return res
+
+def process_incoming(writer, path, file_pattern, verbose, dryrun):
+    """Process incoming jobs.
+
+       Run over C-DNS in */incoming and process each file.
+
        Return number of files queued.
     """
     res = 0
     for f in files_to_process(path, INCOMING_DIR_PATTERN, file_pattern):
+        res += process_incoming_file(writer, f, verbose, dryrun)
+    return res
+
+class IncomingWatcher:
+    """Watch datastore incoming directories for new C-DNS files.
+
+       Watches are set on the datastore root, each server directory and
+       each node directory, so that new servers and nodes are noticed,
+       and on the incoming directory of each node. Changes to filter
+       files in the root or server directories are also noticed, as
+       are changes to the import lock file permissions."""
+    # Directory levels below the datastore root.
+    ROOT = 0
+    SERVER = 1
+    NODE = 2
+    INCOMING = 3
+
+    MASKS = {
+        ROOT: dinotify.IN_CREATE | dinotify.IN_MOVED_TO | dinotify.IN_CLOSE_WRITE,
+        SERVER: dinotify.IN_CREATE | dinotify.IN_MOVED_TO | dinotify.IN_CLOSE_WRITE,
+        NODE: dinotify.IN_CREATE | dinotify.IN_MOVED_TO,
+        INCOMING: dinotify.IN_CLOSE_WRITE | dinotify.IN_MOVED_TO,
+    }
+
+    FILTER_FILES = ['dsv.filter', 'inspector.filter']
+
+    def __init__(self, inotify, path, file_pattern, lockpath):
+        self._inotify = inotify
+        self._root = pathlib.Path(path)
+        self._file_pattern = file_pattern
+        self._lockpath = pathlib.Path(lockpath)
+        self._levels = {}
+
+    def watch(self):
+        """Watch the whole datastore tree. Return list of files present."""
+        self._inotify.add_watch(self._lockpath, dinotify.IN_ATTRIB)
+        return self._watch_dir(self._root, self.ROOT)
+
+    def _watch_dir(self, dpath, level):
+        """Watch a directory and its relevant subdirectories.
+
+           Return a list of any C-DNS files already present in
+           newly watched incoming directories."""
+        try:
+            self._inotify.add_watch(dpath, self.MASKS[level] | dinotify.IN_ONLYDIR)
+        except OSError as err:
+            logging.warning('Cannot watch {}: {}'.format(dpath, err))
+            return []
+        self._levels[str(dpath)] = level
+        res = []
+        if level == self.INCOMING:
+            res.extend(str(f) for f in dpath.glob(self._file_pattern) if f.is_file())
+        elif level == self.NODE:
+            incoming = dpath / dp.INCOMING_DIR
+            if incoming.is_dir():
+                res.extend(self._watch_dir(incoming, self.INCOMING))
+        else:
+            for child in dpath.iterdir():
+                if child.is_dir():
+                    res.extend(self._watch_dir(child, level + 1))
+        return res
+
+    def events(self):
+        """Wait for events, and return a tuple of (new files, control events).
+
+           Control events are 'rescan' if events have been lost, 'lock' if
+           the lock file permissions have changed or 'filter' if a filter
+           file has changed."""
+        files = []
+        control = set()
+        for ev in self._inotify.read():
+            if ev.mask & dinotify.IN_Q_OVERFLOW:
+                control.add('rescan')
+                continue
+            if ev.path is None or ev.mask & dinotify.IN_IGNORED:
+                continue
+            if ev.path == str(self._lockpath):
+                control.add('lock')
+                continue
+            level = self._levels.get(ev.path)
+            if level is None:
+                continue
+            dpath = pathlib.Path(ev.path)
+            if ev.mask & dinotify.IN_ISDIR:
+                if level < self.NODE or (level == self.NODE and ev.name == dp.INCOMING_DIR):
+                    files.extend(self._watch_dir(dpath / ev.name, level + 1))
+            elif level < self.NODE:
+                if ev.name in self.FILTER_FILES:
+                    server = None if level == self.ROOT else dpath.name
+                    server_filters.pop(server, None)
+                    control.add('filter')
+            elif level == self.INCOMING and fnmatch.fnmatchcase(ev.name, self._file_pattern):
+                files.append(str(dpath / ev.name))
+        return (files, control)
+
+def watch_incoming(writer, path, file_pattern, lock, verbose, dryrun):
+    """Watch for incoming files, and process each one on arrival.
+
+       Run a catch-up scan first to process files already present.
+       Run until interrupted, and return the number of jobs queued."""
+    res = 0
+    with dinotify.Inotify() as inotify:
+        watcher = IncomingWatcher(inotify, path, file_pattern, lock.path)
+        watcher.watch()
+        frozen = lock.is_frozen()
+        if not frozen:
+            n = process_incoming(writer, path, file_pattern, verbose, dryrun)
+            res += n
+            logging.info('Import/watch catch-up complete, {} jobs queued'.format(n))
+        try:
+            while True:
+                files, control = watcher.events()
+                if 'filter' in control and None not in server_filters:
+                    server_filters[None] = Filter(pathlib.Path(path))
+                if 'lock' in control:
+                    was_frozen = frozen
+                    frozen = lock.is_frozen()
+                    if frozen != was_frozen:
+                        logging.info('Import {}.'.format('frozen' if frozen else 'thawed'))
+                    if was_frozen and not frozen:
+                        control.add('rescan')
+                if frozen:
+                    continue
+                if 'rescan' in control:
+                    watcher.watch()
+                    n = process_incoming(writer, path, file_pattern, verbose, dryrun)
+                    res += n
+                    logging.info('Import/watch rescan complete, {} jobs queued'.format(n))
+                    continue
+                for f in files:
+                    res += process_incoming_file(writer, f, verbose, dryrun)
+        except KeyboardInterrupt:
+            logging.info('Import/watch interrupted')
+    return res
+
+def queue_jobs(writer, queue, jobs, precedence=dq.JobPrecedence.normal, dryrun=False):
+    """Add all jobs from an iterable to a queue.
+
+       The jobs are submitted in a single batch. If dryrun, consume
+       the jobs without submitting them. Return number of jobs.
+    """
+    if dryrun:
+        return sum(1 for _ in jobs)
+    return writer.add_many(queue, jobs, precedence)
+
+def cbor_jobs(path, file_pattern, from_date, to_date, verbose, dryrun, checkpoint=None):
+    """Generate convert to TSV jobs for C-DNS in */cbor.
+
+       For file in-date and node not import filtered, link to cbor/pending
+       and generate the pending path. If dryrun, generate the file path
+       and don't link.
+
+       If a backfill checkpoint is given, skip files already seen and
+       record each file seen, and count the files found in the checkpoint.
+       Skip files recorded in the import ledger.
+       A file not seen that already has a pending link is queued again,
+       as a backfill interrupted while submitting jobs may have linked
+       it without queueing it.
+    """
+    for f in files_to_process(path, CDNS_DIR_PATTERN, file_pattern, from_date, to_date,
+                              checkpoint.found if checkpoint else None):
+        if checkpoint and checkpoint.check(f):
+            continue
         fpath = dp.DSVPath(f)
-        if do_import(fpath):
+        if do_import(fpath) and not already_imported(fpath, verbose):
             if verbose:
                 print('Add {} to cdns-to-tsv'.format(f))
             if dryrun:
-                res += 1
+                yield f
             else:
-                pendingpath = fpath.incoming_pending_file_path
-                if link(fpath.incoming_file_path, pendingpath):
-                    writer.add('cdns-to-tsv', pendingpath)
-                    res += 1
-
-        if generate_pcap_import(fpath):
+                pendingpath = fpath.cdns_pending_file_path
+                if checkpoint and pendingpath.exists():
+                    # Linked by an interrupted backfill, which may
+                    # not have queued it. If it is queued, the job
+                    # key stops it being queued twice.
+                    yield pendingpath
+                elif link(fpath.cdns_file_path, pendingpath):
+                    yield pendingpath
+
+def pcap_jobs(path, file_pattern, from_date, to_date, verbose, dryrun, checkpoint=None):
+    """Generate convert to PCAP jobs for C-DNS in */cbor.
+
+       For file in-date and node not PCAP filtered, link to pcap/pending
+       and generate the pending path. If dryrun, generate the file path
+       and don't link.
+
+       If a backfill checkpoint is given, skip files already seen and
+       record each file seen, and count the files found in the checkpoint.
+       A file not seen that already has a
+       pending link is queued again, as a backfill interrupted while
+       submitting jobs may have linked it without queueing it.
+    """
+    for f in files_to_process(path, CDNS_DIR_PATTERN, file_pattern, from_date, to_date,
+                              checkpoint.found if checkpoint else None):
+        if checkpoint and checkpoint.check(f):
+            continue
+        fpath = dp.DSVPath(f)
+        if generate_pcap_manual(fpath):
             if verbose:
                 print('Add {} to cdns-to-pcap'.format(f))
             if dryrun:
-                res += 1
+                yield f
             else:
                 pendingpath = fpath.pcap_pending_file_path
-                if link(fpath.incoming_file_path, pendingpath):
-                    writer.add('cdns-to-pcap', pendingpath, dq.JobPrecedence.low)
-                    res += 1
-
-        if not dryrun:
-            cdnspath = fpath.cdns_file_path
-            cdnspath.parent.mkdir(parents=True, exist_ok=True)
-            try:
-                # If origin file has been deleted between assembling the list
-                # and actioning it, this will fail.
-                fpath.incoming_file_path.rename(cdnspath)
-            except FileNotFoundError as err:
-                logging.warning(err)
-    return res
+                if checkpoint and pendingpath.exists():
+                    # Linked by an interrupted backfill, which may
+                    # not have queued it. If it is queued, the job
+                    # key stops it being queued twice.
+                    yield pendingpath
+                elif link(fpath.cdns_file_path, pendingpath):
+                    yield pendingpath
 
 def process_cbor(writer, path, file_pattern, from_date, to_date, verbose, dryrun):
     """Process loading from cbor directory.
@@ -292,20 +650,9 @@ def process_cbor(writer, path, file_pattern, from_date, to_date, verbose, dryrun
 
        Return number of files queued.
     """
-    res = 0
-    for f in files_to_process(path, CDNS_DIR_PATTERN, file_pattern, from_date, to_date):
-        fpath = dp.DSVPath(f)
-        if do_import(fpath):
-            if verbose:
-                print('Add {} to cdns-to-tsv'.format(f))
-            if dryrun:
-                res += 1
-            else:
-                pendingpath = fpath.cdns_pending_file_path
-                if link(fpath.cdns_file_path, pendingpath):
-                    writer.add('cdns-to-tsv', pendingpath, dq.JobPrecedence.low)
-                    res += 1
-    return res
+    return queue_jobs(writer, 'cdns-to-tsv',
+                      cbor_jobs(path, file_pattern, from_date, to_date, verbose, dryrun),
+                      dq.JobPrecedence.low, dryrun)
 
 def process_pcap(writer, path, file_pattern, from_date, to_date, verbose, dryrun):
     """Process generating PCAP from cbor directory.
@@ -316,20 +663,9 @@ def process_pcap(writer, path, file_pattern, from_date, to_date, verbose, dryrun
 
        Return number of files queued.
     """
-    res = 0
-    for f in files_to_process(path, CDNS_DIR_PATTERN, file_pattern, from_date, to_date):
-        fpath = dp.DSVPath(f)
-        if generate_pcap_manual(fpath):
-            if verbose:
-                print('Add {} to cdns-to-pcap'.format(f))
-            if dryrun:
-                res += 1
-            else:
-                pendingpath = fpath.pcap_pending_file_path
-                if link(fpath.cdns_file_path, pendingpath):
-                    writer.add('cdns-to-pcap', pendingpath, dq.JobPrecedence.low)
-                    res += 1
-    return res
+    return queue_jobs(writer, 'cdns-to-pcap',
+                      pcap_jobs(path, file_pattern, from_date, to_date, verbose, dryrun),
+                      dq.JobPrecedence.low, dryrun)
 
 def process_error(writer, path,
                   cdns_file_pattern, tsv_file_pattern, verbose, dryrun):
@@ -378,10 +714,17 @@ def process_error(writer, path,
 
 def process_regen_tsv(writer, path,
                       cdns_file_pattern, tsv_file_pattern, verbose, dryrun):
-    """Refill C-DNS queue from failures in TSV error directories. Return count."""
+    """Refill C-DNS queue from failures in TSV error directories. Return count.
+
+       TSV whose data is recorded in the import ledger is removed without
+       regenerating it."""
     res = 0
     for f in files_to_process(path, error_dir_pattern('import-tsv'), tsv_file_pattern):
         fpath = dp.DSVPath(f)
+        if already_imported(fpath, verbose):
+            if not dryrun:
+                fpath.path.unlink()
+            continue
         # Look for original C-DNS.
         fname = pathlib.Path(fpath.path.name)
         while fname.suffix:
@@ -414,41 +757,24 @@ def process_regen_tsv(writer, path,
 def process_pending(writer, path,
                     cdns_file_pattern, tsv_file_pattern, verbose, dryrun):
     """Refill queue from pending directories. Return count."""
-    res = 0
-    for f in files_to_process(path, INCOMING_DIR_PATTERN + '/' + dp.PENDING_DIR, cdns_file_pattern):
-        if verbose:
-            print('Add {} to cdns-to-tsv'.format(f))
-        if not dryrun:
-            writer.add('cdns-to-tsv', f)
-        res += 1
-
-    for f in files_to_process(path, CDNS_DIR_PATTERN + '/' + dp.PENDING_DIR, cdns_file_pattern):
-        if verbose:
-            print('Add {} to cdns-to-tsv'.format(f))
-        if not dryrun:
-            writer.add('cdns-to-tsv', f, dq.JobPrecedence.low)
-        res += 1
-
-    for f in files_to_process(path, INCOMING_DIR_PATTERN + '/' + dp.PENDING_DIR, tsv_file_pattern):
-        if verbose:
-            print('Add {} to import-tsv'.format(f))
-        if not dryrun:
-            writer.add('import-tsv', f)
-        res += 1
-
-    for f in files_to_process(path, CDNS_DIR_PATTERN + '/' + dp.PENDING_DIR, tsv_file_pattern):
-        if verbose:
-            print('Add {} to import-tsv'.format(f))
-        if not dryrun:
-            writer.add('import-tsv', f)
-        res += 1
+    def jobs(queue, dir_pattern, file_pattern):
+        for f in files_to_process(path, dir_pattern, file_pattern):
+            if verbose:
+                print('Add {} to {}'.format(f, queue))
+            yield f
 
-    for f in files_to_process(path, PCAP_DIR_PATTERN + '/' + dp.PENDING_DIR, cdns_file_pattern):
-        if verbose:
-            print('Add {} to cdns-to-pcap'.format(f))
-        if not dryrun:
-            writer.add('cdns-to-pcap', f, dq.JobPrecedence.low)
-        res += 1
+    incoming_pending = INCOMING_DIR_PATTERN + '/' + dp.PENDING_DIR
+    cdns_pending = CDNS_DIR_PATTERN + '/' + dp.PENDING_DIR
+    pcap_pending = PCAP_DIR_PATTERN + '/' + dp.PENDING_DIR
+    res = 0
+    for queue, dir_pattern, file_pattern, precedence in [
+            ('cdns-to-tsv', incoming_pending, cdns_file_pattern, dq.JobPrecedence.normal),
+            ('cdns-to-tsv', cdns_pending, cdns_file_pattern, dq.JobPrecedence.low),
+            ('import-tsv', incoming_pending, tsv_file_pattern, dq.JobPrecedence.normal),
+            ('import-tsv', cdns_pending, tsv_file_pattern, dq.JobPrecedence.normal),
+            ('cdns-to-pcap', pcap_pending, cdns_file_pattern, dq.JobPrecedence.low)]:
+        res += queue_jobs(writer, queue, jobs(queue, dir_pattern, file_pattern),
+                          precedence, dryrun)
     return res
 
 def add_args(parser):
@@ -471,6 +797,29 @@ def add_args(parser):
                         default=None,
                         help='don\'t process cbor data from at or after this date',
                         metavar='DATE')
+    parser.add_argument('--node-weight',
+                        dest='node_weight', action='store',
+                        choices=[WEIGHT_BACKLOG, WEIGHT_BYTES],
+                        default=None,
+                        help='share files between nodes in proportion to node backlog or bytes',
+                        metavar='WEIGHT')
+    parser.add_argument('--backfill',
+                        dest='backfill', action='store_true', default=False,
+                        help='with source cbor or pcap, add jobs gradually to keep '
+                        'the queue at a target depth')
+    parser.add_argument('--queue-depth',
+                        dest='queue_depth', action='store', type=int,
+                        default=1000,
+                        help='in backfill, the target number of jobs waiting in the queue',
+                        metavar='JOBS')
+    parser.add_argument('--rate',
+                        dest='rate', action='store', type=float,
+                        default=None,
+                        help='in backfill, the maximum average jobs queued per second',
+                        metavar='JOBS')
+    parser.add_argument('-w', '--watch',
+                        dest='watch', action='store_true', default=False,
+                        help='after processing incoming, watch for and process new files')
     parser.add_argument('-v', '--verbose',
                         action='store_true', default=False,
                         help='enable verbosity')
@@ -482,20 +831,35 @@ def main(args, cfg):
     if args.from_date and args.to_date and (args.from_date >= args.to_date):
         print('Error: To date must be after From date', file=sys.stderr)
         return 1
+    if args.watch and args.source != 'incoming':
+        print('Error: --watch is only valid with --source incoming', file=sys.stderr)
+        return 1
+    if args.backfill and args.source not in ['cbor', 'pcap']:
+        print('Error: --backfill is only valid with --source cbor or pcap', file=sys.stderr)
+        return 1
+    if args.queue_depth < 1 or (args.rate is not None and args.rate <= 0):
+        print('Error: --queue-depth and --rate must be positive', file=sys.stderr)
+        return 1
 
     try:
         datastore_cfg = cfg['datastore']
 
+        # A backfill runs for a long time, so uses its own lock and
+        # leaves the import lock free for regular imports.
         try:
-            lock = dl.DSVLock(datastore_cfg['user'], datastore_cfg['lockfile'].format('import'))
+            lock = dl.DSVLock(datastore_cfg['user'],
+                              datastore_cfg['lockfile'].format(
+                                  'backfill' if args.backfill else 'import'))
             lock.lock()
         except PermissionError:
             logging.error('Import is frozen.')
             print('Import is frozen.', file=sys.stderr)
             return 1
         except BlockingIOError:
-            logging.error('Another import is active.')
-            print('Another import is active.', file=sys.stderr)
+            logging.error('Another {} is active.'.format(
+                'backfill' if args.backfill else 'import'))
+            print('Another {} is active.'.format(
+                'backfill' if args.backfill else 'import'), file=sys.stderr)
             return 1
         except dl.WrongUserException as e:
             logging.error(str(e))
@@ -504,13 +868,28 @@ def main(args, cfg):
 
         server_filters[None] = Filter(pathlib.Path(datastore_cfg['path']))
 
+        # pylint: disable=global-statement,invalid-name
+        global scan_index, node_weighting, import_ledger
+        scan_index = dsi.open_scan_index(datastore_cfg['scan_index'])
+        node_weighting = args.node_weight
+        if args.source in ['cbor', 'regen-error-tsv']:
+            import_ledger = open_import_ledger(cfg)
+
         qcontext = dq.QueueContext(cfg, sys.argv[0])
         with qcontext.writer() as writer:
-            if args.source == 'incoming':
+            if args.source == 'incoming' and args.watch:
+                n = watch_incoming(writer,
+                                   datastore_cfg['path'],
+                                   datastore_cfg['cdns_file_pattern'],
+                                   lock, args.verbose, args.dryrun)
+            elif args.source == 'incoming':
                 n = process_incoming(writer,
                                      datastore_cfg['path'],
                                      datastore_cfg['cdns_file_pattern'],
                                      args.verbose, args.dryrun)
+            elif args.backfill and not args.dryrun:
+                n = dbf.process_backfill(writer, datastore_cfg, args,
+                                         cbor_jobs if args.source == 'cbor' else pcap_jobs)
             elif args.source == 'cbor':
                 n = process_cbor(writer,
                                  datastore_cfg['path'],
@@ -542,6 +921,12 @@ def main(args, cfg):
                                     datastore_cfg['tsv_file_pattern'],
                                     args.verbose, args.dryrun)
 
+        if scan_index:
+            scan_index.close()
+        if import_ledger and import_ledger.skipped:
+            logging.info('Import/{job} skipped {nfiles} files already imported'.format(
+                job=args.source, nfiles=import_ledger.skipped))
+
         logging.info('Import/{job} complete, {njobs} jobs queued'.format(job=args.source, njobs=n))
 
         qstat = ""
@@ -552,7 +937,7 @@ def main(args, cfg):
                 name=q[0], length=q[1], running=q[2], workers=q[3])
         logging.info(qstat)
         return 0
-    except ValueError as valerr:
+    except (ValueError, dinotify.InotifyUnavailableError) as valerr:
         logging.error(valerr)
         print(valerr, file=sys.stderr)
         return 1
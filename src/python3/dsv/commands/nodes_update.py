@@ -14,12 +14,14 @@
 #
 
 import csv
+import logging
 import socket
 import sys
 
 import psycopg2
 
 import dsv.common.NodeFlag as dnf
+import dsv.common.NodeIds as dnid
 
 description = 'update Postgres node information.'
 
@@ -327,6 +329,11 @@ def main(args, cfg):
 
         conn.commit()
         conn.close()
+        conn = None
+
+        # Invalidate cached node IDs.
+        version = dnid.NodeIdResolver(pgcfg, cfg['datastore']['node_ids']).reload(new_version=True)
+        logging.info('Node ID snapshot version {} written'.format(version))
         return 0
     except Exception:
         if conn is not None:
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 #
-# Copyright 2018-2019 Internet Corporation for Assigned Names and Numbers.
+# Copyright 2018-2021 Internet Corporation for Assigned Names and Numbers.
 #
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
@@ -38,9 +38,21 @@ def add_args(parser):
                         metavar='SECS')
     parser.add_argument('jobs',
                         nargs='+',
-                        help='the job string to add to the queue',
+                        help='the job string to add to the queue, or - to read '
+                        'job strings from standard input, one per line',
                         metavar='JOB')
 
+def job_strings(jobs):
+    """Generate the job strings, reading from stdin for job '-'."""
+    for job in jobs:
+        if job == '-':
+            for line in sys.stdin:
+                line = line.strip()
+                if line:
+                    yield line
+        else:
+            yield job
+
 def main(args, cfg):
     if args.delay and args.notbefore:
         print('Only one of --delay and --notbefore is allowed.', file=sys.stderr)
@@ -51,6 +63,5 @@ def main(args, cfg):
     else:
         notbefore = args.notbefore
     with dq.QueueContext(cfg, sys.argv[0]).writer() as writer:
-        for job in args.jobs:
-            writer.add(args.queue, job, notbefore=notbefore)
+        writer.add_many(args.queue, job_strings(args.jobs), notbefore=notbefore)
     return 0
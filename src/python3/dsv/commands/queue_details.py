@@ -10,7 +10,8 @@
 #
 # Scan Visualizer incoming directories reporting on current sizes of the
 # C-DNS-TSV, TSV import queue and the number of entries in each
-# error directory.
+# error directory. With the local queue backend, the number of
+# duplicate jobs not queued for each queue is also reported.
 #
 # The reports can be either printed to stdout or posted to
 # a ClickHouse table.
@@ -21,25 +22,15 @@ import pathlib
 import random
 import sys
 
-import psycopg2
-
 import clickhouse_driver
 import clickhouse_driver.errors
 
+import dsv.common.NodeIds as dnid
 import dsv.common.Path as dp
+import dsv.common.Queue as dq
 
 description = 'report on queue sizes and number of error files'
 
-def find_node_id(cur, server_name, node_name):
-    cur.execute('SELECT node.id FROM node '
-                'INNER JOIN node_server ON node_server.id = node.server_id '
-                'WHERE (node_server.name=%(server)s OR '
-                '       node_server.altname=%(server)s) '
-                'AND (node.name=%(node)s OR node.altname=%(node)s)',
-                {'server': server_name, 'node': node_name})
-    res = cur.fetchone()
-    return res[0] if res else None
-
 def count_files(path, dir_pattern, file_pattern):
     """Count files by server/hostname matching the pattern.
 
@@ -114,6 +105,15 @@ def print_node_info(node_info):
                                   err_cdns_pcap=n[7]))
     print(sep_fmt)
 
+def print_duplicates(duplicates):
+    """Print the number of duplicate jobs not queued, by queue.
+
+       duplicates is None if the queue backend doesn't record them."""
+    if duplicates is None:
+        return
+    print('Duplicate jobs not queued: {}'.format(
+        ', '.join('{}:{}'.format(q, n) for q, n in sorted(duplicates.items())) or 'none'))
+
 def store_node_info(node_info, ch_client):
     values = []
     now = datetime.datetime.now()
@@ -172,41 +172,29 @@ def main(args, cfg):
     # no instance in a server (e.g. a server with a few nodes that's
     # never had an error), we won't even have a server record.
     node_info = {}
-    conn = None
-    try:
-        pgcfg = cfg['postgres']
-        conn = psycopg2.connect(host=pgcfg['host'],
-                                dbname=pgcfg['database'],
-                                user=pgcfg['user'],
-                                password=pgcfg['password'])
-
-        with conn.cursor() as cur:
-            for server in cdns_incoming:
-                if server not in node_info:
-                    node_info[server] = {}
-                for node in cdns_incoming[server]:
-                    node_id = find_node_id(cur, server, node)
-                    if node_id is None:
-                        logging.warning('Server {server} node {node} not found in nodes.csv'.format(
-                            server=server, node=node))
-                    node_info[server][node] = (
-                        node_id,
-                        count(cdns_incoming, server, node),
-                        count(cdns_pending, server, node),
-                        count(tsv_pending, server, node),
-                        count(pcap_pending, server, node),
-                        count(error_cdns_to_tsv, server, node),
-                        count(error_import_tsv, server, node),
-                        count(error_cdns_to_pcap, server, node),
-                    )
-    except Exception:
-        if conn is not None:
-            conn.rollback()
-            conn.close()
-        raise
+    resolver = dnid.NodeIdResolver(cfg['postgres'], datastore_cfg['node_ids'])
+    for server in cdns_incoming:
+        if server not in node_info:
+            node_info[server] = {}
+        for node in cdns_incoming[server]:
+            node_id = resolver.node_id(server, node)
+            if node_id is None:
+                logging.warning('Server {server} node {node} not found in nodes.csv'.format(
+                    server=server, node=node))
+            node_info[server][node] = (
+                node_id,
+                count(cdns_incoming, server, node),
+                count(cdns_pending, server, node),
+                count(tsv_pending, server, node),
+                count(pcap_pending, server, node),
+                count(error_cdns_to_tsv, server, node),
+                count(error_import_tsv, server, node),
+                count(error_cdns_to_pcap, server, node),
+            )
 
     if args.print:
         print_node_info(node_info)
+        print_duplicates(dq.QueueContext(cfg, sys.argv[0]).duplicates())
 
     if args.store:
         clickhouse = cfg['clickhouse']
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Rebuild or verify the datastore scan index.
+
+import logging
+import pathlib
+import sys
+
+import dsv.common.Lock as dl
+import dsv.common.Path as dp
+import dsv.common.ScanIndex as dsi
+
+description = 'rebuild or verify the datastore scan index.'
+
+def datastore_dirs(path):
+    """Generate all datastore directories that may be scanned."""
+    for pattern in ['*/*/*', '*/*/*/' + dp.PENDING_DIR]:
+        for dpath in pathlib.Path(path).glob(pattern):
+            if dpath.is_dir():
+                try:
+                    dp.DSVPath(dpath)
+                    yield dpath
+                except dp.UnknownDirError:
+                    pass
+
+def rebuild(index, path, verbose):
+    index.clear()
+    ndirs = 0
+    nfiles = 0
+    for dpath in datastore_dirs(path):
+        n = len(index.listing(dpath))
+        if verbose:
+            print('{}: {} files'.format(dpath, n))
+        ndirs += 1
+        nfiles += n
+    logging.info('Scan index rebuilt, {} directories, {} files'.format(ndirs, nfiles))
+    print('Scan index rebuilt, {} directories, {} files.'.format(ndirs, nfiles))
+    return 0
+
+def verify(index, verbose):
+    bad = 0
+    for dpath in index.directories():
+        added, removed = index.verify(dpath)
+        if added or removed:
+            bad += 1
+            print('{}: {} files not indexed, {} indexed files missing'.format(
+                dpath, len(added), len(removed)))
+            if verbose:
+                for name in sorted(added):
+                    print('  + {}'.format(name))
+                for name in sorted(removed):
+                    print('  - {}'.format(name))
+        elif verbose:
+            print('{}: OK'.format(dpath))
+    if bad:
+        print('Scan index out of date in {} directories.'.format(bad))
+        return 1
+    print('Scan index OK.')
+    return 0
+
+def add_args(parser):
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--rebuild',
+                        dest='rebuild', action='store_true', default=False,
+                        help='discard the index contents and rescan the datastore')
+    action.add_argument('--verify',
+                        dest='verify', action='store_true', default=False,
+                        help='check the index contents against the datastore')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true', default=False,
+                        help='enable verbosity')
+
+def main(args, cfg):
+    datastore_cfg = cfg['datastore']
+
+    try:
+        user = dl.DSVUser(datastore_cfg['user'])
+        user.ensure_user()
+    except dl.WrongUserException as e:
+        logging.error(str(e))
+        print(str(e), file=sys.stderr)
+        return 1
+
+    if not datastore_cfg['scan_index']:
+        print('No scan index configured.', file=sys.stderr)
+        return 1
+
+    with dsi.ScanIndex(datastore_cfg['scan_index']) as index:
+        if args.rebuild:
+            return rebuild(index, datastore_cfg['path'], args.verbose)
+        return verify(index, args.verbose)
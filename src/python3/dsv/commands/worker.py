@@ -14,64 +14,101 @@
 # 0 = Success. Delete input file, move on to next job.
 # 1 = Failure. Move input file to ..<node>/failed, move on to next job.
 # 2 = Transient failure. Re-enter job in queue, sleep for delay period,
-#     move on to next job.
+#     move on to next job. If the job output gives a time before which
+#     it is not to be run, the job has been deferred, not failed; re-enter
+#     it in the queue to run after that time, without counting a retry,
+#     and move on to the next job.
 # 3 = Success. Move on to next job, but don't attempt to delete the file.
 # Any other exit code is an infrastructure exit. Log and quit.
 #
-# All jobs are run by executing a script named <queue-name>.sh.
+# Jobs on the standard queues are run in-process by the handlers in
+# dsv.common.JobHandlers. Other jobs, or all jobs if --external is given,
+# are run by executing a command named dsv-<queue-name>.
 
+import argparse
+import asyncio
+import collections
+import concurrent.futures
 import datetime
 import logging
+import math
 import pathlib
 import subprocess
 import sys
 import time
 
+import dsv.common.Concurrency as dc
+import dsv.common.DelayedJobs as ddj
+import dsv.common.JobHandlers as djh
+import dsv.common.JobStats as djs
 import dsv.common.Lock as dl
 import dsv.common.Path as dp
 import dsv.common.Queue as dq
 
 description = 'process Visualizer jobs.'
 
-def queue_delayed_jobs(qcontext, delayed_jobs_list):
-    if not delayed_jobs_list:
-        return []
-
-    now = datetime.datetime.now()
-    remaining = []
-    for job in delayed_jobs_list:
-        queue, arg, notbefore = job
-        if now >= notbefore:
-            with qcontext.writer() as writer:
-                writer.add(queue, arg, dq.JobPrecedence.high)
-        else:
-            remaining.append(job)
-    return remaining
+def queue_delayed_jobs(writer, delayed_jobs):
+    """Re-queue any delayed jobs that are now due."""
+    due = delayed_jobs.take_due()
+    if not due:
+        return
+    by_queue = collections.OrderedDict()
+    for queue, arg, _ in due:
+        by_queue.setdefault(queue, []).append(arg)
+    try:
+        for queue, qargs in by_queue.items():
+            logging.debug('Re-queue {n} delayed jobs to {queue}'.format(
+                n=len(qargs), queue=queue))
+            # Not unique, so a due job isn't merged with a job queued
+            # for the same file at a lower precedence.
+            writer.add_many(queue, qargs, dq.JobPrecedence.high, unique=False)
+    except Exception:
+        # Put the jobs back so they aren't lost. A job may be queued
+        # twice if only some were submitted; that is safer than losing it.
+        for job in due:
+            delayed_jobs.add(*job)
+        raise
 
-def save_delayed_jobs(qcontext, delayed_jobs_list):
-    for job in delayed_jobs_list:
-        queue, arg, notbefore = job
-        with qcontext.writer() as writer:
-            writer.add(queue, arg, dq.JobPrecedence.high, notbefore=notbefore)
+def save_delayed_jobs(writer, delayed_jobs):
+    """Return delayed jobs held only in memory to the queue."""
+    if delayed_jobs.durable:
+        return
+    for queue, arg, notbefore in delayed_jobs.jobs():
+        writer.add(queue, arg, dq.JobPrecedence.high, notbefore=notbefore)
 
-def execute_job(qcontext, args, job, delayed_jobs_list):
-    process = 'dsv-' + job.queue
+def delayed_wait(delayed_jobs, timeout=None):
+    """Return how long to wait, up to timeout, before the next delayed
+       job is due. Return None if there is no limit on the wait."""
+    due = delayed_jobs.next_due()
+    if due is None:
+        return timeout
+    wait = max((due - datetime.datetime.now()).total_seconds(), 0)
+    return wait if timeout is None else min(wait, timeout)
+
+def start_job(job, delayed_jobs):
+    """Examine a new job.
+
+       If the job is not to be run yet, add it to the delayed jobs and
+       return None. Otherwise return the job argument and retry count."""
     arg, notbefore, retry_count = job.arg
     if notbefore:
         logging.debug('From {queue} delay {arg} until {notbefore}'.format(
             queue=job.queue, arg=arg, notbefore=notbefore))
-        delayed_jobs_list.append((job.queue, arg, notbefore))
+        delayed_jobs.add(job.queue, arg, notbefore)
         job.done()
-        return
+        return None
 
-    logging.debug('From {queue} run {process} {arg} try {retry}'.format(
-        queue=job.queue, process=process, arg=arg, retry=retry_count))
+    logging.debug('From {queue} run dsv-{queue} {arg} try {retry}'.format(
+        queue=job.queue, arg=arg, retry=retry_count))
+    return (arg, retry_count)
 
-    t_start = time.perf_counter()
-    res = subprocess.run([process, arg],
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE,
-                         check=False)
+def complete_job(writer, args, job, arg, retry_count, res, t_start):
+    """Act on the result of running a job.
+
+       Return True if the job had a transient failure and has been
+       re-queued, in which case the caller should delay before
+       running the same slot again."""
+    process = 'dsv-' + job.queue
     if res.returncode == 0 or res.returncode == 3:
         logging.debug('{process} {arg} OK, {runtime:0.3f}s'.format(
             process=process, arg=arg,
@@ -80,6 +117,14 @@ def execute_job(qcontext, args, job, delayed_jobs_list):
         if res.returncode == 0 and p.exists():
             p.unlink()
         job.done()
+    elif djh.not_before(res):
+        notbefore = djh.not_before(res)
+        logging.info('{process} {arg} deferred until {notbefore}: {reason}'.format(
+            process=process, arg=arg, notbefore=notbefore,
+            reason=res.stderr.decode().rstrip()))
+        job.done()
+        writer.add(job.queue, arg, notbefore=notbefore, retry_count=retry_count,
+                   size=job.size, node_id=job.node_id)
     elif res.returncode == 1 or (res.returncode == 2 and retry_count >= args.max_retries):
         logging.error('{process} {arg} failed, {runtime:0.3f}s'.format(
             process=process, arg=arg,
@@ -104,9 +149,9 @@ def execute_job(qcontext, args, job, delayed_jobs_list):
         logging.error('Stderr: {stderr}'.format(
             stderr=res.stderr.decode().rstrip()))
         job.failed()
-        with qcontext.writer() as writer:
-            writer.add(job.queue, arg, retry_count=retry_count + 1)
-        time.sleep(args.fail_delay)
+        writer.add(job.queue, arg, retry_count=retry_count + 1,
+                   size=job.size, node_id=job.node_id)
+        return True
     else:
         logging.error('Infrastructure error')
         logging.error('Stdout: {stdout}'.format(
@@ -114,6 +159,285 @@ def execute_job(qcontext, args, job, delayed_jobs_list):
         logging.error('Stderr: {stderr}'.format(
             stderr=res.stderr.decode().rstrip()))
         raise OSError('Infrastructure error exit code')
+    return False
+
+def job_size(job, arg):
+    """Return the size of the job file, from the job payload if known."""
+    return job.size if job.size is not None else djs.file_size(arg)
+
+def record_job(stats, job, arg, retry_count, size, started, t_start, res):
+    """Record statistics for a completed job, if recording."""
+    if stats:
+        stats.record(job.queue, arg, retry_count, size, job.queued, started,
+                     time.perf_counter() - t_start, res, job.node_id)
+
+def execute_job(writer, args, job, delayed_jobs, handler_context=None, stats=None):
+    started = start_job(job, delayed_jobs)
+    if not started:
+        return
+    arg, retry_count = started
+    size = job_size(job, arg) if stats else 0
+    t_started = datetime.datetime.now()
+    t_start = time.perf_counter()
+    res = djh.run_job(handler_context, job.queue, arg, retry_count)
+    record_job(stats, job, arg, retry_count, size, t_started, t_start, res)
+    if complete_job(writer, args, job, arg, retry_count, res, t_start):
+        time.sleep(args.fail_delay)
+
+# Interval, in seconds, between reports of slot utilisation.
+SLOT_REPORT_INTERVAL = 60
+
+class SlotUsage:
+    """Track how busy the job slots are.
+
+       Record the number of busy slots whenever it changes, and
+       accumulate busy slot time so average utilisation can be
+       reported."""
+    def __init__(self, slots, queues):
+        self._slots = slots
+        self.running = collections.OrderedDict((q, 0) for q in queues)
+        self._busy_time = 0.0
+        self._jobs = 0
+        self._since = self._last = time.monotonic()
+
+    @property
+    def busy(self):
+        return sum(self.running.values())
+
+    def _update(self):
+        now = time.monotonic()
+        self._busy_time += self.busy * (now - self._last)
+        self._last = now
+
+    def start(self, queue):
+        self._update()
+        self.running[queue] = self.running.get(queue, 0) + 1
+
+    def finish(self, queue):
+        self._update()
+        self.running[queue] -= 1
+        self._jobs += 1
+
+    def report(self):
+        """Return the utilisation since the last report, and reset."""
+        self._update()
+        elapsed = self._last - self._since
+        util = self._busy_time / (elapsed * self._slots) if elapsed > 0 else 0.0
+        res = 'Slots {busy}/{slots} busy ({running}), {util:0.1%} utilisation, ' \
+              '{jobs} jobs in {elapsed:0.0f}s'.format(
+                  busy=self.busy, slots=self._slots,
+                  running=', '.join('{}:{}'.format(q, n) for q, n in self.running.items()),
+                  util=util, jobs=self._jobs, elapsed=elapsed)
+        self._busy_time = 0.0
+        self._jobs = 0
+        self._since = self._last
+        return res
+
+# Percentiles of the time jobs wait on their queue to report.
+WAIT_PERCENTILES = [50, 90, 99]
+
+class WaitStats:
+    """Collect the time jobs wait on their queue, by queue and
+       precedence, and report percentiles, so queue weights and
+       promotion can be tuned."""
+    def __init__(self):
+        self._waits = collections.defaultdict(list)
+
+    def record(self, job, now=None):
+        """Record the wait of a job about to run, if its queued time is known."""
+        if job.queued is None:
+            return
+        now = now or datetime.datetime.now()
+        precedence = job.precedence.name if job.precedence else '-'
+        self._waits[(job.queue, precedence)].append(
+            max((now - job.queued).total_seconds(), 0.0))
+
+    def report(self):
+        """Return the wait percentiles since the last report, or None if
+           no waits were recorded, and reset."""
+        classes = []
+        for (queue, precedence), waits in sorted(self._waits.items()):
+            waits.sort()
+            classes.append('{}/{} {} jobs {}'.format(
+                queue, precedence, len(waits),
+                ' '.join('p{}:{:0.1f}s'.format(p, waits[math.ceil(p * len(waits) / 100) - 1])
+                         for p in WAIT_PERCENTILES)))
+        self._waits.clear()
+        return 'Queue waits ' + ', '.join(classes) if classes else None
+
+async def run_job_async(loop, executor, handler_context, queue, arg, retry_count):
+    """Run a job, without blocking the event loop.
+
+       External commands are run as asyncio subprocesses. In-process
+       handlers are run in the executor."""
+    if handler_context and queue in djh.HANDLERS:
+        return await loop.run_in_executor(executor, djh.run_job,
+                                          handler_context, queue, arg, retry_count)
+    proc = await asyncio.create_subprocess_exec('dsv-' + queue, arg,
+                                                stdout=asyncio.subprocess.PIPE,
+                                                stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await proc.communicate()
+    return subprocess.CompletedProcess(['dsv-' + queue, arg], proc.returncode, stdout, stderr)
+
+async def slot_job(loop, executor, writer, args, job, delayed_jobs, handler_contexts,
+                   stats=None):
+    """Run a job in a slot. Return the job runtime, or None if the job
+       was not run."""
+    started = start_job(job, delayed_jobs)
+    if not started:
+        return None
+    arg, retry_count = started
+    size = job_size(job, arg) if stats else 0
+    handler_context = handler_contexts.pop() if handler_contexts else None
+    try:
+        t_started = datetime.datetime.now()
+        t_start = time.perf_counter()
+        res = await run_job_async(loop, executor, handler_context, job.queue, arg,
+                                  retry_count)
+    finally:
+        if handler_context:
+            handler_contexts.append(handler_context)
+    runtime = time.perf_counter() - t_start
+    await loop.run_in_executor(executor, record_job,
+                               stats, job, arg, retry_count, size, t_started, t_start, res)
+    if await loop.run_in_executor(executor, complete_job,
+                                  writer, args, job, arg, retry_count, res, t_start):
+        await asyncio.sleep(args.fail_delay)
+    return runtime
+
+def sample_signals(qcontext, monitor):
+    """Sample the signals used to control concurrency."""
+    try:
+        waiting = {q[0]: q[1] - q[2] for q in qcontext.status()}
+    except Exception as err:    # pylint: disable=broad-except
+        logging.warning('Queue status unavailable: {}'.format(err))
+        waiting = {}
+    max_parts, merges = monitor.sample() if monitor else (None, None)
+    return dc.Signals(dc.host_load(), max_parts, merges, waiting)
+
+async def run_slots(loop, qcontext, args, reader, writer, delayed_jobs, to_register, limits,
+                    handler_contexts, controller=None, monitor=None, control_interval=None,
+                    watcher=None, stats=None, fairshare=None):
+    """Run up to args.slots jobs at once.
+
+       Don't take jobs from a queue already running its limit of jobs.
+       If a FairShare is given, it sets the order queues are checked.
+       If a concurrency controller is given, the limits are set by the
+       controller, updated every control_interval seconds.
+       If a freeze watcher is given, wait for it to report changes in
+       the queues to take jobs from. Otherwise check every second.
+       Run until an infrastructure error occurs."""
+    # One thread to wait for jobs, one to sample signals, plus one per slot.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.slots + 2)
+    usage = SlotUsage(args.slots, limits.keys())
+    queue_waits = WaitStats()
+    tasks = {}
+    registered = None
+    next_report = time.monotonic() + SLOT_REPORT_INTERVAL
+    next_control = time.monotonic()
+    changed = None
+    if watcher:
+        changed = loop.create_future()
+
+        def freeze_changed():
+            reader.interrupt()
+            loop.call_soon_threadsafe(lambda: changed.done() or changed.set_result(None))
+
+        watcher.add_listener(freeze_changed)
+
+    def wake_timeout():
+        """Return the time until the next scheduled action."""
+        now = time.monotonic()
+        timeout = next_report - now
+        if controller:
+            timeout = min(timeout, next_control - now)
+        if not watcher:
+            timeout = min(timeout, 1)
+        return max(delayed_wait(delayed_jobs, timeout), 0)
+
+    try:
+        while True:
+            queue_delayed_jobs(writer, delayed_jobs)
+
+            for task in [t for t in tasks if t.done()]:
+                queue = tasks.pop(task)
+                usage.finish(queue)
+                err = task.exception()
+                if err:
+                    if isinstance(err, OSError):
+                        logging.error('execution process error {err}'.format(err=err))
+                        return
+                    raise err
+                if controller and task.result() is not None:
+                    controller.record(queue, task.result())
+
+            if controller and time.monotonic() >= next_control:
+                signals = await loop.run_in_executor(executor, sample_signals,
+                                                     qcontext, monitor)
+                limits = controller.update(signals, usage.running)
+                next_control = time.monotonic() + control_interval
+
+            if time.monotonic() >= next_report:
+                report = usage.report()
+                if controller:
+                    report += ', limits {}'.format(
+                        ', '.join('{}:{}'.format(q, n) for q, n in limits.items()))
+                logging.info(report)
+                report = queue_waits.report()
+                if report:
+                    logging.info(report)
+                next_report += SLOT_REPORT_INTERVAL
+
+            available = [q for q in to_register()
+                         if limits.get(q) is None or usage.running.get(q, 0) < limits[q]]
+            if fairshare:
+                available = fairshare.registration(available, registered)
+            if changed and changed.done():
+                changed = loop.create_future()
+
+            if len(tasks) < args.slots and available:
+                if available != registered:
+                    reader.register_clear()
+                    for q in available:
+                        reader.register(q)
+                    registered = available
+                job = await loop.run_in_executor(executor, reader.get, wake_timeout())
+                if job:
+                    usage.start(job.queue)
+                    if fairshare:
+                        fairshare.started(job.queue, registered)
+                    if not job.arg[1]:
+                        queue_waits.record(job)
+                    task = loop.create_task(slot_job(loop, executor, writer, args, job,
+                                                     delayed_jobs, handler_contexts, stats))
+                    # A free slot may change the queues to take jobs from.
+                    task.add_done_callback(lambda _: reader.interrupt())
+                    tasks[task] = job.queue
+            else:
+                waits = list(tasks) + ([changed] if changed else [])
+                if waits:
+                    await asyncio.wait(waits, timeout=wake_timeout(),
+                                       return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(wake_timeout())
+    finally:
+        # Stop waiting for a job.
+        reader.interrupt()
+        if tasks:
+            # Let running jobs complete.
+            await asyncio.wait(list(tasks))
+        save_delayed_jobs(writer, delayed_jobs)
+        executor.shutdown()
+
+def queue_limit_arg(arg):
+    """Parse a QUEUE=N queue limit argument."""
+    queue, sep, limit = arg.partition('=')
+    try:
+        if not sep or int(limit) < 0:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError('{} is not QUEUE=N'.format(arg))
+    return (queue, int(limit))
 
 def add_args(parser):
     parser.add_argument('--fail-delay', '--fail_delay',
@@ -128,6 +452,21 @@ def add_args(parser):
                         dest='ignore_queue', action='append',
                         help='do not process jobs on the named queue',
                         metavar='QUEUE')
+    parser.add_argument('--external',
+                        dest='external', action='store_true', default=False,
+                        help='run all jobs with the external dsv-<queue> commands')
+    parser.add_argument('--slots',
+                        dest='slots', action='store', type=int, default=1,
+                        help='the maximum number of jobs to run at once',
+                        metavar='SLOTS')
+    parser.add_argument('--queue-limit',
+                        dest='queue_limit', action='append', type=queue_limit_arg,
+                        help='with multiple slots, run at most N jobs from QUEUE at once',
+                        metavar='QUEUE=N')
+    parser.add_argument('--adaptive',
+                        dest='adaptive', action='store_true', default=False,
+                        help='with multiple slots, adjust the jobs run from each queue '
+                        'according to system load')
 
 def main(args, cfg):
     datastore_cfg = cfg['datastore']
@@ -140,41 +479,146 @@ def main(args, cfg):
         print(str(e), file=sys.stderr)
         return 1
 
-    qcontext = dq.QueueContext(cfg, sys.argv[0])
-
     # Note: Order of registration is important. The last registered
     # queue is checked for jobs first. If none are on that queue, the
     # next most recently registered queue is checked, etc.
     queues = datastore_cfg['queues'].split(',')
+
+    if args.slots < 1:
+        print('Error: --slots must be at least 1', file=sys.stderr)
+        return 1
+    if args.adaptive and args.slots < 2:
+        print('Error: --adaptive needs --slots of at least 2', file=sys.stderr)
+        return 1
+    limits = collections.OrderedDict((q, None) for q in queues)
+    for queue, limit in args.queue_limit or []:
+        if queue not in limits:
+            print('Error: unknown queue {}'.format(queue), file=sys.stderr)
+            return 1
+        limits[queue] = limit
+
+    try:
+        weights = dc.parse_weights(cfg['worker']['queue-weights'])
+    except ValueError as err:
+        print('Error: bad queue-weights: {}'.format(err), file=sys.stderr)
+        return 1
+    for queue in weights:
+        if queue not in limits:
+            print('Error: unknown queue {} in queue-weights'.format(queue), file=sys.stderr)
+            return 1
+    fairshare = dc.FairShare(weights) if weights else None
+
+    qcontext = dq.QueueContext(cfg, sys.argv[0])
+
     queue_locks = {}
     for q in queues:
         queue_locks[q] = dl.DSVLock(datastore_cfg['user'], datastore_cfg['lockfile'].format(q))
-    with qcontext.reader() as reader:
-        delayed_jobs_list = []
-        try:
-            while True:
-                delayed_jobs_list = queue_delayed_jobs(qcontext, delayed_jobs_list)
 
-                # Assess lock status.
-                to_register = []
-                for q in queues:
-                    if (not args.ignore_queue or q not in args.ignore_queue) and \
-                       not queue_locks[q].is_frozen():
-                        to_register.append(q)
+    watcher = dl.FreezeWatcher(queue_locks)
 
-                if to_register:
-                    reader.register_clear()
-                    for q in to_register:
-                        reader.register(q)
-                    job = reader.get()
+    def to_register():
+        """Return the queues to take jobs from, in registration order."""
+        frozen = watcher.frozen
+        return [q for q in queues
+                if (not args.ignore_queue or q not in args.ignore_queue) and
+                q not in frozen]
+
+    with qcontext.reader() as reader, qcontext.writer() as writer, \
+         ddj.DelayedJobs(datastore_cfg['delayed_jobs']) as delayed_jobs, watcher:
+        if args.external:
+            handler_contexts = []
+        else:
+            handler_contexts = [djh.HandlerContext(cfg, writer) for _ in range(args.slots)]
+        worker_cfg = cfg['worker']
+        stats = None
+        if worker_cfg['job-stats']:
+            stats = djs.JobStatsRecorder(djh.HandlerContext(cfg, None),
+                                         int(worker_cfg['job-stats-batch']),
+                                         float(worker_cfg['job-stats-interval']))
+        try:
+            if args.slots > 1:
+                controller = None
+                monitor = None
+                control_interval = None
+                if args.adaptive:
+                    controller = dc.ConcurrencyController(
+                        args.slots, limits,
+                        float(worker_cfg['load-high']),
+                        int(worker_cfg['parts-high']),
+                        int(worker_cfg['parts-max']),
+                        int(worker_cfg['merges-high']))
+                    monitor = dc.ClickHouseMonitor(cfg['clickhouse'])
+                    control_interval = float(worker_cfg['control-interval'])
+                loop = asyncio.new_event_loop()
+                # Set as the current loop, so on older Pythons the child
+                # watcher used by subprocesses is attached to it.
+                asyncio.set_event_loop(loop)
+                try:
+                    slots_task = loop.create_task(run_slots(loop, qcontext, args, reader,
+                                                            writer, delayed_jobs,
+                                                            to_register, limits,
+                                                            handler_contexts, controller,
+                                                            monitor, control_interval,
+                                                            watcher, stats, fairshare))
                     try:
-                        if job:
-                            execute_job(qcontext, args, job, delayed_jobs_list)
-                    except OSError as ose:
-                        logging.error('execution process error {err}'.format(err=ose))
-                        break
-                else:
-                    time.sleep(1)
-        except KeyboardInterrupt:
-            save_delayed_jobs(qcontext, delayed_jobs_list)
-            raise
+                        loop.run_until_complete(slots_task)
+                    except KeyboardInterrupt:
+                        # Let running jobs finish and delayed jobs be saved.
+                        slots_task.cancel()
+                        loop.run_until_complete(asyncio.wait([slots_task]))
+                        raise
+                finally:
+                    asyncio.set_event_loop(None)
+                    loop.close()
+                    if monitor:
+                        monitor.close()
+                return
+
+            handler_context = handler_contexts[0] if handler_contexts else None
+            watcher.add_listener(reader.interrupt)
+            registered = None
+            queue_waits = WaitStats()
+            next_report = time.monotonic() + SLOT_REPORT_INTERVAL
+            try:
+                while True:
+                    queue_delayed_jobs(writer, delayed_jobs)
+                    if time.monotonic() >= next_report:
+                        report = queue_waits.report()
+                        if report:
+                            logging.info(report)
+                        next_report += SLOT_REPORT_INTERVAL
+
+                    # Only change registration when the frozen queues
+                    # or the fair share order change.
+                    registering = to_register()
+                    if fairshare:
+                        registering = fairshare.registration(registering, registered)
+                    if registering != registered:
+                        reader.register_clear()
+                        for q in registering:
+                            reader.register(q)
+                        registered = registering
+                    if registering:
+                        job = reader.get(delayed_wait(delayed_jobs,
+                                                      max(next_report - time.monotonic(), 0)))
+                        try:
+                            if job:
+                                if fairshare:
+                                    fairshare.started(job.queue, registered)
+                                if not job.arg[1]:
+                                    queue_waits.record(job)
+                                execute_job(writer, args, job, delayed_jobs,
+                                            handler_context, stats)
+                        except OSError as ose:
+                            logging.error('execution process error {err}'.format(err=ose))
+                            break
+                    else:
+                        watcher.wait(delayed_wait(delayed_jobs))
+            except KeyboardInterrupt:
+                save_delayed_jobs(writer, delayed_jobs)
+                raise
+        finally:
+            for handler_context in handler_contexts:
+                handler_context.close()
+            if stats:
+                stats.close()
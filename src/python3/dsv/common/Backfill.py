@@ -0,0 +1,180 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Gradual queueing of jobs for historical data.
+#
+# Queueing all the files in a large datastore at once can delay the
+# processing of new files for a long time. A backfill instead keeps
+# the queue topped up to a target depth, recording its progress in a
+# checkpoint so an interrupted backfill can resume where it left off.
+
+import datetime
+import itertools
+import json
+import logging
+import os.path
+import pathlib
+import time
+
+import dsv.common.Lock as dl
+import dsv.common.Queue as dq
+
+class BackfillCheckpoint:
+    """Record of backfill progress, so an interrupted backfill can resume.
+
+       Files are taken from each node directory in reverse name order,
+       so progress is recorded as the name of the last file seen in
+       each directory. The checkpoint is only used to resume a backfill
+       with the same key, that is the same source and date range."""
+    def __init__(self, path, key):
+        self._path = pathlib.Path(path)
+        self._key = key
+        self._last = {}
+        self._found = 0
+        self.queued = 0
+        # The number of files to check, including those seen in any
+        # previous run, once all the directories have been read, and
+        # the number checked so far.
+        self.total = None
+        self.checked = 0
+        try:
+            with self._path.open() as f:
+                saved = json.load(f)
+            if saved['key'] == key:
+                self._last = saved['last']
+                self.queued = saved['queued']
+            else:
+                logging.info('Backfill checkpoint {} is for a different backfill, ignoring'.format(
+                    self._path))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            logging.warning('Backfill checkpoint {} unreadable, ignoring: {}'.format(
+                self._path, err))
+
+    def found(self, n):
+        """Add n files to the total to be checked, or if n is None,
+           record that the total is complete."""
+        if n is None:
+            self.total = self._found
+        else:
+            self._found += n
+
+    def check(self, f):
+        """Return True if the file has already been seen. Otherwise
+           record it as seen, and return False."""
+        self.checked += 1
+        if self.seen(f):
+            return True
+        self.record(f)
+        return False
+
+    def seen(self, f):
+        """Has the file already been seen?"""
+        dpath, name = os.path.split(str(f))
+        last = self._last.get(dpath)
+        return last is not None and name >= last
+
+    def record(self, f):
+        """Record that the file has been seen."""
+        dpath, name = os.path.split(str(f))
+        self._last[dpath] = name
+
+    def save(self):
+        tmppath = self._path.with_name(self._path.name + '.tmp')
+        with tmppath.open('w') as f:
+            json.dump({'key': self._key, 'queued': self.queued, 'last': self._last}, f)
+        tmppath.replace(self._path)
+
+    def remove(self):
+        try:
+            self._path.unlink()
+        except FileNotFoundError:
+            pass
+
+# Interval, in seconds, between backfill queue checks.
+BACKFILL_POLL_INTERVAL = 10
+
+def backfill(writer, queue, jobs, checkpoint, queue_depth, rate, frozen, verbose):
+    """Top up a queue from jobs until jobs is exhausted.
+
+       Periodically check the queue, and add low priority jobs so at
+       most queue_depth jobs are waiting. If rate is given, add on
+       average no more than rate jobs per second. Don't add jobs while
+       frozen() returns True.
+
+       After each top-up, save the checkpoint and report progress.
+       Progress is reported as the files checked out of the total in
+       the checkpoint, which is unknown until every directory has been
+       read. Return number of jobs queued in this run.
+    """
+    start_queued = checkpoint.queued
+    start = time.monotonic()
+    allowance = 0
+    last = start
+    exhausted = False
+    while not exhausted:
+        now = time.monotonic()
+        if rate:
+            allowance = min(allowance + rate * (now - last), queue_depth)
+        last = now
+        if frozen():
+            logging.debug('Import frozen, backfill paused')
+        else:
+            waiting = sum(q[1] - q[2] for q in writer.status() if q[0] == queue)
+            want = queue_depth - waiting
+            if rate:
+                want = min(want, int(allowance))
+            if want > 0:
+                # Duplicates of jobs already queued are not counted
+                # as added, so check for the end of the jobs directly.
+                batch = list(itertools.islice(jobs, want))
+                n = writer.add_many(queue, batch, dq.JobPrecedence.low) if batch else 0
+                exhausted = len(batch) < want
+                allowance -= n
+                checkpoint.queued += n
+                checkpoint.save()
+            total = checkpoint.total
+            elapsed = time.monotonic() - start
+            if total is not None and checkpoint.checked > 0 and elapsed > 0:
+                eta = datetime.timedelta(seconds=round(
+                    max(total - checkpoint.checked, 0) * elapsed / checkpoint.checked))
+            else:
+                eta = 'unknown'
+            msg = ('Backfill {queue}: {queued} queued, {checked}/{total} files checked, '
+                   '{waiting} waiting, ETA {eta}').format(
+                       queue=queue, queued=checkpoint.queued, checked=checkpoint.checked,
+                       total='unknown' if total is None else total, waiting=waiting, eta=eta)
+            logging.info(msg)
+            if verbose:
+                print(msg)
+        if not exhausted:
+            time.sleep(BACKFILL_POLL_INTERVAL)
+    checkpoint.remove()
+    return checkpoint.queued - start_queued
+
+def process_backfill(writer, datastore_cfg, args, jobs_fn):
+    """Backfill from cbor directory. Return number of files queued.
+
+       jobs_fn generates the jobs for the source, and is called with
+       the datastore path, file pattern, date range, verbose and dry
+       run flags and the checkpoint."""
+    queue = 'cdns-to-tsv' if args.source == 'cbor' else 'cdns-to-pcap'
+    key = '{}|{}|{}'.format(args.source, args.from_date or '', args.to_date or '')
+    checkpoint = BackfillCheckpoint(
+        datastore_cfg['backfill_checkpoint'].format(args.source), key)
+    if checkpoint.queued:
+        logging.info('Resuming backfill, {} files already queued'.format(checkpoint.queued))
+    path = datastore_cfg['path']
+    file_pattern = datastore_cfg['cdns_file_pattern']
+    import_lock = dl.DSVLock(datastore_cfg['user'], datastore_cfg['lockfile'].format('import'))
+    return backfill(writer, queue,
+                    jobs_fn(path, file_pattern, args.from_date, args.to_date,
+                            args.verbose, False, checkpoint),
+                    checkpoint, args.queue_depth, args.rate,
+                    import_lock.is_frozen, args.verbose)
@@ -0,0 +1,324 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Adaptive control of the number of jobs a worker runs at once.
+#
+# The controller keeps a limit on the number of jobs running from each
+# queue. At regular intervals it samples the state of the system and
+# adjusts the limits. Limits are raised by one while the queue has
+# waiting jobs, all its slots are in use, and there are no signs of
+# pressure. On signs of pressure, limits are halved. This is the same
+# additive increase, multiplicative decrease scheme TCP uses, and
+# like TCP keeps throughput close to what the system can sustain.
+#
+# Signs of pressure are:
+# * Host load average per CPU above a threshold. This applies to
+#   queues whose jobs are CPU bound on the worker host.
+# * The largest number of active parts in any ClickHouse partition
+#   above a threshold. This applies to queues inserting into
+#   ClickHouse. If ClickHouse accumulates too many parts in a
+#   partition, it first delays and then rejects inserts. Above a
+#   second, higher, threshold, inserts are stopped until merges
+#   catch up.
+# * The number of merges in progress on the ClickHouse servers at or
+#   above a threshold, if one is set. This also applies to queues
+#   inserting into ClickHouse; a merge backlog means parts are being
+#   added faster than ClickHouse can combine them.
+# * The recent average job runtime on a queue rising well above the
+#   lowest recent average. For inserting queues, this is mostly
+#   ClickHouse insert latency.
+#
+# Individual imports are also paced. Before inserting, an import checks
+# the same ClickHouse part and merge counts, and if they are over a
+# threshold it is deferred until later, rather than adding parts that
+# ClickHouse can't merge. With no pressure, imports run at full speed.
+#
+# Which queue a worker takes its next job from is set by the order the
+# queues are registered, the last registered being checked first. With
+# a fixed order, jobs on the first queues can wait indefinitely while
+# later queues are busy. Given queue weights, the order is instead
+# changed as jobs are taken, so over time each busy queue gets a share
+# of jobs in proportion to its weight. Changing the order means
+# registering every queue again, so unless the queues themselves
+# change, the order is only changed every few seconds.
+
+import collections
+import datetime
+import logging
+import os
+import random
+import time
+
+import clickhouse_driver
+import clickhouse_driver.errors
+
+import dsv.common.Shards as dsh
+
+# Queues whose jobs insert into ClickHouse. Jobs on other queues are
+# taken to be CPU bound.
+CLICKHOUSE_QUEUES = ['import-tsv']
+
+# Weight given to each new job runtime in the runtime average.
+RUNTIME_ALPHA = 0.2
+
+# The factor by which the runtime average may exceed the lowest
+# recent average before indicating pressure.
+RUNTIME_SLOWDOWN = 2.0
+
+# The factor by which the lowest recent average rises every update,
+# so the baseline follows lasting changes in job size.
+BASELINE_DRIFT = 1.02
+
+Signals = collections.namedtuple('Signals', ['load', 'max_parts', 'merges', 'waiting'])
+
+class ConcurrencyController:
+    def __init__(self, slots, maxima, load_high, parts_high, parts_max, merges_high=0):
+        """Create a controller.
+
+           maxima gives, for each queue in registration order, the
+           maximum limit, or None if the limit is only bounded by the
+           number of slots. A merges_high of 0 means merges are not
+           checked."""
+        self._slots = slots
+        self._maxima = collections.OrderedDict(
+            (q, slots if m is None else min(m, slots)) for q, m in maxima.items())
+        self._load_high = load_high
+        self._parts_high = parts_high
+        self._parts_max = parts_max
+        self._merges_high = merges_high
+        self.limits = collections.OrderedDict((q, min(1, m)) for q, m in self._maxima.items())
+        self._runtime = {}
+        self._baseline = {}
+
+    def record(self, queue, runtime):
+        """Record the runtime of a completed job."""
+        if queue in self._runtime:
+            self._runtime[queue] += RUNTIME_ALPHA * (runtime - self._runtime[queue])
+        else:
+            self._runtime[queue] = runtime
+
+    def _pressure(self, queue, signals):
+        """Return the reason the queue is under pressure, or None."""
+        if queue in CLICKHOUSE_QUEUES:
+            if signals.max_parts is not None and signals.max_parts >= self._parts_high:
+                return 'ClickHouse parts {}'.format(signals.max_parts)
+            if self._merges_high and signals.merges is not None and \
+               signals.merges >= self._merges_high:
+                return 'ClickHouse merges {}'.format(signals.merges)
+        elif signals.load is not None and signals.load > self._load_high:
+            return 'load {:0.2f}'.format(signals.load)
+        runtime = self._runtime.get(queue)
+        baseline = self._baseline.get(queue)
+        if runtime is not None and baseline and runtime > RUNTIME_SLOWDOWN * baseline:
+            return 'runtime {:0.2f}s'.format(runtime)
+        return None
+
+    def update(self, signals, running):
+        """Adjust the limits given the latest signals and the number
+           of jobs running on each queue. Return the new limits."""
+        for queue, maximum in self._maxima.items():
+            runtime = self._runtime.get(queue)
+            if runtime is not None:
+                baseline = self._baseline.get(queue)
+                if baseline is None or runtime < baseline:
+                    self._baseline[queue] = runtime
+                else:
+                    self._baseline[queue] = baseline * BASELINE_DRIFT
+
+            limit = self.limits[queue]
+            reason = self._pressure(queue, signals)
+            if queue in CLICKHOUSE_QUEUES and signals.max_parts is not None and \
+               signals.max_parts >= self._parts_max:
+                new_limit = 0
+            elif reason:
+                new_limit = max(limit // 2, min(1, maximum))
+            elif signals.waiting.get(queue, 0) > 0 and running.get(queue, 0) >= limit:
+                new_limit = min(limit + 1, maximum)
+            else:
+                new_limit = max(limit, min(1, maximum))
+            if new_limit != limit:
+                logging.info('Queue {queue} limit {old} -> {new}{reason}'.format(
+                    queue=queue, old=limit, new=new_limit,
+                    reason=' ({})'.format(reason) if reason else ''))
+                self.limits[queue] = new_limit
+        return self.limits
+
+def host_load():
+    """Return the 1 minute load average per CPU."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+class ClickHouseMonitor:
+    """Sample part and merge counts from ClickHouse servers."""
+    def __init__(self, chcfg):
+        self._database = chcfg['database']
+        self._servers = dsh.servers(chcfg)
+        self._clients = [clickhouse_driver.Client(host=server,
+                                                  user=chcfg['user'],
+                                                  password=chcfg['password'])
+                         for server in self._servers]
+
+    def close(self):
+        for client in self._clients:
+            client.disconnect()
+
+    def sample(self):
+        """Return the largest active part count in any partition, and the
+           number of merges in progress, over all servers.
+
+           Return (None, None) if any server can't be queried."""
+        max_parts = 0
+        merges = 0
+        try:
+            for client in self._clients:
+                res = client.execute(
+                    'SELECT max(parts) FROM '
+                    '(SELECT count() AS parts FROM system.parts '
+                    ' WHERE active AND database=%(db)s GROUP BY table, partition)',
+                    {'db': self._database})
+                if res and res[0][0]:
+                    max_parts = max(max_parts, res[0][0])
+                res = client.execute('SELECT count() FROM system.merges WHERE database=%(db)s',
+                                     {'db': self._database})
+                merges += res[0][0]
+        except (clickhouse_driver.errors.Error, OSError, EOFError) as err:
+            logging.warning('ClickHouse part count unavailable: {}'.format(err))
+            return (None, None)
+        return (max_parts, merges)
+
+    def server_parts(self):
+        """Return a dictionary giving the number of active parts on each
+           server, or None if any server can't be queried."""
+        res = {}
+        try:
+            for server, client in zip(self._servers, self._clients):
+                res[server] = client.execute(
+                    'SELECT count() FROM system.parts WHERE active AND database=%(db)s',
+                    {'db': self._database})[0][0]
+        except (clickhouse_driver.errors.Error, OSError, EOFError) as err:
+            logging.warning('ClickHouse part count unavailable: {}'.format(err))
+            return None
+        return res
+
+# Minimum interval, in seconds, between samples of ClickHouse part
+# and merge counts used to pace inserts.
+PACE_SAMPLE_INTERVAL = 5
+
+class InsertPacer:
+    """Decide whether inserts should wait for ClickHouse to merge parts.
+
+       Part and merge counts are sampled at most every
+       PACE_SAMPLE_INTERVAL seconds, and the sample shared by all
+       inserts made in the meantime."""
+    def __init__(self, monitor, parts_high, merges_high, delay):
+        """Create a pacer.
+
+           monitor is a ClickHouseMonitor. Inserts are deferred when
+           the largest number of active parts in a partition reaches
+           parts_high, or the number of merges in progress reaches
+           merges_high. A threshold of 0 is not checked. Deferred
+           inserts wait about delay seconds."""
+        self._monitor = monitor
+        self._parts_high = parts_high
+        self._merges_high = merges_high
+        self._delay = delay
+        self._sample = (None, None)
+        self._next_sample = 0
+
+    def close(self):
+        self._monitor.close()
+
+    def defer(self):
+        """Return a tuple of the time before which an insert should not
+           be made and the reason, or None if the insert can go ahead.
+
+           If the counts can't be sampled, inserts go ahead."""
+        now = time.monotonic()
+        if now >= self._next_sample:
+            self._next_sample = now + PACE_SAMPLE_INTERVAL
+            self._sample = self._monitor.sample()
+        max_parts, merges = self._sample
+        if self._parts_high and max_parts is not None and max_parts >= self._parts_high:
+            reason = 'ClickHouse parts {}'.format(max_parts)
+        elif self._merges_high and merges is not None and merges >= self._merges_high:
+            reason = 'ClickHouse merges {}'.format(merges)
+        else:
+            return None
+        # Spread deferred inserts, so they don't all return at once.
+        wait = self._delay * random.uniform(1.0, 1.5)
+        return (datetime.datetime.now() + datetime.timedelta(seconds=wait), reason)
+
+def parse_weights(text):
+    """Parse queue weights given as QUEUE=WEIGHT[,QUEUE=WEIGHT...].
+
+       Return a dictionary of weight by queue. Raise ValueError if the
+       weights are malformed or not positive."""
+    res = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        queue, sep, weight = item.partition('=')
+        if not sep or float(weight) <= 0:
+            raise ValueError('{} is not QUEUE=WEIGHT'.format(item.strip()))
+        res[queue.strip()] = float(weight)
+    return res
+
+# Minimum interval, in seconds, between changes to the order of the
+# same set of queues.
+FAIRSHARE_REORDER_INTERVAL = 5
+
+class FairShare:
+    """Share jobs between queues in proportion to their weights.
+
+       This is stride scheduling. Each queue has a pass value, advanced
+       by the inverse of its weight each time a job is taken from it,
+       and the queue with the lowest pass is checked first. A queue
+       checked before the queue a job was taken from had no jobs, so its
+       pass is brought up to that queue's pass; an idle queue can't
+       build up credit to spend in a burst when jobs arrive. Queues
+       with no weight have weight 1."""
+    def __init__(self, weights):
+        self._weights = weights
+        self._pass = {}
+        self._next_reorder = 0
+
+    def order(self, queues):
+        """Return the queues in registration order, the queue to be
+           checked first last.
+
+           queues is in the configured registration order, which is
+           kept between queues with the same pass."""
+        start = min(self._pass.values()) if self._pass else 0.0
+        for q in queues:
+            self._pass.setdefault(q, start)
+        return sorted(queues, key=lambda q: -self._pass[q])
+
+    def registration(self, queues, registered):
+        """Return the order to register queues in, given the queues
+           currently registered in order, or None.
+
+           If the queues are those registered, keep the registered
+           order unless FAIRSHARE_REORDER_INTERVAL has passed since
+           it was last changed."""
+        now = time.monotonic()
+        if registered is not None and set(queues) == set(registered) and \
+           now < self._next_reorder:
+            return registered
+        self._next_reorder = now + FAIRSHARE_REORDER_INTERVAL
+        return self.order(queues)
+
+    def started(self, queue, registered):
+        """Record a job taken from queue with the queues registered in
+           the given order."""
+        self._pass.setdefault(queue, min(self._pass.values()) if self._pass else 0.0)
+        if queue in registered:
+            for q in registered[registered.index(queue) + 1:]:
+                self._pass[q] = max(self._pass.get(q, 0.0), self._pass[queue])
+        self._pass[queue] += 1.0 / self._weights.get(queue, 1.0)
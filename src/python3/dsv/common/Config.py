@@ -14,7 +14,12 @@ import sys
 _defaults = {
     'gearman': {
         'host': 'localhost',
-        'port': 4730
+        'port': 4730,
+        'submit_window': 1000
+    },
+    'queue': {
+        'backend': 'gearman',
+        'promote-after': 0
     },
     'datastore': {
         'path': '/var/lib/dns-stats-visualizer/cdns/',
@@ -22,10 +27,37 @@ _defaults = {
         'tsv_file_pattern': '*.tsv',
         'lockfile': '/run/lock/dns-stats-visualizer/{}.lock',
         'user': 'dsv',
+        'scan_index': '%(path)s/.scan-index.sqlite',
+        'backfill_checkpoint': '%(path)s/.backfill-{}.json',
+        'delayed_jobs': '%(path)s/.delayed-jobs.sqlite',
+        'node_ids': '%(path)s/.node-ids.json',
+        'queue_db': '%(path)s/.queue.sqlite',
         # NOTE: The order is important. Priority of worker processing
         # INCREASES the later in the list the queue name is.
         'queues': 'cdns-to-pcap,cdns-to-tsv,import-tsv'
     },
+    'worker': {
+        'load-high': 1.0,
+        'parts-high': 150,
+        'parts-max': 250,
+        'merges-high': 0,
+        'control-interval': 15,
+        'job-stats': 'Y',
+        'job-stats-batch': 1000,
+        'job-stats-interval': 60,
+        'import-batch-files': 16,
+        'import-batch-bytes': 1073741824,
+        'import-mode': 'tsv',
+        'stream-block-size': 100000,
+        'xz-threads': 0,
+        'combine-pcap': '',
+        'import-probe': '',
+        'import-pace-parts': 150,
+        'import-pace-merges': 0,
+        'import-pace-delay': 10,
+        'import-chunk-rows': 1000000,
+        'queue-weights': ''
+    },
     'pcap': {
         'compress': 'Y',
         'compression-level': 2,
@@ -52,6 +84,7 @@ _defaults = {
         'password': 'dsv',
         'querytable': 'QueryResponse',
         'packetcountstable': 'PacketCounts',
+        'shard-insert': 'distributed',
         'default_ddl_path': '/usr/share/dns-stats-visualizer/sql/clickhouse/ddl',
         'dataset-name-raw': 'Raw data',
         'dataset-database-raw': 'dsv',
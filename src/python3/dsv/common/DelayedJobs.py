@@ -0,0 +1,118 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# A store for jobs that are not to be run before a given time.
+#
+# When a worker takes a job that is not yet due, the job is held
+# until it is due and then re-queued. Held jobs are kept in a heap
+# ordered on due time, so finding due jobs doesn't mean examining
+# every held job. They are also recorded in an SQLite database, so
+# they are not lost if the worker stops unexpectedly.
+#
+# Several workers may share a database. Each worker loads all the
+# jobs in the database when it starts, so jobs held by a worker that
+# stopped are picked up by the next worker to start. When a job is
+# due, a worker claims it by deleting it from the database; only the
+# worker that deletes the job re-queues it.
+
+import datetime
+import heapq
+import logging
+import sqlite3
+
+# Bump this if the schema changes. Unlike the scan index, the
+# contents must be preserved, so any change needs a migration.
+SCHEMA_VERSION = 1
+
+class DelayedJobs:
+    def __init__(self, dbpath=None):
+        """Open the store.
+
+           If no database path is given, jobs are held in memory only."""
+        self._durable = bool(dbpath)
+        self._db = sqlite3.connect(str(dbpath) if dbpath else ':memory:')
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # Every write is a commit, as jobs must not be lost.
+        self._db.execute('PRAGMA synchronous=FULL')
+        self._check_schema()
+        self._heap = [(rec[3], rec[0], rec[1], rec[2]) for rec in
+                      self._db.execute('SELECT id, queue, arg, notbefore FROM jobs')]
+        heapq.heapify(self._heap)
+        if self._heap:
+            logging.info('Loaded {} delayed jobs'.format(len(self._heap)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def close(self):
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    @property
+    def durable(self):
+        return self._durable
+
+    def _check_schema(self):
+        ver = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if ver == SCHEMA_VERSION:
+            return
+        if ver:
+            raise sqlite3.DatabaseError('Delayed job store schema {} is not {}'.format(
+                ver, SCHEMA_VERSION))
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                             '  id INTEGER PRIMARY KEY,'
+                             '  queue TEXT NOT NULL,'
+                             '  arg TEXT NOT NULL,'
+                             '  notbefore REAL NOT NULL)')
+            self._db.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+
+    def add(self, queue, arg, notbefore):
+        """Hold a job until notbefore, a datetime."""
+        ts = notbefore.timestamp()
+        with self._db:
+            cur = self._db.execute('INSERT INTO jobs(queue, arg, notbefore) VALUES (?, ?, ?)',
+                                   (queue, arg, ts))
+        heapq.heappush(self._heap, (ts, cur.lastrowid, queue, arg))
+
+    def next_due(self):
+        """Return the time the next job is due, or None if no jobs are held."""
+        if not self._heap:
+            return None
+        return datetime.datetime.fromtimestamp(self._heap[0][0])
+
+    def take_due(self, now=None):
+        """Remove and return all jobs due at or before now.
+
+           Return a list of (queue, arg, notbefore) tuples. Jobs
+           already taken by another worker sharing the store are
+           omitted."""
+        now = (now or datetime.datetime.now()).timestamp()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+        if not due:
+            return []
+        res = []
+        with self._db:
+            for ts, jobid, queue, arg in due:
+                if self._db.execute('DELETE FROM jobs WHERE id=?', (jobid,)).rowcount:
+                    res.append((queue, arg, datetime.datetime.fromtimestamp(ts)))
+        return res
+
+    def jobs(self):
+        """Return all held jobs, in due order, as (queue, arg, notbefore) tuples."""
+        return [(queue, arg, datetime.datetime.fromtimestamp(ts))
+                for ts, _, queue, arg in sorted(self._heap)]
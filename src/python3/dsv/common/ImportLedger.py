@@ -0,0 +1,121 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# The import ledger, the ClickHouse table ImportLedger recording each
+# C-DNS file whose query data has been imported.
+#
+# A file is recorded under its node ID and source name, the name of
+# the C-DNS file without compression suffix. TSV files converted from
+# C-DNS are named after the source, so the same name is used whether
+# the data is imported from TSV or streamed during conversion. The
+# ledger is ordered by node and name, so a check is a primary key
+# lookup on a single shard, rather than a query for data on every
+# shard.
+
+import datetime
+import logging
+import socket
+
+import psycopg2
+
+import dsv.common.NativeInsert as dni
+import dsv.common.TimeIndex as dti
+
+TABLE = 'ImportLedger'
+
+INSERT = 'INSERT INTO {db}.{table}(Date, NodeID, FileName, Rows, Completed, Host) VALUES'
+
+def source_name(name):
+    """Return the ledger name for a C-DNS or TSV file name.
+
+       This is the C-DNS file name without compression suffix."""
+    for suffix in ('.xz', '.tsv'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+def imported(client, database, node_id, names):
+    """Return the set of the named sources recorded for the node.
+
+       Raise one of NativeInsert.CLIENT_ERRORS if the query fails."""
+    if not names:
+        return set()
+    recs = client.execute(
+        'SELECT DISTINCT FileName FROM {db}.{table} '
+        'WHERE NodeID=%(nodeid)s AND FileName IN %(names)s'.format(db=database, table=TABLE),
+        {'nodeid': node_id, 'names': tuple(names)},
+        settings={'optimize_skip_unused_shards': 1})
+    return {rec[0] for rec in recs}
+
+def node_sources(client, database, node_id):
+    """Return the set of all sources recorded for the node."""
+    recs = client.execute(
+        'SELECT DISTINCT FileName FROM {db}.{table} '
+        'WHERE NodeID=%(nodeid)s'.format(db=database, table=TABLE),
+        {'nodeid': node_id},
+        settings={'optimize_skip_unused_shards': 1})
+    return {rec[0] for rec in recs}
+
+def record(client, database, node_id, entries):
+    """Record imports in the ledger.
+
+       entries is a list of (source name, rows) tuples. The insert is
+       made synchronously to all shards, so a check made once this
+       returns finds the entries."""
+    now = datetime.datetime.now().replace(microsecond=0)
+    host = socket.gethostname()
+    rows = []
+    for name, nrows in entries:
+        start = dti.name_start(name)
+        rows.append({'Date': start.date() if start else now.date(),
+                     'NodeID': node_id,
+                     'FileName': name,
+                     'Rows': nrows,
+                     'Completed': now,
+                     'Host': host})
+    if rows:
+        client.execute(INSERT.format(db=database, table=TABLE), rows,
+                       settings={'insert_distributed_sync': 1})
+
+class LedgerFilter:
+    """Skip files already recorded in the ledger when queueing jobs.
+
+       The sources recorded for each node are read once, when a file
+       for the node is first checked. If the ledger can't be read, a
+       warning is logged and no files are skipped; the jobs will check
+       the ledger again before importing."""
+    def __init__(self, client, database, resolver):
+        """Create a filter.
+
+           resolver is a NodeIdResolver."""
+        self._client = client
+        self._database = database
+        self._resolver = resolver
+        self._nodes = {}
+        self._failed = False
+        self.skipped = 0
+
+    def imported(self, dsvpath):
+        """Is the file at the DSVPath recorded in the ledger?"""
+        if self._failed:
+            return False
+        key = (dsvpath.server, dsvpath.node)
+        if key not in self._nodes:
+            try:
+                node_id = self._resolver.node_id(dsvpath.server, dsvpath.node)
+                self._nodes[key] = node_sources(self._client, self._database, node_id) \
+                    if node_id is not None else set()
+            except dni.CLIENT_ERRORS + (psycopg2.Error,) as err:
+                logging.warning('Import ledger unavailable, not skipping imported files: '
+                                '{}'.format(err))
+                self._failed = True
+                return False
+        if source_name(dsvpath.path.name) in self._nodes[key]:
+            self.skipped += 1
+            return True
+        return False
@@ -0,0 +1,118 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# A minimal interface to Linux inotify(7), using the C library directly
+# so no extra Python package is required.
+
+import collections
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+InotifyEvent = collections.namedtuple('InotifyEvent', ['wd', 'mask', 'cookie', 'name', 'path'])
+
+class InotifyUnavailableError(OSError):
+    """Exception raised when inotify is not available on this system."""
+
+class Inotify:
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except (OSError, AttributeError) as err:
+            raise InotifyUnavailableError('inotify not available: {}'.format(err))
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._fd = init(os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise InotifyUnavailableError(err, os.strerror(err))
+        self._watches = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+            self._watches = {}
+
+    def add_watch(self, path, mask):
+        """Add a watch on path, and return the watch descriptor."""
+        wd = self._add_watch(self._fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(path))
+        self._watches[wd] = str(path)
+        return wd
+
+    def rm_watch(self, wd):
+        if wd in self._watches:
+            del self._watches[wd]
+            self._rm_watch(self._fd, wd)
+
+    def watched(self):
+        """Return the set of paths currently watched."""
+        return set(self._watches.values())
+
+    def read(self, timeout=None):
+        """Return a list of pending events.
+
+           Wait up to timeout seconds for events to arrive, or
+           indefinitely if timeout is None. If no events arrive, return
+           an empty list."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        buf = os.read(self._fd, 64 * 1024)
+        res = []
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, namelen = _EVENT_HEADER.unpack_from(buf, pos)
+            pos += _EVENT_HEADER.size
+            name = os.fsdecode(buf[pos:pos + namelen].rstrip(b'\0'))
+            pos += namelen
+            path = self._watches.get(wd)
+            if mask & IN_IGNORED:
+                # Watch removed, explicitly or because the file went away.
+                self._watches.pop(wd, None)
+            res.append(InotifyEvent(wd, mask, cookie, name, path))
+        return res
@@ -0,0 +1,115 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Exit codes, errors and file and process helpers shared by the
+# in-process job handlers in JobHandlers and the modules they use.
+
+import fcntl
+import os
+import subprocess
+import tempfile
+
+# Job exit codes. See dsv-worker(1).
+SUCCESS = 0
+FAILURE = 1
+TRANSIENT_FAILURE = 2
+SUCCESS_NO_UNLINK = 3
+INFRASTRUCTURE_ERROR = 99
+
+class JobError(Exception):
+    """Exception raised when a job fails. Gives the job exit code and,
+       for a deferred job, the time before which it should not be
+       retried."""
+    def __init__(self, returncode, msg, notbefore=None):
+        super().__init__(msg)
+        self.returncode = returncode
+        self.notbefore = notbefore
+
+def remove(*paths):
+    for path in paths:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+def claim(path, wait):
+    """Open and lock a file, so no other job imports it.
+
+       If wait is False, don't wait for a lock held by another job.
+       Return the open file, or None if the file doesn't exist or is
+       locked. Locks are released when the file is closed, including
+       when the process exits."""
+    try:
+        f = path.open('rb')
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # The job holding the lock may have imported and removed the file.
+        if os.fstat(f.fileno()).st_ino == path.stat().st_ino:
+            return f
+    except (BlockingIOError, FileNotFoundError):
+        pass
+    f.close()
+    return None
+
+def pipeline(cmds, stdin, stdout):
+    """Run a pipeline of commands, with pipefail semantics.
+
+       Return a tuple of success flag and collected stderr."""
+    return finish_pipeline(start_pipeline(cmds, stdin, stdout))
+
+def start_pipeline(cmds, stdin, stdout, pass_fds=None):
+    """Start a pipeline of commands. Return the processes.
+
+       If given, pass_fds maps the index of a command to the file
+       descriptors to pass to that command.
+
+       stderr of each command goes to a temporary file, errfile on the
+       process. A pipe would not be read until the command's turn to
+       be waited for, and a command filling it would block, and with it
+       the whole pipeline."""
+    procs = []
+    for n, cmd in enumerate(cmds):
+        errfile = tempfile.TemporaryFile()
+        try:
+            proc = subprocess.Popen(
+                cmd,
+                stdin=procs[-1].stdout if procs else stdin,
+                stdout=stdout if n == len(cmds) - 1 else subprocess.PIPE,
+                stderr=errfile,
+                pass_fds=pass_fds.get(n, ()) if pass_fds else ())
+        except BaseException:
+            errfile.close()
+            raise
+        proc.errfile = errfile
+        procs.append(proc)
+        if n > 0:
+            # Let the upstream process get SIGPIPE if this one exits.
+            procs[-2].stdout.close()
+    return procs
+
+def finish_pipeline(procs):
+    """Wait for a pipeline to finish.
+
+       Return a tuple of success flag and collected stderr."""
+    ok = True
+    errs = []
+    for proc in reversed(procs):
+        proc.wait()
+        ok = ok and proc.returncode == 0
+        err = read_errfile(proc.errfile)
+        if err:
+            errs.append(err)
+    return (ok, '\n'.join(reversed(errs)))
+
+def read_errfile(errfile):
+    """Return the contents of a temporary stderr file, and close it."""
+    with errfile:
+        errfile.seek(0)
+        return errfile.read().decode(errors='replace').rstrip()
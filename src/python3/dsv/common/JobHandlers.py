@@ -0,0 +1,693 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# In-process handlers for Visualizer queue jobs.
+#
+# Jobs may be run by the external commands dsv-<queue name>. These
+# are bash scripts which in turn run several Python commands to read
+# configuration, look up node IDs, log and queue jobs, each of which
+# reads the configuration and, for node ID lookup, makes a fresh
+# Postgres connection. The handlers here do the same work within
+# the worker, using configuration read once and connections kept
+# open between jobs. Only the data processing tools themselves,
+# inspector, xz, awk and clickhouse-client, are run as separate
+# processes.
+#
+# Handlers keep the exit code contract of the external commands. A
+# handler returns a subprocess.CompletedProcess, so the worker treats
+# in-process and external jobs alike. Handlers that insert data
+# record the number of rows inserted in the context.
+#
+# A job deferred because ClickHouse is busy exits with a transient
+# failure, and writes the time before which it should not be retried
+# to standard output, as a line 'Not before: <seconds since epoch>'.
+
+import datetime
+import itertools
+import logging
+import os
+import pathlib
+import random
+import shutil
+import subprocess
+import threading
+
+import clickhouse_driver
+import psycopg2
+
+import dsv.common.Concurrency as dc
+import dsv.common.ImportLedger as dil
+import dsv.common.JobBase as djb
+import dsv.common.NativeInsert as dni
+import dsv.common.NodeIds as dnid
+import dsv.common.Path as dp
+import dsv.common.PcapFanout as dpf
+import dsv.common.Shards as dsh
+import dsv.common.TsvImport as dtsv
+import dsv.common.Xz as dxz
+
+# Job exit codes. See dsv-worker(1).
+SUCCESS = djb.SUCCESS
+FAILURE = djb.FAILURE
+TRANSIENT_FAILURE = djb.TRANSIENT_FAILURE
+SUCCESS_NO_UNLINK = djb.SUCCESS_NO_UNLINK
+INFRASTRUCTURE_ERROR = djb.INFRASTRUCTURE_ERROR
+
+JobError = djb.JobError
+
+SHARE_DIR = pathlib.Path('/usr/share/dns-stats-visualizer')
+TSV_TEMPLATES = [SHARE_DIR / 'sql/clickhouse/tsv.tpl',
+                 pathlib.Path('/etc/dns-stats-visualizer/tsv-clickhouse.tpl')]
+INFO_AWK = SHARE_DIR / 'sql/clickhouse/info.awk'
+
+# Prefix of the line in the output of a deferred job giving the time
+# before which it should not be retried.
+NOT_BEFORE = 'Not before: '
+
+class JobResult(subprocess.CompletedProcess):
+    """The result of an in-process job.
+
+       rows is the number of rows inserted, or None if not known."""
+    def __init__(self, args, returncode, stdout=None, stderr=None, rows=None):
+        super().__init__(args, returncode, stdout, stderr)
+        self.rows = rows
+
+class HandlerContext:
+    """Resources shared between in-process jobs.
+
+       Database connections are made when first needed, and kept open
+       until closed or an error occurs on them."""
+    def __init__(self, cfg, writer):
+        self._cfg = cfg
+        self.writer = writer
+        self._nodes = dnid.NodeIdResolver(cfg['postgres'], cfg['datastore']['node_ids'])
+        self._clickhouse = {}
+        self._pacer = None
+        self._shards = None
+        self._commands = {}
+        # Rows inserted by the current job, if known.
+        self.rows = None
+        # The number of times the current job has been retried.
+        self.retry_count = 0
+        # TSV files in imports that failed, not to be imported together
+        # with other files again.
+        self.failed_batch = set()
+
+    def close(self):
+        for client in self._clickhouse.values():
+            client.disconnect()
+        self._clickhouse = {}
+        if self._pacer:
+            self._pacer.close()
+            self._pacer = None
+        if self._shards:
+            self._shards.close()
+            self._shards = None
+
+    @property
+    def cfg(self):
+        return self._cfg
+
+    def require(self, *cmds):
+        """Check the named executables are available."""
+        for cmd in cmds:
+            if cmd not in self._commands:
+                self._commands[cmd] = shutil.which(cmd) is not None
+            if not self._commands[cmd]:
+                raise JobError(INFRASTRUCTURE_ERROR, 'No {}.'.format(cmd))
+
+    def node_id(self, server, node):
+        """Return the node ID for the server and node names, or None."""
+        try:
+            return self._nodes.node_id(server, node)
+        except psycopg2.Error as err:
+            raise JobError(TRANSIENT_FAILURE, 'Postgres node lookup failed: {}'.format(err))
+
+    def clickhouse(self, server):
+        """Return a ClickHouse client for the server."""
+        if server not in self._clickhouse:
+            chcfg = self._cfg['clickhouse']
+            self._clickhouse[server] = clickhouse_driver.Client(
+                host=server, user=chcfg['user'], password=chcfg['password'])
+        return self._clickhouse[server]
+
+    def clickhouse_failed(self, server):
+        """Discard the client for a server after an error."""
+        client = self._clickhouse.pop(server, None)
+        if client:
+            client.disconnect()
+
+    def insert_target(self, node_id, import_server):
+        """Return the server to insert data for the node into, and
+           whether to insert into the shard tables on that server.
+
+           Unless shard inserts are configured, this is the import
+           server, inserting into the distributed tables."""
+        chcfg = self._cfg['clickhouse']
+        mode = chcfg['shard-insert']
+        if mode == dsh.DISTRIBUTED:
+            return (import_server, False)
+        if not self._shards:
+            try:
+                self._shards = dsh.ShardChooser(
+                    mode, dsh.servers(chcfg),
+                    dc.ClickHouseMonitor(chcfg) if mode == dsh.LEAST_LOADED else None)
+            except ValueError as err:
+                raise JobError(INFRASTRUCTURE_ERROR, str(err))
+        return (self._shards.choose(node_id), True)
+
+    def insert_deferral(self):
+        """Return a tuple of the time before which data should not be
+           inserted into ClickHouse and the reason, or None if inserts
+           can go ahead."""
+        workercfg = self._cfg['worker']
+        parts_high = int(workercfg['import-pace-parts'])
+        merges_high = int(workercfg['import-pace-merges'])
+        if not parts_high and not merges_high:
+            return None
+        if not self._pacer:
+            self._pacer = dc.InsertPacer(dc.ClickHouseMonitor(self._cfg['clickhouse']),
+                                         parts_high, merges_high,
+                                         float(workercfg['import-pace-delay']))
+        return self._pacer.defer()
+
+def _decompressed(ctx, path):
+    """Return the commands needed to read the file, uncompressed, and the
+       file name less any .xz extension.
+
+       Multi-block xz files are decompressed with several threads."""
+    if path.suffix == '.xz':
+        threads = int(ctx.cfg['worker']['xz-threads'])
+        return ([dxz.decompress_command(path, threads)], path.stem)
+    return ([], path.name)
+
+def _insert_table(chcfg, table, shard):
+    """Return the name of the configured table to insert into, or of its
+       shard table if inserting into shards directly."""
+    return dsh.shard_table(chcfg[table]) if shard else chcfg[table]
+
+def _start_conversion(fanout, readers, cmd, stdin, stdout):
+    """Start a conversion pipeline. Return the processes."""
+    if fanout:
+        return fanout.start_pipeline(readers, cmd, stdin, stdout)
+    return djb.start_pipeline(readers + [cmd], stdin, stdout)
+
+def cdns_to_tsv(ctx, path):
+    """Convert a C-DNS file to TSV, and queue the TSV for import.
+
+       The TSV is written to the directory containing the C-DNS file.
+       In stream import mode, the data is inserted into ClickHouse as
+       it is converted, and TSV is only written if that can't be done.
+       A file already recorded in the import ledger is not converted.
+
+       If combining PCAP generation with TSV conversion, and a
+       cdns-to-pcap job for the same file is pending, the PCAP is
+       generated from the same read of the C-DNS file."""
+    ctx.require('inspector', 'xz', 'awk')
+    template = next((t for t in TSV_TEMPLATES if t.is_file()), None)
+    if not template:
+        raise JobError(INFRASTRUCTURE_ERROR, 'Template file missing.')
+    dsvpath = dp.DSVPath(path)
+    readers, basename = _decompressed(ctx, path)
+    tsv = path.parent / (basename + '.tsv')
+    info = path.parent / (basename + '.info')
+    tsvinfo = path.parent / (basename + '.tsv.info')
+
+    nodeid = ctx.node_id(dsvpath.server, dsvpath.node)
+    if nodeid is None:
+        raise JobError(FAILURE, "Can't find server {} node {}".format(
+            dsvpath.server, dsvpath.node))
+
+    if not path.is_file():
+        logging.warning('{} not found.'.format(path))
+        return SUCCESS
+
+    if _source_imported(ctx, nodeid, path):
+        logging.warning('{} already in import ledger.'.format(path))
+        return SUCCESS
+
+    inspector = ['inspector', '--output-format', 'template', '--template', str(template),
+                 '--value', 'node={}'.format(nodeid), '--report-info']
+    fanout = dpf.pcap_fanout(ctx, path)
+    try:
+        if ctx.cfg['worker']['import-mode'] == 'stream':
+            fifo = path.parent / (basename + '.tsv.fifo')
+            try:
+                if _stream_cdns(ctx, path, readers, inspector, fifo, info, tsvinfo, nodeid,
+                                fanout):
+                    return SUCCESS
+            finally:
+                djb.remove(fifo, info)
+        _write_tsv(ctx, path, readers, inspector, tsv, info, tsvinfo, nodeid, fanout)
+    finally:
+        if fanout:
+            fanout.close()
+    return SUCCESS
+
+def _write_tsv(ctx, path, readers, inspector, tsv, info, tsvinfo, nodeid, fanout):
+    """Convert a C-DNS file to a TSV file, and queue the TSV for import."""
+    basename = tsv.stem
+    try:
+        with path.open('rb') as inf, info.open('wb') as outf:
+            procs = _start_conversion(fanout, readers, inspector + ['--output', str(tsv)],
+                                      stdin=subprocess.DEVNULL if readers else inf, stdout=outf)
+            ok, err = djb.finish_pipeline(procs)
+            if fanout:
+                fanout.finish()
+        if not ok:
+            raise JobError(FAILURE, 'Error converting file\n' + err)
+
+        with tsvinfo.open('wb') as outf:
+            res = subprocess.run(['awk', '-f', str(INFO_AWK),
+                                  '-v', 'node_id={}'.format(nodeid), str(info)],
+                                 stdout=outf, stderr=subprocess.DEVNULL, check=False)
+        if res.returncode != 0:
+            djb.remove(tsvinfo)
+        djb.remove(info)
+
+        try:
+            ctx.writer.add('import-tsv', tsv, node_id=nodeid)
+        except Exception as err:
+            raise JobError(FAILURE, 'Error adding TSV file {} to import queue: {}'.format(
+                tsv, err))
+    except BaseException:
+        djb.remove(info, *path.parent.glob(basename + '.tsv*'))
+        raise
+
+def _read_fifo(fifo, inserter):
+    """Insert the TSV written to a FIFO."""
+    with fifo.open('rb') as f:
+        first = f.readline()
+        inserter.insert(itertools.chain([first], f) if first else [],
+                        with_names=first.startswith(b'Date\t'))
+
+def _stream_cdns(ctx, path, readers, inspector, fifo, info, tsvinfo, nodeid, fanout=None):
+    """Convert a C-DNS file, and insert the data directly into ClickHouse.
+
+       The TSV output of inspector is written to a FIFO, read in blocks
+       and inserted with the ClickHouse native protocol, so it is not
+       written to disk.
+
+       Return True if the data was inserted, or False if the data should
+       be written to TSV and queued for import instead. That is done if
+       ClickHouse is unavailable or busy merging parts, or the data can't
+       be converted, before any data is sent."""
+    deferral = ctx.insert_deferral()
+    if deferral:
+        logging.info('Not streaming {}, {}, writing TSV.'.format(path, deferral[1]))
+        return False
+    chcfg = ctx.cfg['clickhouse']
+    import_server = random.choice(chcfg['import-server'].split(','))
+    server, shard = ctx.insert_target(nodeid, import_server)
+    database = chcfg['database']
+    block_size = int(ctx.cfg['worker']['stream-block-size'])
+    try:
+        inserter = dni.TSVInserter(
+            ctx.clickhouse(server),
+            '{}.{}'.format(database, _insert_table(chcfg, 'querytable', shard)), block_size)
+    except dni.CLIENT_ERRORS as err:
+        ctx.clickhouse_failed(server)
+        logging.warning('ClickHouse unavailable on server {}, writing TSV: {}'.format(server, err))
+        return False
+
+    os.mkfifo(str(fifo))
+    with path.open('rb') as inf, info.open('wb') as outf:
+        procs = _start_conversion(fanout, readers, inspector + ['--output', str(fifo)],
+                                  stdin=subprocess.DEVNULL if readers else inf, stdout=outf)
+        result = []
+
+        def finish():
+            result.extend(djb.finish_pipeline(procs))
+            # If inspector failed before opening the FIFO, let the
+            # reader open it and see end of file.
+            try:
+                os.close(os.open(str(fifo), os.O_WRONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+
+        finisher = threading.Thread(target=finish, name='StreamPipeline')
+        finisher.start()
+        try:
+            _read_fifo(fifo, inserter)
+        except (dni.ConversionError,) + dni.CLIENT_ERRORS as err:
+            for proc in procs:
+                proc.kill()
+            finisher.join()
+            if fanout:
+                fanout.abort()
+            if not isinstance(err, dni.ConversionError):
+                ctx.clickhouse_failed(server)
+            if inserter.partial:
+                raise JobError(FAILURE, 'Streaming import failed on server {} after {} rows, '
+                               'data partially imported.\n{}'.format(server, inserter.read, err))
+            logging.warning('Streaming import of {} failed, writing TSV: {}'.format(path, err))
+            return False
+        finisher.join()
+        if fanout:
+            fanout.finish()
+    ok, err = result
+    if not ok:
+        raise JobError(FAILURE, 'Error converting file, {} rows imported\n{}'.format(
+            inserter.rows, err))
+    ctx.rows = inserter.rows
+    _record_imported(ctx, import_server, [(nodeid, dil.source_name(path.name), inserter.rows)])
+
+    with tsvinfo.open('wb') as outf:
+        res = subprocess.run(['awk', '-f', str(INFO_AWK),
+                              '-v', 'node_id={}'.format(nodeid), str(info)],
+                             stdout=outf, stderr=subprocess.DEVNULL, check=False)
+    if res.returncode == 0:
+        try:
+            counts = dni.TSVInserter(
+                ctx.clickhouse(server),
+                '{}.{}'.format(database, _insert_table(chcfg, 'packetcountstable', shard)),
+                block_size)
+            with tsvinfo.open('rb') as f:
+                counts.insert(f)
+        except (dni.ConversionError,) + dni.CLIENT_ERRORS as err:
+            # Leave the packet counts to be imported by hand.
+            ctx.clickhouse_failed(server)
+            raise JobError(FAILURE, 'Query data imported, but packet count import failed '
+                           'on server {}, see {}.\n{}'.format(server, tsvinfo, err))
+    djb.remove(tsvinfo)
+    return True
+
+def _check_failed(ctx, server, err):
+    ctx.clickhouse_failed(server)
+    raise JobError(TRANSIENT_FAILURE,
+                   'ClickHouse connection failed on server {}: {}'.format(server, err))
+
+def _already_imported(ctx, server, path, values):
+    """Check whether the first record of the file is in the database."""
+    chcfg = ctx.cfg['clickhouse']
+    try:
+        recs = ctx.clickhouse(server).execute(
+            'SELECT NodeID FROM {db}.{table} '
+            'WHERE Date=%(date)s AND DateTime=toDateTime(%(datetime)s) '
+            'AND NanoSecondsSinceEpoch=%(nanosecs)s AND NodeID=%(nodeid)s '
+            'AND ID=%(qid)s LIMIT 1'.format(db=chcfg['database'], table=chcfg['querytable']),
+            values)
+    except dni.CLIENT_ERRORS as err:
+        _check_failed(ctx, server, err)
+    if recs:
+        logging.warning('{} first record already in database.'.format(path))
+        return True
+    return False
+
+def _imported(ctx, server, files, probe=True):
+    """Return the set of the TSV files whose data is already imported.
+
+       files is a list of (path, check values) tuples. Files are looked
+       up in the import ledger under the node ID from their first row.
+       If probe is True and import-probe is set, files not in the ledger
+       are also checked for their first record in the query table, to
+       catch data imported before the ledger was kept."""
+    database = ctx.cfg['clickhouse']['database']
+    res = set()
+    bynode = {}
+    for path, values in files:
+        bynode.setdefault(values['nodeid'], []).append(path)
+    try:
+        for node_id, paths in bynode.items():
+            found = dil.imported(ctx.clickhouse(server), database, node_id,
+                                 [dil.source_name(p.name) for p in paths])
+            for p in paths:
+                if dil.source_name(p.name) in found:
+                    logging.warning('{} already in import ledger.'.format(p))
+                    res.add(p)
+    except dni.CLIENT_ERRORS as err:
+        _check_failed(ctx, server, err)
+    if probe and ctx.cfg['worker']['import-probe']:
+        res.update(p for p, values in files
+                   if p not in res and _already_imported(ctx, server, p, values))
+    return res
+
+def _record_imported(ctx, server, entries):
+    """Record imported files in the import ledger.
+
+       entries is a list of (node ID, source name, rows) tuples.
+
+       The data is already in ClickHouse, so if the ledger can't be
+       written the job fails permanently, rather than be retried and
+       import the data again."""
+    database = ctx.cfg['clickhouse']['database']
+    bynode = {}
+    for node_id, name, rows in entries:
+        bynode.setdefault(node_id, []).append((name, rows))
+    try:
+        for node_id, nodeentries in bynode.items():
+            dil.record(ctx.clickhouse(server), database, node_id, nodeentries)
+    except dni.CLIENT_ERRORS as err:
+        ctx.clickhouse_failed(server)
+        raise JobError(FAILURE, 'Data imported, but recording the import in the ledger failed '
+                       'on server {}. Not retrying, to avoid importing the data twice.\n{}'.format(
+                           server, err))
+
+def _source_imported(ctx, nodeid, path):
+    """Check the import ledger for a C-DNS file before converting it.
+
+       If the ledger can't be read, assume the file is not imported;
+       the import checks again."""
+    server = random.choice(ctx.cfg['clickhouse']['import-server'].split(','))
+    name = dil.source_name(path.name)
+    try:
+        return name in dil.imported(ctx.clickhouse(server), ctx.cfg['clickhouse']['database'],
+                                    nodeid, [name])
+    except dni.CLIENT_ERRORS as err:
+        ctx.clickhouse_failed(server)
+        logging.warning('Import ledger unavailable on server {}: {}'.format(server, err))
+        return False
+
+def import_tsv(ctx, path):
+    """Import a TSV file into ClickHouse.
+
+       As a guard against duplicating data, look for the file in the
+       import ledger, and if it is there the file is already imported.
+       Once the data is inserted, the file is recorded in the ledger,
+       before anything else that might fail and cause a retry.
+
+       To reduce the number of parts ClickHouse must create and merge,
+       other pending TSV files with data for the same partition are
+       imported with the file in a single insert. Those files are
+       locked while being imported, and removed if the insert succeeds,
+       so their own jobs find them gone. If the insert fails, they are
+       left for their own jobs, so failures are reported against the
+       file that caused them.
+
+       A file imported on its own is inserted in chunks of rows, with
+       progress recorded after each chunk, so a retry after a failure
+       part way through resumes where the import stopped.
+
+       If ClickHouse has too many parts waiting to be merged, the import
+       is deferred. Otherwise files are imported without delay."""
+    ctx.require('clickhouse-client')
+    primary = djb.claim(path, wait=True)
+    if not primary:
+        logging.warning('{} not found.'.format(path))
+        return SUCCESS
+
+    batch = []
+    try:
+        chcfg = ctx.cfg['clickhouse']
+        server = random.choice(chcfg['import-server'].split(','))
+        database = chcfg['database']
+        chunked = int(ctx.cfg['worker']['import-chunk-rows']) > 0
+        progress = dtsv.ImportProgress(path, primary) if chunked else None
+
+        # Part of a file being resumed is already in the query table,
+        # so don't probe for its first record.
+        values, fmt = dtsv.check_values(path)
+        resuming = progress is not None and progress.resuming
+        if values and _imported(ctx, server, [(path, values)], probe=not resuming):
+            djb.remove(path.with_name(path.name + '.info'))
+            if progress:
+                progress.remove()
+            return SUCCESS
+
+        deferral = ctx.insert_deferral()
+        if deferral:
+            notbefore, reason = deferral
+            raise JobError(TRANSIENT_FAILURE,
+                           'Import deferred until {:%Y-%m-%d %H:%M:%S}, {}.'.format(
+                               notbefore, reason), notbefore=notbefore)
+
+        claimed = dtsv.claim_batch(ctx, path, primary, fmt) if not resuming else []
+        done = _imported(ctx, server, [(other, ovalues)
+                                       for other, _, ovalues in claimed if ovalues])
+        for other, f, ovalues in claimed:
+            if other in done:
+                djb.remove(other, other.with_name(other.name + '.info'))
+                f.close()
+            else:
+                batch.append((other, f, ovalues))
+        paths = [path] + [p for p, _, _ in batch]
+        files = [primary] + [f for _, f, _ in batch]
+        if batch:
+            logging.info('Importing {} with {}'.format(
+                path, ', '.join(p.name for p, _, _ in batch)))
+
+        # Insert with distributed sync. Helps ensure we don't race ahead of ClickHouse's
+        # ability to digest incoming data. If inserting into a shard directly, the
+        # setting has no effect.
+        insert_server, shard = ctx.insert_target(values['nodeid'] if values else None, server)
+        client = ['clickhouse-client', '--insert_distributed_sync=1', '--host', insert_server,
+                  '--user', chcfg['user'], '--password', chcfg['password']]
+        query = 'INSERT INTO {}.{} FORMAT {}'.format(
+            database, _insert_table(chcfg, 'querytable', shard), fmt)
+        if chunked and not batch:
+            rows = [dtsv.insert_chunked(ctx, client, insert_server, query, path, primary,
+                                        fmt, progress)]
+        else:
+            ok, err = dtsv.insert(client, query, files, fmt == 'TabSeparatedWithNames')
+            if not ok:
+                if batch:
+                    ctx.failed_batch.update(paths)
+                raise JobError(TRANSIENT_FAILURE,
+                               'ClickHouse import failed on server {}{}.\n{}'.format(
+                                   insert_server,
+                                   ' with {}'.format(', '.join(p.name for p, _, _ in batch))
+                                   if batch else '',
+                                   err))
+            rows = [dtsv.count_rows(f, fmt) for f in files]
+            ctx.rows = sum(rows)
+        _record_imported(ctx, server, [(v['nodeid'], dil.source_name(p.name), n)
+                                       for p, v, n in zip(
+                                           paths, [values] + [v for _, _, v in batch], rows)
+                                       if v])
+        if progress:
+            progress.remove()
+
+        infos = []
+        try:
+            for p in paths:
+                try:
+                    infos.append(p.with_name(p.name + '.info').open('rb'))
+                except FileNotFoundError:
+                    pass
+            if infos:
+                ok, err = dtsv.insert(client, 'INSERT INTO {}.{} FORMAT TabSeparated'.format(
+                    database, _insert_table(chcfg, 'packetcountstable', shard)), infos, False)
+                if not ok:
+                    raise JobError(TRANSIENT_FAILURE,
+                                   'ClickHouse packet count import failed on server {}.\n{}'.format(
+                                       insert_server, err))
+        finally:
+            for f in infos:
+                f.close()
+
+        for p in paths:
+            djb.remove(p.with_name(p.name + '.info'))
+        ctx.failed_batch.difference_update(paths)
+        # The worker removes the primary file.
+        for p, _, _ in batch:
+            djb.remove(p)
+    finally:
+        for _, f, _ in batch:
+            f.close()
+        primary.close()
+    return SUCCESS
+
+def cdns_to_pcap(ctx, path):
+    """Convert a C-DNS file to PCAP.
+
+       The PCAP is written to the directory containing the C-DNS file,
+       or its parent if that directory is a pending directory."""
+    ctx.require('inspector', 'xz')
+    pcapcfg = ctx.cfg['pcap']
+    args = dpf.pcap_args(ctx)
+
+    outdir = path.parent
+    if outdir.name == dp.PENDING_DIR:
+        outdir = outdir.parent
+    readers, basename = _decompressed(ctx, path)
+    pcap = outdir / (basename + '.pcap')
+
+    # A cdns-to-tsv job generating the PCAP as well holds a lock on
+    # the file, and removes it when done.
+    lock = djb.claim(path, wait=True)
+    if not lock:
+        logging.warning('{} not found.'.format(path))
+        return SUCCESS
+
+    try:
+        # Ensure if re-generating we don't end up with -1 etc. outputs but replace.
+        if pcapcfg['replace']:
+            djb.remove(pcap, outdir / (basename + '.pcap.xz'),
+                       outdir / (basename + '.pcap.info'))
+        with path.open('rb') as inf:
+            ok, err = djb.pipeline(readers + [['inspector'] + args + ['-o', str(pcap)]],
+                                   stdin=subprocess.DEVNULL if readers else inf,
+                                   stdout=subprocess.DEVNULL)
+        if not ok:
+            raise JobError(FAILURE, 'Error converting file\n' + err)
+    except BaseException:
+        djb.remove(*outdir.glob(basename + '.pcap*'))
+        raise
+    finally:
+        lock.close()
+    return SUCCESS
+
+# The in-process handler for each queue. Jobs on queues not listed
+# here are run by the external command dsv-<queue name>.
+HANDLERS = {
+    'cdns-to-tsv': cdns_to_tsv,
+    'import-tsv': import_tsv,
+    'cdns-to-pcap': cdns_to_pcap,
+}
+
+def run_external(queue, arg):
+    """Run a job with the external command dsv-<queue name>."""
+    return subprocess.run(['dsv-' + queue, arg],
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE,
+                           check=False)
+
+def not_before(res):
+    """Return the time before which a job deferred with a transient
+       failure should not be retried, or None if the job was not
+       deferred."""
+    if res.returncode != TRANSIENT_FAILURE or not res.stdout:
+        return None
+    for line in res.stdout.decode(errors='replace').splitlines():
+        if line.startswith(NOT_BEFORE):
+            try:
+                return datetime.datetime.fromtimestamp(float(line[len(NOT_BEFORE):]))
+            except (ValueError, OverflowError):
+                pass
+    return None
+
+def run_job(ctx, queue, arg, retry_count=0):
+    """Run a job, in-process if there is a handler for the queue.
+
+       If ctx is None, always use the external command.
+       Return a subprocess.CompletedProcess, which for in-process jobs
+       is a JobResult."""
+    handler = HANDLERS.get(queue) if ctx else None
+    if not handler:
+        return run_external(queue, arg)
+    ctx.rows = None
+    ctx.retry_count = retry_count
+    stdout = ''
+    try:
+        returncode = handler(ctx, pathlib.Path(arg))
+        stderr = ''
+    except dp.UnknownDirError as err:
+        returncode = FAILURE
+        stderr = str(err)
+    except JobError as err:
+        returncode = err.returncode
+        stderr = str(err)
+        if err.notbefore:
+            stdout = NOT_BEFORE + str(err.notbefore.timestamp())
+    except OSError as err:
+        # Disk full, too many open files and the like, which may well
+        # clear, so retry.
+        returncode = TRANSIENT_FAILURE
+        stderr = str(err)
+    return JobResult([queue, arg], returncode, stdout=stdout.encode(), stderr=stderr.encode(),
+                     rows=ctx.rows)
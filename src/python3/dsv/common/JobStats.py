@@ -0,0 +1,109 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Record statistics for each job run by a worker in the ClickHouse
+# table dsv.JobStats.
+#
+# Rows are buffered, and inserted when the buffer reaches a set size
+# or a set interval has passed since the last insert, so recording
+# adds no per-job round trip to ClickHouse. If an insert fails, the
+# rows are kept and inserted with the next batch, up to a limit.
+
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+import clickhouse_driver.errors
+
+import dsv.common.JobHandlers as djh
+import dsv.common.Path as dp
+
+# Maximum number of batches to hold if ClickHouse is unavailable.
+# Beyond this, the oldest rows are discarded.
+MAX_PENDING_BATCHES = 10
+
+INSERT = 'INSERT INTO dsv.JobStats(Date, DateTime, Host, Queue, NodeID, ' \
+         'FileName, FileSize, Rows, ExitCode, RetryCount, QueueWait, RunTime) VALUES'
+
+def file_size(path):
+    """Return the size of the file, or 0 if it can't be read."""
+    try:
+        return os.stat(str(path)).st_size
+    except OSError:
+        return 0
+
+class JobStatsRecorder:
+    def __init__(self, ctx, batch_size, flush_interval):
+        """Create a recorder.
+
+           ctx is a HandlerContext used to look up node IDs and to
+           connect to ClickHouse."""
+        self._ctx = ctx
+        self._batch_size = max(batch_size, 1)
+        self._flush_interval = flush_interval
+        self._host = socket.gethostname()
+        self._lock = threading.Lock()
+        self._rows = []
+        self._next_flush = time.monotonic() + flush_interval
+
+    def close(self):
+        with self._lock:
+            self._flush()
+        self._ctx.close()
+
+    def _node_id(self, path):
+        try:
+            dsvpath = dp.DSVPath(path)
+            return self._ctx.node_id(dsvpath.server, dsvpath.node) or 0
+        except (dp.UnknownDirError, djh.JobError):
+            return 0
+
+    def record(self, queue, arg, retry_count, size, queued, started, runtime, res,
+               node_id=None):
+        """Record a job.
+
+           queued and started are datetimes, queued None if not known.
+           runtime is in seconds. res is the job result. If node_id is
+           not given, it is found from the job file path."""
+        wait = max((started - queued).total_seconds(), 0.0) if queued else None
+        with self._lock:
+            self._rows.append({'Date': started.date(),
+                               'DateTime': started,
+                               'Host': self._host,
+                               'Queue': queue,
+                               'NodeID': node_id if node_id is not None
+                                         else self._node_id(arg),
+                               'FileName': os.path.basename(arg),
+                               'FileSize': size,
+                               'Rows': getattr(res, 'rows', None) or 0,
+                               'ExitCode': res.returncode & 0xff,
+                               'RetryCount': retry_count,
+                               'QueueWait': wait,
+                               'RunTime': runtime})
+            if len(self._rows) >= self._batch_size or time.monotonic() >= self._next_flush:
+                self._flush()
+
+    def _flush(self):
+        self._next_flush = time.monotonic() + self._flush_interval
+        if not self._rows:
+            return
+        server = random.choice([s.strip() for s in self._ctx.cfg['clickhouse']['servers'].split(',')
+                                if s.strip()])
+        try:
+            self._ctx.clickhouse(server).execute(INSERT, self._rows)
+            self._rows = []
+        except (clickhouse_driver.errors.Error, OSError, EOFError) as err:
+            self._ctx.clickhouse_failed(server)
+            logging.warning('Job stats insert failed on server {}: {}'.format(server, err))
+            excess = len(self._rows) - MAX_PENDING_BATCHES * self._batch_size
+            if excess > 0:
+                logging.warning('Discarding {} job stats rows'.format(excess))
+                del self._rows[:excess]
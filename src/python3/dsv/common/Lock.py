@@ -7,9 +7,14 @@
 # Developed by Sinodun IT (sinodun.com)
 
 import fcntl
+import logging
 import pathlib
 import pwd
 import os
+import threading
+import time
+
+import dsv.common.Inotify as dinotify
 
 class NoSuchUserException(Exception):
     """Exception raised when there is no such user as the one specified for locking."""
@@ -44,6 +49,11 @@ class DSVLock:
     def __init__(self, user, lockpath):
         self._lock = pathlib.Path(lockpath)
         self._user = DSVUser(user)
+        self._lockfile = None
+
+    @property
+    def path(self):
+        return self._lock
 
     def _ensure_lockfile(self):
         # pylint: disable=no-member
@@ -67,6 +77,8 @@ class DSVLock:
         self._ensure_lockfile()
         f = self._lock.open('w')
         fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # Keep the file open, or the lock is released when it is closed.
+        self._lockfile = f
 
     def is_frozen(self):
         """Is the lock currently frozen?
@@ -95,3 +107,107 @@ class DSVLock:
         """
         self._ensure_lockfile()
         self._lock.chmod(self._get_mode() | 0o200)
+
+# Interval, in seconds, between checks of lock state if inotify
+# is not available.
+FREEZE_POLL_INTERVAL = 1
+
+class FreezeWatcher:
+    """Watch a set of locks for freezing and thawing.
+
+       The frozen state of the locks is kept up to date by a background
+       thread, using inotify on the lock directories to learn of changes.
+       Listeners are called from that thread whenever the set of frozen
+       locks changes. If inotify is not available, the locks are checked
+       every FREEZE_POLL_INTERVAL seconds instead."""
+    def __init__(self, locks):
+        """locks is a dictionary of DSVLock keyed by name."""
+        self._locks = locks
+        self._listeners = []
+        self._mutex = threading.Lock()
+        self._changed = threading.Event()
+        self._frozen = self._check()
+        self._inotify = None
+        self._thread = None
+        self._running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def frozen(self):
+        """Return the set of names of frozen locks."""
+        with self._mutex:
+            return self._frozen
+
+    def add_listener(self, listener):
+        """Add a function to be called with no arguments when the
+           set of frozen locks changes."""
+        self._listeners.append(listener)
+
+    def wait(self, timeout=None):
+        """Wait up to timeout seconds for the set of frozen locks to
+           change. Return True if it has changed since the last wait."""
+        res = self._changed.wait(timeout)
+        self._changed.clear()
+        return res
+
+    def _check(self):
+        return frozenset(name for name, lock in self._locks.items() if lock.is_frozen())
+
+    def start(self):
+        try:
+            self._inotify = dinotify.Inotify()
+            for lockdir in {lock.path.parent for lock in self._locks.values()}:
+                lockdir.mkdir(0o755, parents=True, exist_ok=True)
+                self._inotify.add_watch(lockdir,
+                                        dinotify.IN_ATTRIB | dinotify.IN_CREATE |
+                                        dinotify.IN_DELETE | dinotify.IN_MOVED_FROM |
+                                        dinotify.IN_MOVED_TO)
+        except OSError as err:
+            logging.warning('Lock changes not watchable, polling: {}'.format(err))
+            if self._inotify:
+                self._inotify.close()
+                self._inotify = None
+        # Catch any change made before the watches were in place.
+        self._update()
+        self._running = True
+        self._thread = threading.Thread(target=self._watch, name='FreezeWatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    def _update(self):
+        frozen = self._check()
+        with self._mutex:
+            if frozen == self._frozen:
+                return
+            logging.info('Frozen queues now: {}'.format(', '.join(sorted(frozen)) or 'none'))
+            self._frozen = frozen
+        self._changed.set()
+        for listener in self._listeners:
+            listener()
+
+    def _watch(self):
+        names = {lock.path.name for lock in self._locks.values()}
+        while self._running:
+            if self._inotify:
+                # Wake periodically only to notice stop().
+                events = self._inotify.read(FREEZE_POLL_INTERVAL)
+                if any(e.name in names or e.mask & dinotify.IN_Q_OVERFLOW for e in events):
+                    self._update()
+            else:
+                time.sleep(FREEZE_POLL_INTERVAL)
+                self._update()
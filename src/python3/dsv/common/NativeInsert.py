@@ -0,0 +1,156 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Insert TSV data into ClickHouse with the native protocol.
+#
+# clickhouse-client sends TSV as text, which the server parses. Here
+# each TSV field is converted in the worker to the value for the
+# column type, and clickhouse_driver sends the values to the server
+# in typed column blocks. Rows are read and sent incrementally from
+# any iterable of lines, such as a pipe from inspector, so the data
+# need not be written to disk.
+
+import datetime
+import re
+
+import clickhouse_driver.errors
+
+class ConversionError(Exception):
+    """Exception raised when TSV data can't be converted for insertion."""
+
+# Errors from the ClickHouse client, as opposed to errors in the data.
+CLIENT_ERRORS = (clickhouse_driver.errors.Error, OSError, EOFError)
+
+_ESCAPE_RE = re.compile(rb'\\(x[0-9a-fA-F]{2}|.)', re.DOTALL)
+_ESCAPES = {b'b': b'\b', b'f': b'\f', b'r': b'\r', b'n': b'\n', b't': b'\t',
+            b'0': b'\0', b'a': b'\a', b'v': b'\v'}
+
+def _unescape_match(m):
+    esc = m.group(1)
+    if len(esc) == 3:
+        return bytes([int(esc[1:], 16)])
+    return _ESCAPES.get(esc, esc)
+
+def unescape(value):
+    """Return a TSV String field value, with escapes replaced."""
+    if b'\\' not in value:
+        return value
+    return _ESCAPE_RE.sub(_unescape_match, value)
+
+def _int(value):
+    return int(value) if value else 0
+
+def _float(value):
+    return float(value) if value else 0.0
+
+def _fixed_string(value):
+    # Visualizer TSV gives addresses as hex strings.
+    return bytes.fromhex(value.decode())
+
+def _date_converter():
+    cache = {}
+
+    def convert(value):
+        res = cache.get(value)
+        if res is None:
+            res = datetime.datetime.strptime(value.decode(), '%Y-%m-%d').date()
+            cache[value] = res
+        return res
+    return convert
+
+def converter(chtype):
+    """Return a function converting a TSV field to a value for a column
+       of the ClickHouse type."""
+    if chtype.startswith(('UInt', 'Int')):
+        return _int
+    if chtype.startswith('Float'):
+        return _float
+    if chtype == 'Date':
+        return _date_converter()
+    if chtype == 'DateTime':
+        # Visualizer TSV gives times as seconds since the epoch, which
+        # clickhouse_driver takes as is, avoiding time zone conversion.
+        return _int
+    if chtype.startswith('FixedString'):
+        return _fixed_string
+    if chtype == 'String':
+        return unescape
+    raise ConversionError('No conversion for ClickHouse type {}'.format(chtype))
+
+def describe(client, table):
+    """Return a list of the (name, type) of each column in the table."""
+    return [(col[0], col[1]) for col in client.execute('DESCRIBE TABLE {}'.format(table))]
+
+def rows(lines, converters):
+    """Generate rows of converted values from TSV lines."""
+    ncols = len(converters)
+    for n, line in enumerate(lines, 1):
+        fields = line.rstrip(b'\n').split(b'\t')
+        if len(fields) != ncols:
+            raise ConversionError('Line {}: {} fields, expected {}'.format(
+                n, len(fields), ncols))
+        try:
+            yield [conv(field) for conv, field in zip(converters, fields)]
+        except ValueError as err:
+            raise ConversionError('Line {}: {}'.format(n, err))
+
+class TSVInserter:
+    """Insert TSV data into a table, using a ClickHouse client."""
+    def __init__(self, client, table, block_size):
+        self._client = client
+        self._table = table
+        self._block_size = block_size
+        self._columns = describe(client, table)
+        # Rows inserted, and rows read in the current insert.
+        self.rows = 0
+        self.read = 0
+
+    def insert(self, lines, with_names=False):
+        """Insert the rows in an iterable of TSV lines, as bytes.
+
+           If with_names is True, the first line gives the column names.
+           Otherwise the columns are in table order."""
+        lines = iter(lines)
+        if with_names:
+            header = next(lines, b'').rstrip(b'\n').decode()
+            names = header.split('\t') if header else []
+            types = dict(self._columns)
+            missing = [name for name in names if name not in types]
+            if missing:
+                raise ConversionError('No columns {} in {}'.format(
+                    ', '.join(missing), self._table))
+            columns = [(name, types[name]) for name in names]
+        else:
+            columns = self._columns
+        if not columns:
+            return 0
+        converters = [converter(chtype) for _, chtype in columns]
+
+        self.read = 0
+
+        def counting(gen):
+            for row in gen:
+                self.read += 1
+                yield row
+
+        self._client.execute(
+            'INSERT INTO {} ({}) VALUES'.format(self._table,
+                                                ', '.join(name for name, _ in columns)),
+            counting(rows(lines, converters)),
+            settings={'insert_block_size': self._block_size,
+                      'strings_as_bytes': True,
+                      'insert_distributed_sync': 1})
+        self.rows += self.read
+        return self.read
+
+    @property
+    def partial(self):
+        """After a failed insert, whether data may have been sent.
+
+           A block is sent when block_size rows have been read."""
+        return self.read >= self._block_size
@@ -0,0 +1,172 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Resolve server and node names to node IDs.
+#
+# The IDs of all nodes, under both their names and alternate names, are
+# loaded from Postgres in one query and held in memory. The map is also
+# saved to a snapshot file, so short-lived processes can read it
+# without going to Postgres. dsv-nodes-update writes a new snapshot
+# when the nodes change, and a process holding the map reloads it when
+# it sees a new snapshot.
+#
+# A name not in the map may be a node added since the map was loaded,
+# possibly by dsv-nodes-update on another host, so a miss reloads the
+# map from Postgres.
+
+import json
+import logging
+import os
+import tempfile
+import time
+
+import psycopg2
+
+# Minimum interval, in seconds, between checks for a new snapshot.
+CHECK_INTERVAL = 1
+
+# Minimum interval, in seconds, between reloads from Postgres to look
+# for a node not found. A node missing from the nodes tables would
+# otherwise cost a full reload on every lookup.
+MISS_RELOAD_INTERVAL = 60
+
+def query_node_ids(pgcfg):
+    """Return a dictionary mapping (server name, node name) to node ID
+       for all nodes, read from Postgres.
+
+       Each node appears under all combinations of server and node name
+       and alternate name."""
+    conn = psycopg2.connect(host=pgcfg['host'],
+                            dbname=pgcfg['database'],
+                            user=pgcfg['user'],
+                            password=pgcfg['password'])
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT node_server.name, node_server.altname, '
+                        '       node.name, node.altname, node.id FROM node '
+                        'INNER JOIN node_server ON node_server.id = node.server_id')
+            recs = cur.fetchall()
+        conn.rollback()
+    finally:
+        conn.close()
+    res = {}
+    for server, server_alt, node, node_alt, node_id in recs:
+        for s in (server, server_alt):
+            for n in (node, node_alt):
+                if s and n:
+                    res[(s, n)] = node_id
+    return res
+
+def read_snapshot(path):
+    """Read a snapshot file.
+
+       Return a tuple of the snapshot version and node ID dictionary,
+       or None if the snapshot is missing or can't be read."""
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+        return (snapshot['version'],
+                {(server, node): node_id for server, node, node_id in snapshot['nodes']})
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        logging.warning('Ignoring node ID snapshot {}: {}'.format(path, err))
+        return None
+
+def write_snapshot(path, version, node_ids):
+    """Atomically write a snapshot file."""
+    dirname = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.node-ids-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': version,
+                       'nodes': sorted([server, node, node_id]
+                                       for (server, node), node_id in node_ids.items())},
+                      f)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+class NodeIdResolver:
+    """Look up node IDs from server and node names."""
+    def __init__(self, pgcfg, snapshot=None):
+        """Create a resolver.
+
+           pgcfg is the Postgres configuration. snapshot is the path of
+           the snapshot file, or None if there is no snapshot."""
+        self._pgcfg = pgcfg
+        self._snapshot = snapshot or None
+        self._node_ids = None
+        self._version = 0
+        self._stat = None
+        self._next_check = 0
+        self._next_reload = 0
+
+    def _snapshot_stat(self):
+        try:
+            st = os.stat(self._snapshot)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _check_snapshot(self):
+        """Load the snapshot if it has changed since last loaded."""
+        now = time.monotonic()
+        if now < self._next_check and self._node_ids is not None:
+            return
+        self._next_check = now + CHECK_INTERVAL
+        stat = self._snapshot_stat()
+        if stat is None or stat == self._stat:
+            return
+        snapshot = read_snapshot(self._snapshot)
+        if snapshot:
+            self._version, self._node_ids = snapshot
+            self._stat = stat
+
+    def reload(self, new_version=False):
+        """Load the node IDs from Postgres. If they have changed, or
+           new_version is True, write a new snapshot.
+
+           Return the snapshot version."""
+        node_ids = query_node_ids(self._pgcfg)
+        self._next_reload = time.monotonic() + MISS_RELOAD_INTERVAL
+        changed = node_ids != self._node_ids
+        self._node_ids = node_ids
+        if self._snapshot and (changed or new_version):
+            current = read_snapshot(self._snapshot)
+            if current and current[1] == node_ids and not new_version:
+                self._version = current[0]
+                self._stat = self._snapshot_stat()
+                return self._version
+            self._version = max(self._version, current[0] if current else 0) + 1
+            try:
+                write_snapshot(self._snapshot, self._version, self._node_ids)
+                self._stat = self._snapshot_stat()
+            except OSError as err:
+                logging.warning('Cannot write node ID snapshot {}: {}'.format(
+                    self._snapshot, err))
+        return self._version
+
+    def node_id(self, server, node):
+        """Return the node ID for the server and node names, or None.
+
+           If the node is not known, reload from Postgres, but no more
+           than once every MISS_RELOAD_INTERVAL seconds.
+
+           Raise psycopg2.Error if Postgres must be queried and the
+           query fails."""
+        if self._snapshot:
+            self._check_snapshot()
+        if self._node_ids is not None:
+            res = self._node_ids.get((server, node))
+            if res is not None or time.monotonic() < self._next_reload:
+                return res
+        self.reload()
+        return self._node_ids.get((server, node))
@@ -0,0 +1,141 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Generation of PCAP from a C-DNS file along with its conversion to TSV.
+#
+# Rather than decompress and read the C-DNS file a second time in a
+# separate cdns-to-pcap job, tee copies the data being converted to
+# TSV to a second inspector, which writes the PCAP.
+
+import logging
+import os
+import subprocess
+import tempfile
+
+import dsv.common.JobBase as djb
+import dsv.common.Path as dp
+
+def pcap_args(ctx):
+    """Return the inspector arguments to write PCAP as configured."""
+    pcapcfg = ctx.cfg['pcap']
+    args = []
+    if pcapcfg['compress']:
+        args += ['-x', '-u', pcapcfg['compression-level']]
+    if pcapcfg['query-only']:
+        args += ['-q']
+    if pcapcfg['pseudo-anonymise']:
+        if pcapcfg['pseudo-anonymisation-key']:
+            args += ['-p', '-k', pcapcfg['pseudo-anonymisation-key']]
+        elif pcapcfg['pseudo-anonymisation-passphrase']:
+            args += ['-p', '-P', pcapcfg['pseudo-anonymisation-passphrase']]
+    return args
+
+class PcapFanout:
+    """Generate PCAP from the same read of a C-DNS file as the TSV.
+
+       tee copies the uncompressed C-DNS data to a second inspector,
+       which writes the PCAP. If the PCAP is written, the pending
+       cdns-to-pcap link is removed, so that job finds nothing to do.
+       Otherwise the link is left for that job, which reports any
+       error."""
+    def __init__(self, ctx, pending, lock):
+        self._pending = pending
+        self._lock = lock
+        self._outdir = pending.parent.parent
+        self._basename = pending.stem if pending.suffix == '.xz' else pending.name
+        self._cmd = ['inspector'] + pcap_args(ctx) + [
+            '-o', str(self._outdir / (self._basename + '.pcap'))]
+        self._replace = ctx.cfg['pcap']['replace']
+        self._proc = None
+        self._err = None
+        self._inputs = []
+
+    def start_pipeline(self, readers, cmd, stdin, stdout):
+        """Start a conversion pipeline, with tee passing the data to
+           the PCAP inspector as well. Return the pipeline processes."""
+        # Ensure if re-generating we don't end up with -1 etc. outputs but replace.
+        if self._replace:
+            self._remove_outputs()
+        rfd, wfd = os.pipe()
+        # stderr isn't read until the pipeline finishes, so must not be
+        # a pipe that could fill and block the inspector, and so tee.
+        self._err = tempfile.TemporaryFile()
+        try:
+            self._proc = subprocess.Popen(self._cmd, stdin=rfd, stdout=subprocess.DEVNULL,
+                                          stderr=self._err)
+        finally:
+            os.close(rfd)
+        try:
+            # Don't stop the conversion if the PCAP inspector exits.
+            tee = ['tee', '--output-error=warn-nopipe', '/dev/fd/{}'.format(wfd)]
+            procs = djb.start_pipeline(readers + [tee, cmd], stdin, stdout,
+                                       pass_fds={len(readers): (wfd,)})
+        finally:
+            os.close(wfd)
+        self._inputs = procs[:len(readers) + 1]
+        return procs
+
+    def finish(self):
+        """Wait for the PCAP inspector, once the pipeline has finished.
+
+           Return True if the PCAP was written."""
+        self._proc.wait()
+        err = djb.read_errfile(self._err)
+        # The PCAP is only complete if all the data was read.
+        ok = self._proc.returncode == 0 and all(p.returncode == 0 for p in self._inputs)
+        self._proc = None
+        self._err = None
+        if ok:
+            djb.remove(self._pending)
+        else:
+            self._remove_outputs()
+            logging.warning('PCAP generation with TSV failed, leaving {} for '
+                            'cdns-to-pcap.\n{}'.format(self._pending, err))
+        return ok
+
+    def abort(self):
+        """Stop the PCAP inspector and remove any output."""
+        if self._proc:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+            self._remove_outputs()
+        if self._err:
+            self._err.close()
+            self._err = None
+
+    def close(self):
+        self.abort()
+        self._lock.close()
+
+    def _remove_outputs(self):
+        djb.remove(*self._outdir.glob(self._basename + '.pcap*'))
+
+def pcap_fanout(ctx, path):
+    """If a cdns-to-pcap job for the C-DNS file is pending, and not
+       running, claim it to generate the PCAP along with the TSV.
+
+       Return a PcapFanout, or None if not combining."""
+    if not ctx.cfg['worker']['combine-pcap']:
+        return None
+    try:
+        pending = dp.DSVPath(path).pcap_pending_dir_path / path.name
+    except dp.UnknownDirError:
+        return None
+    lock = djb.claim(pending, wait=False)
+    if not lock:
+        return None
+    try:
+        # The pending PCAP link must be to the same C-DNS file.
+        if os.path.samestat(os.fstat(lock.fileno()), path.stat()):
+            ctx.require('tee')
+            return PcapFanout(ctx, pending, lock)
+    except FileNotFoundError:
+        pass
+    lock.close()
+    return None
@@ -5,42 +5,161 @@
 # file, you can obtain one at https://mozilla.org/MPL/2.0/.
 #
 # Developed by Sinodun IT (sinodun.com)
+#
+# Visualizer job queues.
+#
+# Queues are held by a backend chosen by the queue configuration
+# backend setting. The gearman backend uses a GearMan server. The
+# local backend keeps queues in an SQLite database in the datastore,
+# for single host installations, which then need no GearMan server.
+# Both backends offer the same reader and writer interface, and the
+# same job arguments.
 
+import collections
 import datetime
 import enum
+import hashlib
+import itertools
+import json
 import logging
+import os
+import socket
+import sqlite3
 import threading
 import time
 
 import gear
 
+# Queue backends.
+GEARMAN = 'gearman'
+LOCAL = 'local'
+
+BACKENDS = [GEARMAN, LOCAL]
+
 class JobPrecedence(enum.Enum):
     high = gear.PRECEDENCE_HIGH
     normal = gear.PRECEDENCE_NORMAL
     low = gear.PRECEDENCE_LOW
 
+# Job payload format version. Version 1 payloads are JSON objects.
+# Earlier versions sent 'path|notbefore|queued|retry', or before that
+# 'path|notbefore|retry'; these are still read. Readers ignore fields
+# they don't know, so fields can be added without a version change.
+PAYLOAD_VERSION = 1
+
+def _timestamp(value):
+    """Return a datetime from seconds since the epoch, or None."""
+    try:
+        return datetime.datetime.fromtimestamp(float(value)) if value not in (None, '') else None
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+class JobPayload:
+    """The argument of a queued job, and what is known about it.
+
+       Besides the job path, the payload carries the time before which
+       the job should not run, the retry count and the time the job was
+       queued. It may also carry the file size, the node ID, the job
+       precedence and a list of further files for the job, so the worker
+       and schedulers need not find them out again. Those are None if
+       not known."""
+    def __init__(self, path, notbefore=None, retry_count=0, queued=None, size=None,
+                 node_id=None, precedence=None, files=None):
+        self.path = path
+        self.notbefore = notbefore
+        self.retry_count = retry_count
+        self.queued = queued
+        self.size = size
+        self.node_id = node_id
+        self.precedence = precedence
+        self.files = files
+
+    def encode(self):
+        payload = {'v': PAYLOAD_VERSION, 'path': self.path, 'retry': self.retry_count}
+        if self.notbefore:
+            payload['notbefore'] = self.notbefore.timestamp()
+        if self.queued:
+            payload['queued'] = self.queued.timestamp()
+        if self.size is not None:
+            payload['size'] = self.size
+        if self.node_id is not None:
+            payload['node'] = self.node_id
+        if self.precedence is not None:
+            payload['precedence'] = self.precedence.name
+        if self.files:
+            payload['files'] = self.files
+        return json.dumps(payload, separators=(',', ':')).encode()
+
+    @classmethod
+    def decode(cls, data):
+        """Return the payload from a job argument string."""
+        if data.startswith('{'):
+            try:
+                payload = json.loads(data)
+                return cls(str(payload['path']),
+                           notbefore=_timestamp(payload.get('notbefore')),
+                           retry_count=int(payload.get('retry', 0)),
+                           queued=_timestamp(payload.get('queued')),
+                           size=payload.get('size'),
+                           node_id=payload.get('node'),
+                           precedence=JobPrecedence.__members__.get(payload.get('precedence')),
+                           files=payload.get('files'))
+            except (ValueError, KeyError, TypeError) as err:
+                logging.warning('Malformed job payload {}: {}'.format(data, err))
+        params = data.split('|')
+        try:
+            retry_count = int(params[-1])
+        except ValueError:
+            retry_count = 0
+        return cls(params[0],
+                   notbefore=_timestamp(params[1]) if len(params) > 2 else None,
+                   retry_count=retry_count,
+                   queued=_timestamp(params[2]) if len(params) > 3 else None)
+
 class QueueJob:
     def __init__(self, job):
         self._job = job
+        self._payload = None
 
     @property
     def queue(self):
         return self._job.name.decode()
 
+    @property
+    def _arguments(self):
+        return self._job.arguments.decode()
+
+    @property
+    def payload(self):
+        if self._payload is None:
+            self._payload = JobPayload.decode(self._arguments)
+        return self._payload
+
     @property
     def arg(self):
-        params = self._job.arguments.decode().split('|')
-        try:
-            retry_count = int(params[-1])
-        except (IndexError, ValueError):
-            retry_count = 0
-        notbefore = None
-        if len(params) > 2:
-            try:
-                notbefore = datetime.datetime.fromtimestamp(float(params[1]))
-            except (IndexError, ValueError, OverflowError):
-                pass
-        return (params[0], notbefore, retry_count)
+        return (self.payload.path, self.payload.notbefore, self.payload.retry_count)
+
+    @property
+    def queued(self):
+        """Return the time the job was queued, or None if not known.
+
+           Jobs queued by earlier versions don't record it."""
+        return self.payload.queued
+
+    @property
+    def size(self):
+        """Return the size of the job file when queued, or None if not known."""
+        return self.payload.size
+
+    @property
+    def node_id(self):
+        """Return the node ID of the job file, or None if not known."""
+        return self.payload.node_id
+
+    @property
+    def precedence(self):
+        """Return the precedence the job was queued with, or None if not known."""
+        return self.payload.precedence
 
     def failed(self):
         self._job.sendWorkFail()
@@ -49,26 +168,36 @@ class QueueJob:
         self._job.sendWorkComplete()
 
 class QueueReader:
+    """Take jobs from queues.
+
+       get() blocks until a job is available. It can be woken early
+       by calling interrupt() from another thread, or by giving a
+       timeout, so the caller can respond to other events."""
     def __init__(self, client_id, host, port):
         self._client = gear.Worker(client_id)
         self._host = host
         self._port = port
-        self._stop_thread = None
-        self._stop_thread_running = False
+        self._cond = threading.Condition()
+        self._interrupt_thread = None
+        self._running = False
+        self._interrupted = False
+        self._getting = False
 
     def __enter__(self):
         self._client.addServer(self._host, self._port)
         self._client.waitForServer()
-        self._stop_thread_running = True
-        self._stop_thread = threading.Thread(target=self.stop_waiting_for_jobs,
-                                             name='QueueReaderStopWaiting')
-        self._stop_thread.daemon = True
-        self._stop_thread.start()
+        self._running = True
+        self._interrupt_thread = threading.Thread(target=self._interrupter,
+                                                  name='QueueReaderInterrupt')
+        self._interrupt_thread.daemon = True
+        self._interrupt_thread.start()
         return self
 
     def __exit__(self, *args):
-        self._stop_thread_running = False
-        self._stop_thread.join()
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._interrupt_thread.join()
         self._client.shutdown()
 
     def register(self, queue):
@@ -80,24 +209,109 @@ class QueueReader:
     def register_clear(self):
         self._client.setFunctions([])
 
-    def get(self):
+    def get(self, timeout=None):
+        """Return the next job, or None if interrupted or no job
+           arrives within timeout seconds."""
+        with self._cond:
+            if self._interrupted:
+                self._interrupted = False
+                return None
+            self._getting = True
+            self._cond.notify_all()
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self.interrupt)
+            timer.daemon = True
+            timer.start()
         try:
             job = QueueJob(self._client.getJob())
             logging.debug('Got {arg} from {queue}'.format(queue=job.queue, arg=job.arg))
             return job
         except gear.InterruptedError:
             return None
+        finally:
+            if timer:
+                timer.cancel()
+            with self._cond:
+                self._getting = False
+                self._interrupted = False
+
+    def interrupt(self):
+        """Make any current or the next call to get() return None."""
+        with self._cond:
+            self._interrupted = True
+            self._cond.notify_all()
 
-    def stop_waiting_for_jobs(self):
-        while self._stop_thread_running:
-            time.sleep(1)
+    def _interrupter(self):
+        while True:
+            with self._cond:
+                while self._running and not (self._interrupted and self._getting):
+                    self._cond.wait()
+                if not self._running:
+                    return
             self._client.stopWaitingForJobs()
+            with self._cond:
+                # If getJob() was not yet waiting, the interrupt had no
+                # effect. Try again shortly.
+                if self._interrupted and self._getting:
+                    self._cond.wait(0.01)
+
+def _file_size(path):
+    try:
+        return os.stat(str(path)).st_size
+    except OSError:
+        return None
+
+def _job_arg(arg, precedence, notbefore, retry_count, size=None, node_id=None, files=None):
+    """Return the encoded payload for a job.
+
+       If size is not given, it is the size of the job file, if any."""
+    return JobPayload(str(arg), notbefore=notbefore, retry_count=retry_count,
+                      queued=datetime.datetime.now(),
+                      size=size if size is not None else _file_size(arg),
+                      node_id=node_id, precedence=precedence, files=files).encode()
+
+# Job keys.
+#
+# A job newly queued for a file is given a key derived from its queue and
+# path. While a job with the same key is queued or running, another job
+# with that key is not added, so scanning the same pending directories
+# twice doesn't queue each file twice. GearMan coalesces background jobs
+# with the same unique ID, and the local backend refuses a duplicate key.
+#
+# Jobs re-queued by a worker, deferred or retried, have no key. They
+# carry a not before time or retry count that a job newly queued for
+# the same file doesn't. With a key, a re-queue could be coalesced with
+# such a job, and the file run at once or its retries start again.
+# Deferred jobs held by a worker until due are queued again with no
+# not before time, so are added with unique False to have no key; with
+# one, a job due now could be coalesced with a low precedence job
+# waiting behind a backfill.
+
+def _job_key(queue, arg, notbefore, retry_count, unique=True):
+    """Return the key for a job, or None if it is a re-queued job.
+
+       The key is a hash, as GearMan limits unique IDs to 64 bytes."""
+    if notbefore or retry_count or not unique:
+        return None
+    return hashlib.sha1('{}\0{}'.format(queue, arg).encode()).hexdigest()
+
+# Default maximum number of jobs submitted by add_many() before
+# waiting for the server to acknowledge the oldest.
+DEFAULT_SUBMIT_WINDOW = 1000
+
+# Seconds to wait for the server to acknowledge a job submission.
+SUBMIT_TIMEOUT = 30
 
 class QueueWriter:
-    def __init__(self, client_id, host, port):
+    def __init__(self, client_id, host, port, submit_window=DEFAULT_SUBMIT_WINDOW):
         self._client = gear.Client(client_id)
         self._host = host
         self._port = port
+        self._submit_window = max(submit_window, 1)
+        # Submissions must not interleave if the writer is shared
+        # between threads.
+        self._lock = threading.Lock()
 
     def __enter__(self):
         self._client.addServer(self._host, self._port)
@@ -107,19 +321,84 @@ class QueueWriter:
     def __exit__(self, *args):
         self._client.shutdown()
 
-    def add(self, queue, arg, precedence=JobPrecedence.normal, notbefore=None, retry_count=0):
+    def add(self, queue, arg, precedence=JobPrecedence.normal, notbefore=None, retry_count=0,
+            size=None, node_id=None, files=None, unique=True):
+        """Add a job to the queue.
+
+           size, node_id and files are recorded in the job payload. If
+           size is not given, the size of the job file is recorded.
+           If unique is False, the job has no key, and is added even if
+           a job for the same file is queued."""
         logging.debug('Add {arg} to {queue}{precedence}{notbefore}'.format(
             queue=queue, arg=arg,
             precedence=' ({} precedence)'.format(precedence.name) \
             if precedence != JobPrecedence.normal else '',
             notbefore=' (not before {})'.format(notbefore) if notbefore else ''))
-        sarg = str(arg)
-        sarg += '|{notb4}|{retry_count}'.format(
-            notb4=notbefore.timestamp() if notbefore else '',
-            retry_count=retry_count)
-        self._client.submitJob(gear.Job(queue, sarg.encode()),
-                               background=True,
-                               precedence=precedence.value)
+        with self._lock:
+            self._client.submitJob(gear.Job(queue, _job_arg(arg, precedence, notbefore,
+                                                            retry_count, size, node_id, files),
+                                            _job_key(queue, arg, notbefore, retry_count,
+                                                     unique)),
+                                   background=True,
+                                   precedence=precedence.value)
+
+    def add_many(self, queue, args, precedence=JobPrecedence.normal, notbefore=None, retry_count=0,
+                 unique=True):
+        """Add a job to the queue for each item in args.
+
+           Rather than waiting for the server to acknowledge each job
+           before submitting the next, keep up to submit_window jobs
+           in flight, and wait for acknowledgements in submission order.
+           args may be any iterable, and is consumed as jobs are sent.
+
+           Return the number of jobs added. GearMan doesn't report jobs
+           coalesced with one already queued, so these are included.
+           If unique is False, the jobs have no key, as for add()."""
+        cmd = {
+            JobPrecedence.high: gear.constants.SUBMIT_JOB_HIGH_BG,
+            JobPrecedence.normal: gear.constants.SUBMIT_JOB_BG,
+            JobPrecedence.low: gear.constants.SUBMIT_JOB_LOW_BG,
+        }[precedence]
+        with self._lock:
+            res = self._add_many(queue, args, cmd, precedence, notbefore, retry_count, unique)
+        logging.debug('Added {n} jobs to {queue}{precedence}{notbefore}'.format(
+            n=res, queue=queue,
+            precedence=' ({} precedence)'.format(precedence.name) \
+            if precedence != JobPrecedence.normal else '',
+            notbefore=' (not before {})'.format(notbefore) if notbefore else ''))
+        return res
+
+    def _add_many(self, queue, args, cmd, precedence, notbefore, retry_count, unique):
+        conn = self._client.getConnection()
+        inflight = collections.deque()
+        res = 0
+        for arg in args:
+            if len(inflight) >= self._submit_window:
+                self._wait_submitted(inflight.popleft())
+            job = gear.Job(queue, _job_arg(arg, precedence, notbefore, retry_count),
+                           _job_key(queue, arg, notbefore, retry_count, unique))
+            job.background = True
+            # This is what gear.Client.submitJob() does, less the wait.
+            # The connection matches replies to pending tasks in order.
+            task = gear.SubmitJobTask(job)
+            conn.pending_tasks.append(task)
+            packet = gear.Packet(gear.constants.REQ, cmd,
+                                 b'\x00'.join((job.binary_name, job.binary_unique or b'',
+                                                job.binary_arguments)))
+            self._client.sendPacket(packet, conn)
+            inflight.append(task)
+            res += 1
+        while inflight:
+            self._wait_submitted(inflight.popleft())
+        return res
+
+    @staticmethod
+    def _wait_submitted(task):
+        if not task.wait(SUBMIT_TIMEOUT):
+            raise gear.TimeoutError()
+        if task.job.handle is None:
+            raise gear.GearmanError('Job {} not accepted by server'.format(
+                task.job.arguments.decode()))
 
     def status(self):
         req = gear.StatusAdminRequest()
@@ -132,28 +411,434 @@ class QueueWriter:
             res.append((queue, int(jobs), int(running), int(workers)))
         return res
 
+    def duplicates(self):
+        """GearMan does not report jobs coalesced with another, so
+           return None."""
+        return None
+
     def version(self):
         req = gear.VersionAdminRequest()
         self._client.getConnection().sendAdminRequest(req)
         return req.response.decode()
 
+# Local backend.
+#
+# Jobs are rows in an SQLite database in WAL mode, so readers and
+# writers in several processes can use it at once. A reader claims a
+# job by marking it taken, in a transaction, and the job is deleted
+# when done or failed. Jobs taken by a process that has gone away are
+# released when the next reader starts. Jobs are not handed out before
+# their not before time, so the worker need not hold them itself.
+#
+# If promote-after is set, low precedence jobs that have been due for
+# that long are promoted to normal precedence, so a steady stream of
+# normal jobs can't hold back backfill indefinitely. GearMan can't
+# change the precedence of a queued job, so this is local only.
+
+# Bump this if the schema changes. Like the delayed job store, the
+# contents must be preserved, so any change needs a migration.
+LOCAL_SCHEMA_VERSION = 1
+
+# Interval, in seconds, between checks for new jobs while none are
+# available.
+LOCAL_POLL_INTERVAL = 0.1
+
+# Seconds to wait for another process to release a database lock.
+LOCAL_LOCK_TIMEOUT = 30
+
+# Minimum interval, in seconds, between checks for jobs to promote.
+LOCAL_PROMOTE_INTERVAL = 60
+
+# Precedence order of jobs, most urgent first.
+_LOCAL_PRECEDENCE = {
+    JobPrecedence.high: 0,
+    JobPrecedence.normal: 1,
+    JobPrecedence.low: 2,
+}
+
+class LocalQueueJob(QueueJob):
+    def __init__(self, store, jobid, queue, arguments):
+        super().__init__(None)
+        self._store = store
+        self._jobid = jobid
+        self._queue = queue
+        self._arguments_str = arguments
+
+    @property
+    def queue(self):
+        return self._queue
+
+    @property
+    def _arguments(self):
+        return self._arguments_str
+
+    @property
+    def arg(self):
+        # The store only hands out jobs that are due.
+        path, _, retry_count = super().arg
+        return (path, None, retry_count)
+
+    def failed(self):
+        self._store.finish(self._jobid)
+
+    def done(self):
+        self._store.finish(self._jobid)
+
+class _LocalQueueStore:
+    """The SQLite database holding local queues."""
+    def __init__(self, dbpath, promote_after=0):
+        self._dbpath = str(dbpath)
+        self._db = None
+        self._lock = threading.Lock()
+        self._promote_after = promote_after
+        self._next_promote = 0
+        self.owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    def open(self):
+        # The connection is shared between the worker's threads, and
+        # guarded by the lock. Transactions are explicit.
+        self._db = sqlite3.connect(self._dbpath, timeout=LOCAL_LOCK_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._check_schema()
+
+    def close(self):
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def _check_schema(self):
+        ver = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if ver == LOCAL_SCHEMA_VERSION:
+            return
+        if ver:
+            raise sqlite3.DatabaseError('Local queue schema {} is not {}'.format(
+                ver, LOCAL_SCHEMA_VERSION))
+        with self._transaction():
+            self._db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                             '  id INTEGER PRIMARY KEY,'
+                             '  queue TEXT NOT NULL,'
+                             '  precedence INTEGER NOT NULL,'
+                             '  notbefore REAL NOT NULL,'
+                             '  arg TEXT NOT NULL,'
+                             '  owner TEXT,'
+                             '  since REAL NOT NULL,'
+                             '  key TEXT)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS waiting '
+                             'ON jobs(queue, precedence, id) WHERE owner IS NULL')
+            self._db.execute('CREATE UNIQUE INDEX IF NOT EXISTS jobkey ON jobs(key)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS duplicates ('
+                             '  queue TEXT PRIMARY KEY,'
+                             '  count INTEGER NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS workers ('
+                             '  owner TEXT NOT NULL,'
+                             '  queue TEXT NOT NULL,'
+                             '  PRIMARY KEY (owner, queue))')
+            self._db.execute('PRAGMA user_version={}'.format(LOCAL_SCHEMA_VERSION))
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+    def add(self, queue, precedence, notbefore, jobs):
+        """Add jobs in a single transaction.
+
+           jobs is a list of (key, encoded job argument). Jobs with the
+           key of a job already in the store are not added, and counted
+           as duplicates. Return the number of jobs added."""
+        ts = notbefore.timestamp() if notbefore else 0
+        rank = _LOCAL_PRECEDENCE[precedence]
+        now = time.time()
+        with self._lock, self._transaction():
+            n = self._db.executemany(
+                'INSERT OR IGNORE INTO jobs(queue, precedence, notbefore, arg, since, key) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                ((queue, rank, ts, arg, now, key) for key, arg in jobs)).rowcount
+            if n < len(jobs):
+                self._db.execute('INSERT OR IGNORE INTO duplicates(queue, count) VALUES (?, 0)',
+                                 (queue,))
+                self._db.execute('UPDATE duplicates SET count=count+? WHERE queue=?',
+                                 (len(jobs) - n, queue))
+        if n < len(jobs):
+            logging.debug('Skipped {n} jobs already in {queue}'.format(
+                n=len(jobs) - n, queue=queue))
+        return n
+
+    def _promote(self, now):
+        """Promote low precedence jobs due for longer than promote_after.
+
+           Must be called in a transaction."""
+        if not self._promote_after or now < self._next_promote:
+            return
+        self._next_promote = now + LOCAL_PROMOTE_INTERVAL
+        normal = _LOCAL_PRECEDENCE[JobPrecedence.normal]
+        n = self._db.execute(
+            'UPDATE jobs SET precedence=? WHERE owner IS NULL AND precedence>? '
+            'AND max(since, notbefore)<=?',
+            (normal, normal, now - self._promote_after)).rowcount
+        if n:
+            logging.info('Promoted {} low precedence jobs waiting over {}s'.format(
+                n, self._promote_after))
+
+    def take(self, queues):
+        """Claim the next due job from the first of the queues with one.
+
+           Return a LocalQueueJob, or None if no job is due."""
+        if not queues:
+            return None
+        now = time.time()
+        with self._lock:
+            # Idle readers poll often. Check for a due job with a read
+            # before taking the write lock, so they don't hold up writers.
+            if not self._db.execute(
+                    'SELECT 1 FROM jobs WHERE queue IN ({}) AND owner IS NULL AND notbefore<=? '
+                    'LIMIT 1'.format(','.join('?' * len(queues))),
+                    list(queues) + [now]).fetchone():
+                return None
+            with self._transaction():
+                return self._take(queues, now)
+
+    def _take(self, queues, now):
+        """Claim the next due job. Must be called in a transaction."""
+        self._promote(now)
+        for queue in queues:
+            rec = self._db.execute(
+                'SELECT id, arg FROM jobs WHERE queue=? AND owner IS NULL AND notbefore<=? '
+                'ORDER BY precedence, id LIMIT 1', (queue, now)).fetchone()
+            if rec:
+                self._db.execute('UPDATE jobs SET owner=? WHERE id=?', (self.owner, rec[0]))
+                return LocalQueueJob(self, rec[0], queue, rec[1])
+        return None
+
+    def finish(self, jobid):
+        with self._lock, self._transaction():
+            self._db.execute('DELETE FROM jobs WHERE id=?', (jobid,))
+
+    def set_queues(self, queues):
+        """Record the queues this process takes jobs from."""
+        with self._lock, self._transaction():
+            self._db.execute('DELETE FROM workers WHERE owner=?', (self.owner,))
+            self._db.executemany('INSERT INTO workers(owner, queue) VALUES (?, ?)',
+                                 ((self.owner, q) for q in queues))
+
+    def release(self, owner=None):
+        """Return jobs taken by an owner, by default this process, to
+           their queues, and forget its queues."""
+        owner = owner or self.owner
+        with self._lock, self._transaction():
+            n = self._db.execute('UPDATE jobs SET owner=NULL WHERE owner=?', (owner,)).rowcount
+            self._db.execute('DELETE FROM workers WHERE owner=?', (owner,))
+        return n
+
+    def release_orphans(self):
+        """Release jobs taken by processes on this host that have gone away."""
+        host = socket.gethostname()
+        with self._lock:
+            owners = [rec[0] for rec in self._db.execute(
+                'SELECT owner FROM jobs WHERE owner IS NOT NULL '
+                'UNION SELECT owner FROM workers')]
+        for owner in owners:
+            ohost, _, pid = owner.rpartition(':')
+            if ohost == host and not _process_exists(int(pid)):
+                n = self.release(owner)
+                if n:
+                    logging.warning('Returned {} jobs taken by {} to their queues'.format(
+                        n, owner))
+
+    def status(self):
+        """Return (queue, jobs, running, workers) for each queue."""
+        with self._lock:
+            jobs = {rec[0]: rec[1:] for rec in self._db.execute(
+                'SELECT queue, count(), count(owner) FROM jobs GROUP BY queue')}
+            workers = dict(self._db.execute(
+                'SELECT queue, count() FROM workers GROUP BY queue').fetchall())
+        return [(q, jobs.get(q, (0, 0))[0], jobs.get(q, (0, 0))[1], workers.get(q, 0))
+                for q in sorted(set(jobs) | set(workers))]
+
+    def duplicates(self):
+        """Return the number of duplicate jobs not added, by queue."""
+        with self._lock:
+            return dict(self._db.execute('SELECT queue, count FROM duplicates').fetchall())
+
+class _Transaction:
+    """Run statements in an immediate transaction, so writers queue
+       for the database lock at the start rather than failing part way."""
+    def __init__(self, db):
+        self._db = db
+
+    def __enter__(self):
+        self._db.execute('BEGIN IMMEDIATE')
+        return self._db
+
+    def __exit__(self, exc_type, *args):
+        self._db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class LocalQueueReader:
+    """Take jobs from local queues.
+
+       The interface is that of QueueReader. Queues registered later
+       are checked for jobs first, as with GearMan. Low precedence jobs
+       due for over promote_after seconds are promoted, if it is set."""
+    def __init__(self, client_id, dbpath, promote_after=0):
+        self._client_id = client_id
+        self._store = _LocalQueueStore(dbpath, promote_after)
+        self._queues = []
+        self._cond = threading.Condition()
+        self._interrupted = False
+
+    def __enter__(self):
+        self._store.open()
+        self._store.release_orphans()
+        return self
+
+    def __exit__(self, *args):
+        self._store.release()
+        self._store.close()
+
+    def register(self, queue):
+        if queue not in self._queues:
+            self._queues.append(queue)
+            self._store.set_queues(self._queues)
+
+    def unregister(self, queue):
+        if queue in self._queues:
+            self._queues.remove(queue)
+            self._store.set_queues(self._queues)
+
+    def register_clear(self):
+        self._queues = []
+        self._store.set_queues(self._queues)
+
+    def get(self, timeout=None):
+        """Return the next job, or None if interrupted or no job
+           becomes due within timeout seconds."""
+        end = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._cond:
+                if self._interrupted:
+                    self._interrupted = False
+                    return None
+            job = self._store.take(list(reversed(self._queues)))
+            if job:
+                logging.debug('Got {arg} from {queue}'.format(queue=job.queue, arg=job.arg))
+                return job
+            wait = LOCAL_POLL_INTERVAL
+            if end is not None:
+                wait = min(wait, end - time.monotonic())
+                if wait <= 0:
+                    return None
+            with self._cond:
+                if not self._interrupted:
+                    self._cond.wait(wait)
+
+    def interrupt(self):
+        """Make any current or the next call to get() return None."""
+        with self._cond:
+            self._interrupted = True
+            self._cond.notify_all()
+
+class LocalQueueWriter:
+    """Add jobs to local queues.
+
+       The interface is that of QueueWriter."""
+    def __init__(self, client_id, dbpath, submit_window=DEFAULT_SUBMIT_WINDOW):
+        self._client_id = client_id
+        self._store = _LocalQueueStore(dbpath)
+        self._submit_window = max(submit_window, 1)
+
+    def __enter__(self):
+        self._store.open()
+        return self
+
+    def __exit__(self, *args):
+        self._store.close()
+
+    def add(self, queue, arg, precedence=JobPrecedence.normal, notbefore=None, retry_count=0,
+            size=None, node_id=None, files=None, unique=True):
+        logging.debug('Add {arg} to {queue}{precedence}{notbefore}'.format(
+            queue=queue, arg=arg,
+            precedence=' ({} precedence)'.format(precedence.name) \
+            if precedence != JobPrecedence.normal else '',
+            notbefore=' (not before {})'.format(notbefore) if notbefore else ''))
+        self._store.add(queue, precedence, notbefore,
+                        [(_job_key(queue, arg, notbefore, retry_count, unique),
+                          _job_arg(arg, precedence, notbefore, retry_count,
+                                   size, node_id, files).decode())])
+
+    def add_many(self, queue, args, precedence=JobPrecedence.normal, notbefore=None, retry_count=0,
+                 unique=True):
+        """Add a job to the queue for each item in args.
+
+           Jobs are committed in transactions of up to submit_window
+           jobs. Return the number of jobs added, not counting
+           duplicates of jobs already queued. If unique is False, the
+           jobs have no key, as for add()."""
+        res = 0
+        args = iter(args)
+        while True:
+            batch = [(_job_key(queue, arg, notbefore, retry_count, unique),
+                      _job_arg(arg, precedence, notbefore, retry_count).decode())
+                     for arg in itertools.islice(args, self._submit_window)]
+            if not batch:
+                break
+            res += self._store.add(queue, precedence, notbefore, batch)
+        logging.debug('Added {n} jobs to {queue}{precedence}{notbefore}'.format(
+            n=res, queue=queue,
+            precedence=' ({} precedence)'.format(precedence.name) \
+            if precedence != JobPrecedence.normal else '',
+            notbefore=' (not before {})'.format(notbefore) if notbefore else ''))
+        return res
+
+    def status(self):
+        return self._store.status()
+
+    def duplicates(self):
+        return self._store.duplicates()
+
+    def version(self):
+        return 'local SQLite {}'.format(sqlite3.sqlite_version)
+
 class QueueContext:
     def __init__(self, config, client_id):
         gearman_cfg = config['gearman']
         self._host = gearman_cfg['host']
         self._port = gearman_cfg['port']
+        self._submit_window = int(gearman_cfg.get('submit_window', DEFAULT_SUBMIT_WINDOW))
         self._client_id = client_id
+        self._backend = config['queue']['backend']
+        if self._backend not in BACKENDS:
+            raise ValueError('Unknown queue backend {}'.format(self._backend))
+        self._dbpath = config['datastore']['queue_db']
+        self._promote_after = float(config['queue'].get('promote-after', 0))
 
     def reader(self):
+        if self._backend == LOCAL:
+            return LocalQueueReader(self._client_id, self._dbpath, self._promote_after)
         return QueueReader(self._client_id, self._host, self._port)
 
     def writer(self):
-        return QueueWriter(self._client_id, self._host, self._port)
+        if self._backend == LOCAL:
+            return LocalQueueWriter(self._client_id, self._dbpath, self._submit_window)
+        return QueueWriter(self._client_id, self._host, self._port, self._submit_window)
 
     def status(self):
         with self.writer() as writer:
             return writer.status()
 
+    def duplicates(self):
+        """Return the number of duplicate jobs not queued, by queue, or
+           None if the backend doesn't record it."""
+        with self.writer() as writer:
+            return writer.duplicates()
+
     def version(self):
         with self.writer() as writer:
             return writer.version()
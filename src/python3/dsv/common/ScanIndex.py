@@ -0,0 +1,166 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# A persistent index of the contents of datastore directories.
+#
+# Scanning the datastore means reading every node directory and
+# examining every file in it. When a directory holds many thousands
+# of files, as archived C-DNS directories do, this gets slow.
+#
+# The index records, for each directory scanned, the directory
+# modification time and the names of the files it contained. Adding,
+# removing or renaming a directory entry updates the directory
+# modification time, so if the modification time is unchanged the
+# recorded contents can be used without reading the directory again.
+# Only when a directory has changed is it re-read and its recorded
+# contents replaced.
+
+import fnmatch
+import logging
+import os
+import re
+import sqlite3
+import time
+
+# Bump this if the schema changes. The index is only a cache, so an
+# index with a different schema version is simply discarded.
+SCHEMA_VERSION = 1
+
+# Modification times this close to the present can't be trusted. A
+# file added later in the same filesystem timestamp tick would not
+# change the directory mtime. Such directories are recorded as
+# needing a rescan next time.
+RACY_INTERVAL_NS = 2 * 1000 * 1000 * 1000
+RESCAN_MTIME = -1
+
+class ScanIndex:
+    def __init__(self, dbpath):
+        self._db = sqlite3.connect(str(dbpath))
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._check_schema()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._db:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def _check_schema(self):
+        ver = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if ver == SCHEMA_VERSION:
+            return
+        if ver:
+            logging.info('Scan index schema {} is not {}, rebuilding'.format(
+                ver, SCHEMA_VERSION))
+        with self._db:
+            self._db.execute('DROP TABLE IF EXISTS dirs')
+            # The file names in a directory are held as a single
+            # newline-separated string. Reading the names of an unchanged
+            # directory is then a single primary key lookup.
+            self._db.execute('CREATE TABLE dirs ('
+                             '  path TEXT PRIMARY KEY,'
+                             '  mtime INTEGER NOT NULL,'
+                             '  names TEXT NOT NULL)')
+            self._db.execute('PRAGMA user_version={}'.format(SCHEMA_VERSION))
+
+    def _recorded(self, dpath):
+        rec = self._db.execute('SELECT mtime, names FROM dirs WHERE path=?', (dpath,)).fetchone()
+        if rec:
+            return (rec[0], rec[1].split('\n') if rec[1] else [])
+        return (None, [])
+
+    def _update(self, dpath, mtime):
+        """Re-read a changed directory and record its new contents.
+
+           Return the list of file names now in the directory."""
+        names = []
+        with os.scandir(dpath) as it:
+            for entry in it:
+                if entry.is_file():
+                    names.append(entry.name)
+        names.sort()
+        if int(time.time() * 1000000000) - mtime < RACY_INTERVAL_NS:
+            mtime = RESCAN_MTIME
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO dirs(path, mtime, names) VALUES (?, ?, ?)',
+                             (dpath, mtime, '\n'.join(names)))
+        return names
+
+    def listing(self, dpath):
+        """Return the sorted names of the files in a directory.
+
+           If the directory is unchanged since it was last read, the
+           names are taken from the index and the directory is not read.
+           If the directory does not exist, return an empty list."""
+        dpath = str(dpath)
+        try:
+            mtime = os.stat(dpath).st_mtime_ns
+        except FileNotFoundError:
+            self.forget(dpath)
+            return []
+        recorded_mtime, names = self._recorded(dpath)
+        if recorded_mtime == mtime:
+            return names
+        return self._update(dpath, mtime)
+
+    def files(self, dpath, file_pattern):
+        """Return the sorted names of files in a directory matching the pattern."""
+        match = re.compile(fnmatch.translate(file_pattern)).match
+        return [name for name in self.listing(dpath) if match(name)]
+
+    def forget(self, dpath):
+        """Remove a directory from the index."""
+        with self._db:
+            self._db.execute('DELETE FROM dirs WHERE path=?', (str(dpath),))
+
+    def clear(self):
+        """Remove all entries from the index."""
+        with self._db:
+            self._db.execute('DELETE FROM dirs')
+
+    def directories(self):
+        """Return the paths of all indexed directories."""
+        return [rec[0] for rec in self._db.execute('SELECT path FROM dirs ORDER BY path')]
+
+    def verify(self, dpath):
+        """Check the recorded contents of a directory against the directory.
+
+           Return a tuple of two sets, the names of files present but not
+           recorded and the names of files recorded but not present."""
+        dpath = str(dpath)
+        recorded = set(self._recorded(dpath)[1])
+        actual = set()
+        try:
+            with os.scandir(dpath) as it:
+                for entry in it:
+                    if entry.is_file():
+                        actual.add(entry.name)
+        except FileNotFoundError:
+            pass
+        return (actual - recorded, recorded - actual)
+
+def open_scan_index(dbpath):
+    """Open the scan index, if one is configured.
+
+       Return None if no index is configured or the index can't be
+       opened. In the latter case, log a warning; the datastore can
+       always be scanned directly."""
+    if not dbpath:
+        return None
+    try:
+        return ScanIndex(dbpath)
+    except (OSError, sqlite3.Error) as err:
+        logging.warning('Scan index {} unavailable: {}'.format(dbpath, err))
+        return None
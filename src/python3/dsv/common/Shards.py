@@ -0,0 +1,86 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Choose the ClickHouse shard to insert imported data into.
+#
+# By default data is inserted into the distributed tables on an import
+# server, which passes each block on to a random shard. All data then
+# passes through the import server. Instead, the importer can pick a
+# shard itself and insert directly into the local *Shard tables on the
+# shard server. The ClickHouse servers list is taken as the list of
+# shards, one server per shard.
+
+import itertools
+import random
+import time
+
+# Shard selection modes.
+DISTRIBUTED = 'distributed'
+ROUND_ROBIN = 'round-robin'
+LEAST_LOADED = 'least-loaded'
+NODE = 'node'
+
+MODES = [DISTRIBUTED, ROUND_ROBIN, LEAST_LOADED, NODE]
+
+# Minimum interval, in seconds, between samples of shard part counts.
+LOAD_SAMPLE_INTERVAL = 5
+
+def shard_table(table):
+    """Return the name of the local shard table for a distributed table."""
+    return table + 'Shard'
+
+def servers(chcfg):
+    """Return the list of shard servers."""
+    return [s.strip() for s in chcfg['servers'].split(',') if s.strip()]
+
+class ShardChooser:
+    """Choose the shard server to insert into."""
+    def __init__(self, mode, shards, monitor=None):
+        """Create a chooser.
+
+           mode is one of MODES other than DISTRIBUTED. shards is the
+           list of shard servers. For LEAST_LOADED, monitor is a
+           ClickHouseMonitor for the shards."""
+        if mode not in MODES[1:]:
+            raise ValueError('Unknown shard insert mode {}'.format(mode))
+        self._mode = mode
+        self._shards = shards
+        self._monitor = monitor
+        # Start at a random shard, so workers don't all start together.
+        self._next = itertools.islice(itertools.cycle(shards), random.randrange(len(shards)),
+                                      None)
+        self._parts = None
+        self._next_sample = 0
+
+    def close(self):
+        if self._monitor:
+            self._monitor.close()
+
+    def _least_loaded(self):
+        now = time.monotonic()
+        if now >= self._next_sample:
+            self._next_sample = now + LOAD_SAMPLE_INTERVAL
+            self._parts = self._monitor.server_parts()
+        if not self._parts:
+            return None
+        fewest = min(self._parts.values())
+        return random.choice([s for s in self._shards if self._parts.get(s) == fewest])
+
+    def choose(self, node_id):
+        """Return the shard server to insert data for the node into.
+
+           With LEAST_LOADED, this is the shard with the fewest active
+           parts. If part counts can't be sampled, shards are taken in
+           turn."""
+        if self._mode == NODE:
+            return self._shards[(node_id or 0) % len(self._shards)]
+        if self._mode == LEAST_LOADED:
+            server = self._least_loaded()
+            if server:
+                return server
+        return next(self._next)
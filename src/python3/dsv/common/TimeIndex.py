@@ -0,0 +1,113 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# A time index of the files in a single node directory.
+#
+# Visualizer file names start with the file start time as
+# YYYYMMDD-HHMMSS. With fixed width digit fields, names sorted by
+# name are also sorted by start time, and comparing the name with a
+# date/time in the same format compares the start times. So files
+# in a date range can be found in a sorted list of names by binary
+# search, without parsing any name or examining any file.
+#
+# Files whose names don't start with a timestamp are dated by their
+# modification time, as DSVPath.datetime() does. These are expected
+# to be rare.
+
+import bisect
+import datetime
+import os
+import re
+
+_TIMESTAMP_RE = re.compile(r'[0-9]{8}-[0-9]{6}')
+_TIMESTAMP_LEN = 15
+_TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S'
+
+def _key(datim):
+    """Return the timestamp name prefix for a date/time.
+
+       File start times are whole seconds, so round up any fraction.
+       A file starts at or after the date/time if and only if its name
+       sorts at or after the key."""
+    if datim.microsecond:
+        datim = datim.replace(microsecond=0) + datetime.timedelta(seconds=1)
+    return datim.strftime(_TIMESTAMP_FORMAT)
+
+def name_start(name):
+    """Return the start date/time given by a file name, or None if the
+       name doesn't start with a timestamp."""
+    if _TIMESTAMP_RE.match(name):
+        try:
+            return datetime.datetime.strptime(name[0:_TIMESTAMP_LEN], _TIMESTAMP_FORMAT)
+        except ValueError:
+            pass
+    return None
+
+class TimeIndex:
+    def __init__(self, dpath, names):
+        """Index the named files in directory dpath.
+
+           names need not be sorted."""
+        self._prefix = str(dpath) + os.sep
+        self._timed = []
+        self._untimed = []
+        for name in names:
+            if _TIMESTAMP_RE.match(name):
+                self._timed.append(name)
+            else:
+                self._untimed.append(name)
+        self._timed.sort()
+
+    def __len__(self):
+        return len(self._timed) + len(self._untimed)
+
+    def start(self, name):
+        """Return the start date/time of the named file."""
+        res = name_start(name)
+        if res:
+            return res
+        return datetime.datetime.utcfromtimestamp(os.path.getmtime(self._prefix + name))
+
+    def select(self, from_date=None, to_date=None):
+        """Return the names of files starting in the date range.
+
+           If from_date is given, the file start must be >= from_date.
+           If to_date is given, the file start must be < to_date.
+           Names of files with timestamp names are returned in name
+           order, followed by any other files."""
+        lo = bisect.bisect_left(self._timed, _key(from_date)) if from_date else 0
+        hi = bisect.bisect_left(self._timed, _key(to_date)) if to_date else len(self._timed)
+        res = self._timed[lo:hi]
+        for name in self._untimed:
+            try:
+                datim = self.start(name)
+            except FileNotFoundError:
+                continue
+            if from_date and datim < from_date:
+                continue
+            if to_date and datim >= to_date:
+                continue
+            res.append(name)
+        return res
+
+    def span(self):
+        """Return the earliest and latest file start times.
+
+           Return (None, None) if there are no files."""
+        starts = []
+        if self._timed:
+            starts.append(self.start(self._timed[0]))
+            starts.append(self.start(self._timed[-1]))
+        for name in self._untimed:
+            try:
+                starts.append(self.start(name))
+            except FileNotFoundError:
+                pass
+        if not starts:
+            return (None, None)
+        return (min(starts), max(starts))
@@ -0,0 +1,271 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# Reading TSV files and inserting them into ClickHouse.
+#
+# TSV files may be inserted together in a single batch, or a single
+# file may be inserted in chunks of rows, with progress recorded after
+# each chunk.
+
+import datetime
+import itertools
+import logging
+import os
+import subprocess
+import tempfile
+
+import dsv.common.JobBase as djb
+import dsv.common.TimeIndex as dti
+
+# Column positions and names of the fields used to check whether
+# TSV data is already in the database.
+TSV_CHECK_COLUMNS = [(0, 'Date'), (1, 'DateTime'), (2, 'NanoSecondsSinceEpoch'),
+                     (3, 'NodeID'), (22, 'ID')]
+
+def check_values(path):
+    """Return the values in the first data row used to check whether
+       the data is already imported, and the ClickHouse input format.
+
+       If there is no data row, return None for the values."""
+    with path.open() as f:
+        first = f.readline().rstrip('\n').split('\t')
+        if first[0] != 'Date':
+            row = first
+            fmt = 'TabSeparated'
+        else:
+            names = [first[col] if col < len(first) else '' for col, _ in TSV_CHECK_COLUMNS]
+            if names != [name for _, name in TSV_CHECK_COLUMNS]:
+                raise djb.JobError(djb.INFRASTRUCTURE_ERROR,
+                                   'Import data column names do not match expected.\n'
+                                   '{}.'.format(', '.join(names[1:])))
+            line = f.readline()
+            row = line.rstrip('\n').split('\t') if line else None
+            fmt = 'TabSeparatedWithNames'
+    if not row:
+        return (None, fmt)
+    try:
+        return ({'date': row[0],
+                 'datetime': int(row[1]),
+                 'nanosecs': int(row[2]),
+                 'nodeid': int(row[3]),
+                 'qid': int(row[22])}, fmt)
+    except (IndexError, ValueError):
+        raise djb.JobError(djb.FAILURE, 'Malformed TSV data in {}'.format(path))
+
+def count_rows(f, fmt):
+    """Return the number of data rows in an open TSV file."""
+    f.seek(0)
+    lines = 0
+    for block in iter(lambda: f.read(1024 * 1024), b''):
+        lines += block.count(b'\n')
+    return max(lines - 1, 0) if fmt == 'TabSeparatedWithNames' else lines
+
+def read_header(f, fmt):
+    """Return the header line of an open TSV file, or None."""
+    f.seek(0)
+    return f.readline() if fmt == 'TabSeparatedWithNames' else None
+
+def week_start(path):
+    """Return the start of the ClickHouse toYearWeek() week of the file,
+       from its name, or None if the name has no date."""
+    start = dti.name_start(path.name)
+    if not start:
+        return None
+    day = start.date()
+    return day - datetime.timedelta(days=(day.weekday() + 1) % 7)
+
+def insert_blocks(client, query, blocks):
+    """Stream blocks of data into a single ClickHouse insert.
+
+       Return a tuple of success flag and stderr."""
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(client + ['--query=' + query],
+                                stdin=subprocess.PIPE, stderr=err)
+        try:
+            for block in blocks:
+                proc.stdin.write(block)
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        proc.wait()
+        err.seek(0)
+        return (proc.returncode == 0, err.read().decode(errors='replace').rstrip())
+
+def file_blocks(files, skip_header):
+    """Generate the contents of open files, each ending in a newline.
+
+       If skip_header is True, generate the first line of the first
+       file only."""
+    for n, f in enumerate(files):
+        f.seek(0)
+        if n > 0 and skip_header:
+            f.readline()
+        last = b'\n'
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            yield block
+            last = block[-1:]
+        if last != b'\n':
+            yield b'\n'
+
+def insert(client, query, files, skip_header):
+    """Stream the contents of open files into a single ClickHouse insert.
+
+       If skip_header is True, send the first line of the first file
+       only. Return a tuple of success flag and stderr."""
+    return insert_blocks(client, query, file_blocks(files, skip_header))
+
+class ImportProgress:
+    """Record of the chunks of a TSV file already imported.
+
+       Progress is kept beside the file, as the byte offset of the first
+       row not yet imported and the number of rows imported, in a single
+       line also read and written by dsv-import-tsv. It only applies to
+       the file as it was when recorded, identified by inode, size and
+       modification time; a TSV file regenerated under the same name
+       starts again from the beginning."""
+    def __init__(self, path, f):
+        self._path = path.with_suffix('.progress')
+        st = os.fstat(f.fileno())
+        self._key = [st.st_ino, st.st_size, int(st.st_mtime)]
+        self.offset = None
+        self.rows = 0
+        try:
+            with self._path.open() as pf:
+                saved = [int(v) for v in pf.read().split()]
+            if saved[:3] == self._key:
+                self.offset, self.rows = saved[3:5]
+            else:
+                logging.info('Import progress {} is for a different file, ignoring'.format(
+                    self._path))
+                self.remove()
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as err:
+            logging.warning('Import progress {} unreadable, ignoring: {}'.format(self._path, err))
+
+    @property
+    def resuming(self):
+        """Are some chunks of the file already imported?"""
+        return self.offset is not None
+
+    def save(self, offset, rows):
+        self.offset = offset
+        self.rows = rows
+        tmppath = self._path.with_name(self._path.name + '.tmp')
+        with tmppath.open('w') as f:
+            f.write(' '.join(str(v) for v in self._key + [offset, rows]) + '\n')
+        tmppath.replace(self._path)
+
+    def remove(self):
+        djb.remove(self._path)
+
+def chunk_blocks(f, max_rows, rows):
+    """Generate the next chunk of an open TSV file, up to max_rows rows,
+       from the current file position.
+
+       Afterwards the file is positioned at the start of the next chunk.
+       The number of rows generated is appended to the list rows."""
+    n = 0
+    last = b'\n'
+    while n < max_rows:
+        pos = f.tell()
+        block = f.read(1024 * 1024)
+        if not block:
+            break
+        lines = block.count(b'\n')
+        if n + lines >= max_rows:
+            end = -1
+            for _ in range(max_rows - n):
+                end = block.index(b'\n', end + 1)
+            block = block[:end + 1]
+            f.seek(pos + end + 1)
+            lines = max_rows - n
+        n += lines
+        last = block[-1:]
+        yield block
+    if last != b'\n':
+        # A final row without a newline.
+        n += 1
+        yield b'\n'
+    rows.append(n)
+
+def insert_chunked(ctx, client, server, query, path, f, fmt, progress):
+    """Insert an open TSV file in chunks of import-chunk-rows rows.
+
+       Each chunk is a separate insert, so the memory ClickHouse needs
+       for an insert is bounded by the chunk size rather than the file
+       size. After each chunk is inserted, progress is recorded, so if
+       a later chunk fails or the import is deferred, a retry resumes
+       at the first chunk not inserted, rather than importing the whole
+       file again. Return the number of rows in the file."""
+    chunk_rows = int(ctx.cfg['worker']['import-chunk-rows'])
+    header = read_header(f, fmt) or b''
+    if progress.resuming:
+        f.seek(progress.offset)
+        logging.info('Resuming import of {} after {} rows'.format(path, progress.rows))
+    total = progress.rows
+    inserted = 0
+    while f.read(1):
+        f.seek(-1, os.SEEK_CUR)
+        if inserted:
+            deferral = ctx.insert_deferral()
+            if deferral:
+                notbefore, reason = deferral
+                raise djb.JobError(djb.TRANSIENT_FAILURE,
+                                   'Import deferred until {:%Y-%m-%d %H:%M:%S} after {} rows, '
+                                   '{}.'.format(notbefore, total, reason), notbefore=notbefore)
+        rows = []
+        ok, err = insert_blocks(client, query,
+                                itertools.chain([header], chunk_blocks(f, chunk_rows, rows)))
+        if not ok:
+            raise djb.JobError(djb.TRANSIENT_FAILURE,
+                               'ClickHouse import failed on server {} after {} rows.\n{}'.format(
+                                   server, total, err))
+        total += rows[0]
+        inserted += rows[0]
+        ctx.rows = inserted
+        progress.save(f.tell(), total)
+    return total
+
+def claim_batch(ctx, path, primary, fmt):
+    """Claim further pending TSV files to import with the primary file.
+
+       Files claimed are in the same directory, have the same header,
+       and have data in the same ClickHouse partition. Return a list of
+       (path, open file, check values) tuples."""
+    workercfg = ctx.cfg['worker']
+    max_files = int(workercfg['import-batch-files'])
+    max_bytes = int(workercfg['import-batch-bytes'])
+    week = week_start(path)
+    if max_files < 2 or week is None or ctx.retry_count > 0 or path in ctx.failed_batch:
+        return []
+    header = read_header(primary, fmt)
+    size = os.fstat(primary.fileno()).st_size
+    res = []
+    for name in sorted(os.listdir(str(path.parent))):
+        if len(res) + 1 >= max_files:
+            break
+        other = path.parent / name
+        if name == path.name or not name.endswith('.tsv') or \
+           other in ctx.failed_batch or week_start(other) != week:
+            continue
+        f = djb.claim(other, wait=False)
+        if not f:
+            continue
+        try:
+            values, ofmt = check_values(other)
+            osize = os.fstat(f.fileno()).st_size
+            if ofmt == fmt and read_header(f, ofmt) == header and size + osize <= max_bytes:
+                res.append((other, f, values))
+                size += osize
+                continue
+        except djb.JobError:
+            # Leave problem files to their own job.
+            pass
+        f.close()
+    return res
@@ -0,0 +1,103 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+#
+# xz decompression and recompression of C-DNS files.
+#
+# xz can only decompress with more than one thread if the compressed
+# data is split into several independently compressed blocks. Files
+# compressed by a single-threaded xz, as C-DNS files from nodes
+# usually are, have one block. Such files can be recompressed into
+# blocks so that later decompression can use several threads.
+
+import os
+import shutil
+import subprocess
+
+# Decompression threads meaning one per CPU.
+ALL_CPUS = 0
+
+class XzError(Exception):
+    """Exception raised when an xz file can't be read or written."""
+
+def block_count(path):
+    """Return the number of compressed blocks in an xz file.
+
+       Return None if the file can't be listed."""
+    try:
+        res = subprocess.run(['xz', '--robot', '--list', str(path)],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             check=False)
+    except OSError:
+        return None
+    if res.returncode != 0:
+        return None
+    for line in res.stdout.decode(errors='replace').splitlines():
+        fields = line.split('\t')
+        if fields[0] == 'file' and len(fields) > 2:
+            try:
+                return int(fields[2])
+            except ValueError:
+                return None
+    return None
+
+def decompress_command(path, threads):
+    """Return the command to decompress a file to standard output.
+
+       If the file has more than one block, and threads is not 1,
+       decompress with up to the given number of threads, 0 meaning
+       one per CPU. Otherwise decompress single-threaded."""
+    cmd = ['xz', '--decompress', '--stdout']
+    if threads != 1:
+        blocks = block_count(path)
+        if blocks and blocks > 1:
+            cmd.append('--threads={}'.format(threads))
+    return cmd + [str(path)]
+
+def recompress(path, threads, block_size, level=6):
+    """Recompress an xz file into blocks of block_size uncompressed bytes,
+       so it can be decompressed with several threads.
+
+       The new file is written alongside the original, checked, and
+       then replaces the original, keeping its permissions and times.
+       Return False if the file already has more than one block."""
+    blocks = block_count(path)
+    if blocks is None:
+        raise XzError('Cannot read {}'.format(path))
+    if blocks > 1:
+        return False
+
+    path = str(path)
+    tmp = os.path.join(os.path.dirname(path), '.{}.recompress'.format(os.path.basename(path)))
+    try:
+        with open(tmp, 'wb') as outf:
+            decomp = subprocess.Popen(['xz', '--decompress', '--stdout', path],
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            comp = subprocess.Popen(['xz', '--compress', '--stdout', '-{}'.format(level),
+                                     '--threads={}'.format(threads),
+                                     '--block-size={}'.format(block_size)],
+                                    stdin=decomp.stdout, stdout=outf, stderr=subprocess.PIPE)
+            decomp.stdout.close()
+            _, comp_err = comp.communicate()
+            _, decomp_err = decomp.communicate()
+        if decomp.returncode != 0 or comp.returncode != 0:
+            raise XzError('Recompressing {} failed: {}'.format(
+                path, (decomp_err + comp_err).decode(errors='replace').strip()))
+        res = subprocess.run(['xz', '--test', tmp],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+        if res.returncode != 0:
+            raise XzError('Recompressed {} failed check: {}'.format(
+                path, res.stderr.decode(errors='replace').strip()))
+        shutil.copystat(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    return True
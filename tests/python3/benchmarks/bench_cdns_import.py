@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+# Compare getting C-DNS data into ClickHouse by converting to TSV and
+# importing the TSV with clickhouse-client, and by streaming the
+# converted data with the native protocol. Reports rows imported per
+# second and the bytes written to disk by the worker and its children.
+#
+# This needs a full Visualizer installation: inspector, clickhouse-client,
+# a Postgres database in which the given server and node are defined,
+# and a ClickHouse server. The sample data is imported once per job
+# in each mode, so use a scratch ClickHouse database.
+#
+# Usage: PYTHONPATH=src/python3 python3 tests/python3/benchmarks/bench_cdns_import.py \
+#            --server <server> --node <node>
+
+import argparse
+import pathlib
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import dsv.common.Config as dc
+import dsv.common.JobHandlers as djh
+
+SAMPLE = pathlib.Path(__file__).resolve().parents[3] / 'sampledata' / 'testnode.cdns.xz'
+
+class TSVCollector:
+    """Collect the TSV files queued by cdns-to-tsv, for import here."""
+    def __init__(self):
+        self.files = []
+
+    def add(self, queue, path):
+        self.files.append(path)
+
+def blocks_written():
+    return sum(resource.getrusage(who).ru_oublock
+               for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+def check(label, res):
+    if res.returncode != 0:
+        print('{} job failed: {}'.format(label, res.stderr.decode()), file=sys.stderr)
+        sys.exit(1)
+
+def run(mode, cfg, jobdir, jobs):
+    cfg['worker']['import-mode'] = mode
+    collector = TSVCollector()
+    ctx = djh.HandlerContext(cfg, collector)
+    rows = 0
+    t = 0.0
+    blocks = 0
+    for n in range(jobs):
+        job = jobdir / '20210101-{:06d}-testnode.cdns.xz'.format(n)
+        shutil.copy(str(SAMPLE), str(job))
+        b_start = blocks_written()
+        t_start = time.perf_counter()
+        res = djh.run_job(ctx, 'cdns-to-tsv', str(job))
+        check(mode, res)
+        rows += res.rows or 0
+        for tsv in collector.files:
+            res = djh.run_job(ctx, 'import-tsv', str(tsv))
+            check(mode, res)
+            rows += res.rows or 0
+            tsv.unlink()
+        t += time.perf_counter() - t_start
+        blocks += blocks_written() - b_start
+        collector.files = []
+        job.unlink()
+    ctx.close()
+    # ru_oublock counts 512 byte blocks.
+    print('{:<6} {} jobs, {} rows, {:0.3f}s, {:0.0f} rows/s, {:0.1f} MB written'.format(
+        mode, jobs, rows, t, rows / t, blocks * 512 / 1e6))
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark C-DNS import modes.')
+    parser.add_argument('-c', '--config', default=None)
+    parser.add_argument('--server', required=True)
+    parser.add_argument('--node', required=True)
+    parser.add_argument('--jobs', type=int, default=10)
+    args = parser.parse_args()
+
+    cfg = dc.Config(args.config)
+    # Each job imports the same data. Skip the duplicate data check in
+    # TSV import so every job does the full import.
+    djh._already_imported = lambda ctx, server, path, values: False
+    with tempfile.TemporaryDirectory(prefix='bench_') as base:
+        jobdir = pathlib.Path(base) / args.server / args.node / 'incoming' / 'pending'
+        jobdir.mkdir(parents=True)
+        for mode in ('tsv', 'stream'):
+            run(mode, cfg, jobdir, args.jobs)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+# Compare enqueue and dequeue rates of the queue backends.
+#
+# Jobs are added with add_many(), then taken one at a time with get()
+# and marked done, as a worker does. The local backend uses a database
+# in a temporary directory. The gearman backend needs a running GearMan
+# server, and is skipped unless --gearman is given. Jobs are added to a
+# queue that no worker reads, dsv-bench by default.
+#
+# Usage: PYTHONPATH=src/python3 python3 tests/python3/benchmarks/bench_queue_backends.py \
+#            [--gearman]
+
+import argparse
+import configparser
+import tempfile
+import time
+
+import dsv.common.Queue as dq
+
+def run(label, qcontext, queue, jobs):
+    with qcontext.writer() as writer:
+        t_start = time.perf_counter()
+        added = writer.add_many(queue, jobs, dq.JobPrecedence.low)
+        t = time.perf_counter() - t_start
+        print('{:<8} enqueue {} jobs, {:0.3f}s, {:0.0f} jobs/s'.format(
+            label, added, t, added / t))
+
+    with qcontext.reader() as reader:
+        reader.register(queue)
+        t_start = time.perf_counter()
+        n = 0
+        while n < added:
+            job = reader.get(5)
+            if not job:
+                break
+            job.done()
+            n += 1
+        t = time.perf_counter() - t_start
+        print('{:<8} dequeue {} jobs, {:0.3f}s, {:0.0f} jobs/s'.format(label, n, t, n / t))
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark queue backends.')
+    parser.add_argument('--gearman', action='store_true', default=False,
+                        help='also benchmark the GearMan server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=4730)
+    parser.add_argument('--queue', default='dsv-bench')
+    parser.add_argument('--jobs', type=int, default=10000)
+    args = parser.parse_args()
+    jobs = ['/srv/cbor/server/node/cbor/pending/{:08d}.cdns.xz'.format(n)
+            for n in range(args.jobs)]
+
+    with tempfile.TemporaryDirectory(prefix='bench_') as base:
+        cfg = configparser.ConfigParser()
+        cfg.read_dict({
+            'gearman': {'host': args.host, 'port': args.port},
+            'queue': {'backend': dq.LOCAL},
+            'datastore': {'queue_db': base + '/queue.sqlite'},
+        })
+        run(dq.LOCAL, dq.QueueContext(cfg, 'bench'), args.queue, jobs)
+        if args.gearman:
+            cfg['queue']['backend'] = dq.GEARMAN
+            run(dq.GEARMAN, dq.QueueContext(cfg, 'bench'), args.queue, jobs)
+
+if __name__ == '__main__':
+    main()
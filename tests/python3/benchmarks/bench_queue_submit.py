@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+# Compare submitting jobs one at a time with QueueWriter.add() against
+# pipelined submission with QueueWriter.add_many().
+#
+# This needs a running GearMan server. Jobs are added to a queue that
+# no worker reads, dsv-bench by default. Remove them afterwards with
+# 'gearadmin --drop-function dsv-bench'.
+#
+# Usage: PYTHONPATH=src/python3 python3 tests/python3/benchmarks/bench_queue_submit.py
+
+import argparse
+import time
+
+import dsv.common.Queue as dq
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark queue job submission.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=4730)
+    parser.add_argument('--queue', default='dsv-bench')
+    parser.add_argument('--jobs', type=int, default=10000)
+    parser.add_argument('--window', type=int, action='append',
+                        help='submit window to try, may be repeated')
+    args = parser.parse_args()
+    jobs = ['/srv/cbor/server/node/cbor/pending/{:08d}.cdns.xz'.format(n)
+            for n in range(args.jobs)]
+
+    with dq.QueueWriter('bench', args.host, args.port) as writer:
+        t_start = time.perf_counter()
+        for job in jobs:
+            writer.add(args.queue, job, dq.JobPrecedence.low)
+        t = time.perf_counter() - t_start
+        print('add()             {} jobs, {:0.3f}s, {:0.0f} jobs/s'.format(
+            len(jobs), t, len(jobs) / t))
+
+    for window in args.window or [10, 100, dq.DEFAULT_SUBMIT_WINDOW]:
+        with dq.QueueWriter('bench', args.host, args.port, window) as writer:
+            t_start = time.perf_counter()
+            n = writer.add_many(args.queue, jobs, dq.JobPrecedence.low)
+            t = time.perf_counter() - t_start
+            print('add_many({:>5}) {} jobs, {:0.3f}s, {:0.0f} jobs/s'.format(
+                window, n, t, n / t))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+# Compare scanning a synthetic datastore by globbing directories with
+# scanning using the scan index, both with an empty (cold) index and
+# a populated (warm) index.
+#
+# Usage: PYTHONPATH=src/python3 python3 tests/python3/benchmarks/bench_scan_index.py
+
+import argparse
+import importlib
+import tempfile
+import time
+
+import synthetic
+
+import dsv.common.ScanIndex as dsi
+
+di = importlib.import_module('dsv.commands.import')
+
+def scan(base, from_date=None):
+    t_start = time.perf_counter()
+    n = sum(1 for _ in di.files_to_process(base, di.CDNS_DIR_PATTERN, '*.cdns.xz',
+                                           from_date=from_date))
+    return (n, time.perf_counter() - t_start)
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark datastore scan index.')
+    parser.add_argument('--servers', type=int, default=2)
+    parser.add_argument('--nodes', type=int, default=50)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_') as base:
+        total = synthetic.make_tree(base, args.servers, args.nodes, args.files)
+        print('Datastore: {} servers, {} nodes, {} files'.format(
+            args.servers, args.servers * args.nodes, total))
+        di.server_filters[None] = di.Filter(di.pathlib.Path(base))
+
+        for run in range(args.runs):
+            n, t = scan(base)
+            print('glob        run {}: {} files, {:0.3f}s'.format(run, n, t))
+
+        di.scan_index = dsi.ScanIndex(base + '/.scan-index.sqlite')
+        for run in range(args.runs):
+            n, t = scan(base)
+            print('index {} run {}: {} files, {:0.3f}s'.format(
+                'cold' if run == 0 else 'warm', run, n, t))
+        di.scan_index.close()
+
+if __name__ == '__main__':
+    main()
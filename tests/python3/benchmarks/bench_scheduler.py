@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+# Compare the dsv-import file scheduler with the previous scheduler,
+# which built a list of every file before returning the first, and
+# took files from the head of each node list.
+#
+# Each scheduler runs in a separate process, so that peak RSS can
+# be reported for each. Time to first job is the time from starting
+# the scan to the first file being produced.
+#
+# For a 10 million file datastore, use --nodes 500 --files 10000.
+# Building the tree takes a while and needs plenty of inodes.
+#
+# Usage: PYTHONPATH=src/python3 python3 tests/python3/benchmarks/bench_scheduler.py
+
+import argparse
+import importlib
+import pathlib
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+
+import dsv.common.Path as dp
+
+di = importlib.import_module('dsv.commands.import')
+
+def legacy_files_to_process(path, dir_pattern, file_pattern):
+    nodefiles = {}
+    for dpath in pathlib.Path(path).glob(dir_pattern):
+        if dpath.is_dir():
+            wompath = dp.DSVPath(dpath)
+            node = wompath.server + '|' + wompath.node
+            di.ensure_server_filter(wompath)
+            nodefiles[node] = [str(f) for f in dpath.glob(file_pattern)]
+    for node in nodefiles:
+        nodefiles[node].sort(reverse=True)
+    more = True
+    while more:
+        more = False
+        for node in nodefiles:
+            if len(nodefiles[node]) > 0:
+                yield nodefiles[node].pop(0)
+                more = True
+
+def run(base, scheduler, weight):
+    di.node_weighting = weight
+    if scheduler == 'legacy':
+        gen = legacy_files_to_process(base, di.CDNS_DIR_PATTERN, '*.cdns.xz')
+    else:
+        gen = di.files_to_process(base, di.CDNS_DIR_PATTERN, '*.cdns.xz')
+    t_start = time.perf_counter()
+    t_first = None
+    n = 0
+    for _ in gen:
+        if t_first is None:
+            t_first = time.perf_counter() - t_start
+        n += 1
+    t_total = time.perf_counter() - t_start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('{:<8} {:<8} {:>10} files, first {:8.3f}s, total {:8.3f}s, peak RSS {:>8} KiB'.format(
+        scheduler, weight or 'equal', n, t_first or 0.0, t_total, rss))
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark dsv-import scheduler.')
+    parser.add_argument('--servers', type=int, default=2)
+    parser.add_argument('--nodes', type=int, default=50)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--run', nargs=2, metavar=('BASE', 'SCHEDULER'),
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--weight', choices=['backlog', 'bytes'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run[0], args.run[1], args.weight)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='bench_') as base:
+        total = synthetic.make_tree(base, args.servers, args.nodes, args.files)
+        print('Datastore: {} servers, {} nodes, {} files'.format(
+            args.servers, args.servers * args.nodes, total))
+        for cmd in [['legacy'], ['heap'], ['heap', '--weight', 'backlog']]:
+            subprocess.run([sys.executable, __file__, '--run', base] + cmd, check=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+# Compare job throughput running jobs with the external dsv-<queue>
+# commands and with the in-process handlers.
+#
+# This needs a full Visualizer installation: inspector, the Visualizer
+# commands on PATH, a GearMan server and a Postgres database in which
+# the given server and node are defined. The TSV files generated by
+# cdns-to-tsv jobs are queued on the import-tsv queue; stop workers
+# or freeze the import-tsv queue while running this.
+#
+# Usage: PYTHONPATH=src/python3 python3 tests/python3/benchmarks/bench_worker_jobs.py \
+#            --server <server> --node <node>
+
+import argparse
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+import dsv.common.Config as dc
+import dsv.common.JobHandlers as djh
+import dsv.common.Queue as dq
+
+SAMPLE = pathlib.Path(__file__).resolve().parents[3] / 'sampledata' / 'testnode.cdns.xz'
+
+def run(label, ctx, queue, jobdir, jobs):
+    t_start = time.perf_counter()
+    for n in range(jobs):
+        job = jobdir / '20210101-{:06d}-testnode.cdns.xz'.format(n)
+        shutil.copy(str(SAMPLE), str(job))
+        res = djh.run_job(ctx, queue, str(job))
+        if res.returncode != 0:
+            print('{} job failed: {}'.format(label, res.stderr.decode()), file=sys.stderr)
+            sys.exit(1)
+        job.unlink()
+    t = time.perf_counter() - t_start
+    print('{:<10} {} {} jobs, {:0.3f}s, {:0.2f} jobs/s'.format(label, queue, jobs, t, jobs / t))
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark worker job handling.')
+    parser.add_argument('-c', '--config', default=None)
+    parser.add_argument('--server', required=True)
+    parser.add_argument('--node', required=True)
+    parser.add_argument('--queue', default='cdns-to-tsv',
+                        choices=['cdns-to-tsv', 'cdns-to-pcap'])
+    parser.add_argument('--jobs', type=int, default=50)
+    args = parser.parse_args()
+
+    cfg = dc.Config(args.config)
+    with tempfile.TemporaryDirectory(prefix='bench_') as base:
+        jobdir = pathlib.Path(base) / args.server / args.node / 'incoming' / 'pending'
+        jobdir.mkdir(parents=True)
+        run('external', None, args.queue, jobdir, args.jobs)
+        with dq.QueueContext(cfg, sys.argv[0]).writer() as writer:
+            ctx = djh.HandlerContext(cfg, writer)
+            run('in-process', ctx, args.queue, jobdir, args.jobs)
+            ctx.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+# Measure xz decompression throughput of a C-DNS file with 1 to N
+# threads, compressed as a single block as received from nodes, and
+# after recompression into blocks by dsv-cdns-recompress.
+#
+# xz decompresses with several threads only from version 5.4.0. With
+# an older xz, all thread counts give single-threaded throughput.
+#
+# Usage: PYTHONPATH=src/python3 python3 tests/python3/benchmarks/bench_xz_threads.py \
+#            [--file <C-DNS .xz file>] [--max-threads <n>]
+
+import argparse
+import os
+import pathlib
+import shutil
+import subprocess
+import tempfile
+import time
+
+import dsv.common.Xz as dxz
+
+SAMPLE = pathlib.Path(__file__).resolve().parents[3] / 'sampledata' / 'testnode.cdns.xz'
+
+def decompress(path, threads, repeat):
+    cmd = dxz.decompress_command(path, threads)
+    size = 0
+    t_start = time.perf_counter()
+    for _ in range(repeat):
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        for block in iter(lambda: proc.stdout.read(1024 * 1024), b''):
+            size += len(block)
+        proc.wait()
+    return (size, time.perf_counter() - t_start)
+
+def run(label, path, max_threads, repeat):
+    blocks = dxz.block_count(path)
+    for threads in range(1, max_threads + 1):
+        size, t = decompress(path, threads, repeat)
+        print('{:<12} {:3d} blocks {:2d} threads {:0.3f}s {:8.1f} MB/s'.format(
+            label, blocks, threads, t, size / t / 1e6))
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark threaded xz decompression.')
+    parser.add_argument('--file', default=str(SAMPLE))
+    parser.add_argument('--max-threads', type=int, default=os.cpu_count())
+    parser.add_argument('--block-size', default='16MiB')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_') as base:
+        single = pathlib.Path(base) / 'single.cdns.xz'
+        with single.open('wb') as outf:
+            decomp = subprocess.Popen(['xz', '--decompress', '--stdout', args.file],
+                                      stdout=subprocess.PIPE)
+            subprocess.run(['xz', '--compress', '--stdout', '--threads=1'],
+                           stdin=decomp.stdout, stdout=outf, check=True)
+            decomp.stdout.close()
+            decomp.wait()
+        multi = pathlib.Path(base) / 'multi.cdns.xz'
+        shutil.copy(str(single), str(multi))
+        t_start = time.perf_counter()
+        dxz.recompress(multi, 0, args.block_size)
+        print('recompress {:0.3f}s'.format(time.perf_counter() - t_start))
+        run('single-block', single, args.max_threads, args.repeat)
+        run('multi-block', multi, args.max_threads, args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+# Helpers for building synthetic datastores for benchmarks.
+
+import datetime
+import os
+import pathlib
+
+def make_tree(base, servers, nodes, files, subdir='cbor', age=3600):
+    """Create a datastore under base with empty C-DNS files.
+
+       There are 'servers' servers, each with 'nodes' nodes, each with
+       'files' files in directory 'subdir'. Files are named in the usual
+       Visualizer fashion, one every 5 minutes. Directory modification
+       times are set 'age' seconds into the past.
+
+       Return the total number of files created."""
+    start = datetime.datetime(2021, 1, 1)
+    step = datetime.timedelta(minutes=5)
+    old = (datetime.datetime.now() - datetime.timedelta(seconds=age)).timestamp()
+    total = 0
+    for s in range(servers):
+        for n in range(nodes):
+            node = 'node{}'.format(n)
+            d = pathlib.Path(base) / 'server{}'.format(s) / node / subdir
+            d.mkdir(parents=True, exist_ok=True)
+            for f in range(files):
+                name = '{}-{}.cdns.xz'.format((start + f * step).strftime('%Y%m%d-%H%M%S'), node)
+                fd = os.open(str(d / name), os.O_CREAT | os.O_WRONLY, 0o644)
+                os.close(fd)
+            os.utime(str(d), (old, old))
+            total += files
+    return total
@@ -22,16 +22,47 @@ _testconfig = {
         'host': 'localhost',
         'port': 4730
     },
+    'queue': {
+        'backend': 'gearman',
+        'promote-after': 0
+    },
     'datastore': {
         'path': '/srv/cbor/',
         'cdns_file_pattern': '*.cbor.xz',
         'tsv_file_pattern': '*.tsv*',
         'lockfile': '/run/lock/dns-stats-visualization/{}.lock',
         'user': 'dsv',
+        'scan_index': '%(path)s/.scan-index.sqlite',
+        'backfill_checkpoint': '%(path)s/.backfill-{}.json',
+        'delayed_jobs': '%(path)s/.delayed-jobs.sqlite',
+        'node_ids': '%(path)s/.node-ids.json',
+        'queue_db': '%(path)s/.queue.sqlite',
         # NOTE: The order is important. Priority of worker processing
         # INCREASES the later in the list the queue name is.
         'queues': 'cdns-to-pcap,cdns-to-tsv,import-tsv'
     },
+    'worker': {
+        'load-high': 1.0,
+        'parts-high': 150,
+        'parts-max': 250,
+        'merges-high': 0,
+        'control-interval': 15,
+        'job-stats': 'Y',
+        'job-stats-batch': 1000,
+        'job-stats-interval': 60,
+        'import-batch-files': 16,
+        'import-batch-bytes': 1073741824,
+        'import-mode': 'tsv',
+        'stream-block-size': 100000,
+        'xz-threads': 0,
+        'combine-pcap': '',
+        'import-probe': '',
+        'import-pace-parts': 150,
+        'import-pace-merges': 0,
+        'import-pace-delay': 10,
+        'import-chunk-rows': 1000000,
+        'queue-weights': ''
+    },
     'pcap': {
         'compress': 'Y',
         'compression-level': 2,
@@ -61,6 +92,7 @@ _testconfig = {
         'password': 'dsv',
         'querytable': 'QueryResponse',
         'packetcountstable': 'PacketCounts',
+        'shard-insert': 'distributed',
     },
     'rssac': {
         'outdir': '.',
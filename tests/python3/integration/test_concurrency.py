@@ -0,0 +1,177 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import collections
+import datetime
+import time
+
+from unittest.mock import patch
+
+import common
+import dsv.common.Concurrency as dc
+
+class TestConcurrencyController(common.DSVTestCase):
+    def setUp(self):
+        super().setUp()
+        maxima = collections.OrderedDict([('cdns-to-pcap', 2), ('cdns-to-tsv', None),
+                                          ('import-tsv', None)])
+        self._ctl = dc.ConcurrencyController(8, maxima, 1.0, 150, 250)
+        self._busy = {'cdns-to-pcap': 0, 'cdns-to-tsv': 0, 'import-tsv': 0}
+        self._waiting = {'cdns-to-pcap': 10, 'cdns-to-tsv': 10, 'import-tsv': 10}
+
+    def _update(self, load=0.5, parts=10, merges=0, saturated=True):
+        running = dict(self._ctl.limits) if saturated else self._busy
+        return self._ctl.update(dc.Signals(load, parts, merges, self._waiting), running)
+
+    def test_increase(self):
+        for _ in range(10):
+            limits = self._update()
+        self.assertEqual(limits['cdns-to-pcap'], 2)
+        self.assertEqual(limits['cdns-to-tsv'], 8)
+        self.assertEqual(limits['import-tsv'], 8)
+
+        # No increase if slots aren't all in use, or no jobs waiting.
+        ctl_limits = dict(self._update(saturated=False))
+        self._waiting = {}
+        self.assertEqual(dict(self._update()), ctl_limits)
+
+    def test_load(self):
+        for _ in range(10):
+            self._update()
+        limits = self._update(load=2.0)
+        self.assertEqual(limits['cdns-to-tsv'], 4)
+        self.assertEqual(limits['cdns-to-pcap'], 1)
+        self.assertEqual(limits['import-tsv'], 8)
+        for _ in range(5):
+            limits = self._update(load=2.0)
+        self.assertEqual(limits['cdns-to-tsv'], 1)
+
+    def test_parts(self):
+        for _ in range(10):
+            self._update()
+        limits = self._update(parts=200)
+        self.assertEqual(limits['import-tsv'], 4)
+        self.assertEqual(limits['cdns-to-tsv'], 8)
+        limits = self._update(parts=300)
+        self.assertEqual(limits['import-tsv'], 0)
+        limits = self._update(parts=100)
+        self.assertEqual(limits['import-tsv'], 1)
+
+    def test_merges(self):
+        for _ in range(10):
+            self._update()
+        # Merges are not checked with no threshold.
+        self.assertEqual(self._update(merges=50)['import-tsv'], 8)
+        maxima = collections.OrderedDict([('cdns-to-tsv', None), ('import-tsv', None)])
+        self._ctl = dc.ConcurrencyController(8, maxima, 1.0, 150, 250, 20)
+        for _ in range(10):
+            self._update()
+        limits = self._update(merges=20)
+        self.assertEqual(limits['import-tsv'], 4)
+        self.assertEqual(limits['cdns-to-tsv'], 8)
+
+    def test_runtime(self):
+        for _ in range(10):
+            self._ctl.record('import-tsv', 1.0)
+            self._update()
+        for _ in range(10):
+            self._ctl.record('import-tsv', 10.0)
+        limits = self._update()
+        self.assertEqual(limits['import-tsv'], 4)
+
+class TestClickHouseMonitor(common.DSVTestCase):
+    def test_servers(self):
+        # The test configuration server list ends with a comma.
+        with patch('clickhouse_driver.Client') as client:
+            monitor = dc.ClickHouseMonitor(self._config['clickhouse'])
+        hosts = [call[1]['host'] for call in client.call_args_list]
+        self.assertEqual(hosts, ['dsv-clickhouse1', 'dsv-clickhouse2',
+                                 'dsv-clickhouse3', 'dsv-clickhouse4'])
+        self.assertEqual(sorted(monitor.server_parts()), hosts)
+
+class FakeMonitor:
+    def __init__(self):
+        self.counts = (10, 0)
+        self.samples = 0
+
+    def sample(self):
+        self.samples += 1
+        return self.counts
+
+    def close(self):
+        pass
+
+class TestInsertPacer(common.DSVTestCase):
+    def test_defer(self):
+        monitor = FakeMonitor()
+        pacer = dc.InsertPacer(monitor, 150, 8, 10)
+        self.assertIsNone(pacer.defer())
+        # The sample is reused until the sample interval has passed.
+        monitor.counts = (200, 0)
+        self.assertIsNone(pacer.defer())
+        self.assertEqual(monitor.samples, 1)
+
+        with patch.object(dc, 'PACE_SAMPLE_INTERVAL', 0):
+            pacer = dc.InsertPacer(monitor, 150, 8, 10)
+            start = datetime.datetime.now()
+            notbefore, reason = pacer.defer()
+            self.assertEqual(reason, 'ClickHouse parts 200')
+            self.assertGreaterEqual(notbefore, start + datetime.timedelta(seconds=10))
+            self.assertLessEqual(notbefore, datetime.datetime.now() + datetime.timedelta(seconds=15))
+
+            monitor.counts = (10, 8)
+            self.assertEqual(pacer.defer()[1], 'ClickHouse merges 8')
+            # If ClickHouse can't be sampled, don't hold up inserts.
+            monitor.counts = (None, None)
+            self.assertIsNone(pacer.defer())
+
+            # A threshold of 0 is not checked.
+            pacer = dc.InsertPacer(monitor, 150, 0, 10)
+            monitor.counts = (10, 100)
+            self.assertIsNone(pacer.defer())
+
+class TestFairShare(common.DSVTestCase):
+    def test_weights(self):
+        self.assertEqual(dc.parse_weights(' a=3, b=0.5,'), {'a': 3.0, 'b': 0.5})
+        self.assertEqual(dc.parse_weights(''), {})
+        for bad in ['a', 'a=0', 'a=x']:
+            with self.assertRaises(ValueError):
+                dc.parse_weights(bad)
+
+    def test_share(self):
+        fairshare = dc.FairShare({'a': 3.0})
+        taken = collections.Counter()
+        # Both queues always have jobs, so the last registered is taken.
+        for _ in range(40):
+            registered = fairshare.order(['a', 'b'])
+            taken[registered[-1]] += 1
+            fairshare.started(registered[-1], registered)
+        self.assertEqual(taken, {'a': 30, 'b': 10})
+
+        # An idle queue doesn't build up credit.
+        fairshare = dc.FairShare({})
+        for _ in range(10):
+            registered = fairshare.order(['a', 'b'])
+            fairshare.started('b', registered)
+        registered = fairshare.order(['a', 'b'])
+        self.assertEqual(registered, ['b', 'a'])
+        fairshare.started('a', registered)
+        self.assertEqual(fairshare.order(['a', 'b']), ['a', 'b'])
+
+    def test_registration(self):
+        fairshare = dc.FairShare({})
+        registered = fairshare.registration(['a', 'b'], None)
+        self.assertEqual(registered, ['a', 'b'])
+        fairshare.started('b', registered)
+        # The order of the same queues is kept for a while.
+        self.assertIs(fairshare.registration(['a', 'b'], registered), registered)
+        later = time.monotonic() + dc.FAIRSHARE_REORDER_INTERVAL
+        with patch('time.monotonic', return_value=later):
+            self.assertEqual(fairshare.registration(['a', 'b'], registered), ['b', 'a'])
+        # But a change in the queues is applied at once.
+        self.assertEqual(fairshare.registration(['a', 'b', 'c'], registered), ['b', 'a', 'c'])
@@ -0,0 +1,90 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import datetime
+import importlib
+import pathlib
+import tempfile
+import unittest
+
+import dsv.common.DelayedJobs as ddj
+
+cmd = importlib.import_module('dsv.commands.worker')
+
+class FakeWriter:
+    def __init__(self, fail=False):
+        self.added = []
+        self._fail = fail
+
+    def add_many(self, queue, args, precedence, unique=True):
+        if self._fail:
+            raise OSError('Queue unavailable')
+        self.unique = unique
+        self.added.extend((queue, arg) for arg in args)
+
+class TestDelayedJobs(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._dbpath = pathlib.Path(self._dir.name, 'delayed.sqlite')
+        self._now = datetime.datetime(2021, 1, 1, 12)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _at(self, minutes):
+        return self._now + datetime.timedelta(minutes=minutes)
+
+    def test_take_due(self):
+        with ddj.DelayedJobs(self._dbpath) as dj:
+            for n in [5, 1, 3, 2, 4]:
+                dj.add('import-tsv', '/f{}'.format(n), self._at(n))
+            self.assertEqual(len(dj), 5)
+            self.assertEqual(dj.next_due(), self._at(1))
+            self.assertEqual(dj.take_due(self._now), [])
+            self.assertEqual([j[1] for j in dj.take_due(self._at(3))], ['/f1', '/f2', '/f3'])
+            self.assertEqual(dj.next_due(), self._at(4))
+
+        # Remaining jobs survive reopening.
+        with ddj.DelayedJobs(self._dbpath) as dj:
+            self.assertEqual([j[1] for j in dj.jobs()], ['/f4', '/f5'])
+
+    def test_shared(self):
+        with ddj.DelayedJobs(self._dbpath) as dj1:
+            dj1.add('import-tsv', '/f1', self._at(1))
+            with ddj.DelayedJobs(self._dbpath) as dj2:
+                # Only one store may take the job.
+                self.assertEqual(len(dj1.take_due(self._at(1))), 1)
+                self.assertEqual(dj2.take_due(self._at(1)), [])
+
+    def test_in_memory(self):
+        with ddj.DelayedJobs() as dj:
+            self.assertFalse(dj.durable)
+            dj.add('import-tsv', '/f1', self._at(1))
+            self.assertEqual(len(dj.take_due(self._at(1))), 1)
+
+    def test_queue_delayed_jobs(self):
+        past = datetime.datetime.now() - datetime.timedelta(minutes=1)
+        future = datetime.datetime.now() + datetime.timedelta(hours=1)
+        with ddj.DelayedJobs(self._dbpath) as dj:
+            dj.add('import-tsv', '/f1', past)
+            dj.add('cdns-to-tsv', '/f2', past)
+            dj.add('import-tsv', '/f3', past)
+            dj.add('import-tsv', '/f4', future)
+
+            with self.assertRaises(OSError):
+                cmd.queue_delayed_jobs(FakeWriter(fail=True), dj)
+            self.assertEqual(len(dj), 4)
+
+            writer = FakeWriter()
+            cmd.queue_delayed_jobs(writer, dj)
+            self.assertEqual(sorted(writer.added),
+                             [('cdns-to-tsv', '/f2'), ('import-tsv', '/f1'),
+                              ('import-tsv', '/f3')])
+            self.assertFalse(writer.unique)
+            self.assertEqual(len(dj), 1)
+            self.assertLessEqual(cmd.delayed_wait(dj, 1), 1)
@@ -0,0 +1,45 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+from unittest.mock import patch
+
+import common
+
+import dsv.common.Inotify as dinotify
+import dsv.common.Lock as dl
+
+class TestFreezeWatcher(common.DSVTestCase):
+    def setUp(self):
+        super().setUp()
+        datastore_cfg = self._config['datastore']
+        self._locks = {q: dl.DSVLock(datastore_cfg['user'], datastore_cfg['lockfile'].format(q))
+                       for q in datastore_cfg['queues'].split(',')}
+
+    def _check_watch(self):
+        self._locks['import-tsv'].freeze()
+        calls = []
+        with dl.FreezeWatcher(self._locks) as watcher:
+            watcher.add_listener(lambda: calls.append(watcher.frozen))
+            self.assertEqual(watcher.frozen, {'import-tsv'})
+            self.assertFalse(watcher.wait(0.1))
+
+            self._locks['cdns-to-tsv'].freeze()
+            self.assertTrue(watcher.wait(5))
+            self.assertEqual(watcher.frozen, {'import-tsv', 'cdns-to-tsv'})
+
+            self._locks['import-tsv'].thaw()
+            self.assertTrue(watcher.wait(5))
+            self.assertEqual(watcher.frozen, {'cdns-to-tsv'})
+        self.assertEqual(calls, [{'import-tsv', 'cdns-to-tsv'}, {'cdns-to-tsv'}])
+
+    def test_watch(self):
+        self._check_watch()
+
+    def test_poll(self):
+        with patch.object(dinotify, 'Inotify', side_effect=dinotify.InotifyUnavailableError):
+            self._check_watch()
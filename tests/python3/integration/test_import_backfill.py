@@ -0,0 +1,142 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import importlib
+import pathlib
+
+from unittest.mock import Mock, patch
+
+import common
+import dsv.common.Backfill as dbf
+
+di = importlib.import_module('dsv.commands.import')
+
+class Interrupted(Exception):
+    pass
+
+class FakeWriter:
+    """Writer whose queue is emptied by each status() call."""
+    def __init__(self, fail_after=None, fail_taken=0):
+        self.added = []
+        self.batches = []
+        self._fail_after = fail_after
+        self._fail_taken = fail_taken
+
+    def status(self):
+        return [('cdns-to-tsv', 0, 0, 1)]
+
+    def add_many(self, queue, jobs, precedence):
+        if self._fail_after is not None and len(self.batches) >= self._fail_after:
+            # Take some jobs, as if interrupted part way through a batch.
+            for _ in zip(range(self._fail_taken), jobs):
+                pass
+            raise Interrupted()
+        batch = [str(j) for j in jobs]
+        self.batches.append(batch)
+        self.added.extend(batch)
+        return len(batch)
+
+class TestBackfill(common.DSVTestCase):
+    def setUp(self):
+        super().setUp()
+        self._base = pathlib.Path(self._datastore_path.name)
+        for node in ['n1', 'n2']:
+            d = self._base / 'server' / node / 'cbor'
+            d.mkdir(parents=True)
+            for n in range(5):
+                (d / '20210101-00000{}-{}.cbor.xz'.format(n, node)).touch()
+        di.server_filters[None] = di.Filter(self._base)
+        self._args = common.get_args(di, ['-s', 'cbor', '--backfill', '--queue-depth', '3'])
+        self._datastore_cfg = self._config['datastore']
+        self._checkpoint = pathlib.Path(self._datastore_cfg['backfill_checkpoint'].format('cbor'))
+
+    def _backfill(self, writer, args=None):
+        return dbf.process_backfill(writer, self._datastore_cfg, args or self._args,
+                                    di.cbor_jobs)
+
+    @patch.object(dbf, 'BACKFILL_POLL_INTERVAL', 0)
+    def test_backfill(self):
+        writer = FakeWriter()
+        self.assertEqual(self._backfill(writer), 10)
+        self.assertEqual([len(b) for b in writer.batches], [3, 3, 3, 1])
+        self.assertEqual(len(set(writer.added)), 10)
+        self.assertFalse(self._checkpoint.exists())
+
+    @patch.object(dbf, 'BACKFILL_POLL_INTERVAL', 0)
+    def test_resume(self):
+        writer = FakeWriter(fail_after=2)
+        with self.assertRaises(Interrupted):
+            self._backfill(writer)
+        self.assertTrue(self._checkpoint.exists())
+        first = writer.added
+
+        writer = FakeWriter()
+        self.assertEqual(self._backfill(writer), 4)
+        self.assertEqual(sorted(first + writer.added),
+                         sorted(str(p) for p in self._base.glob('*/*/cbor/pending/*')))
+        self.assertFalse(self._checkpoint.exists())
+
+    @patch.object(dbf, 'BACKFILL_POLL_INTERVAL', 0)
+    def test_resume_linked(self):
+        # Files linked into pending but not queued are queued on resume.
+        writer = FakeWriter(fail_after=1, fail_taken=2)
+        with self.assertRaises(Interrupted):
+            self._backfill(writer)
+        first = writer.added
+        self.assertEqual(len(list(self._base.glob('*/*/cbor/pending/*'))), 6)
+
+        writer = FakeWriter()
+        self.assertEqual(self._backfill(writer), 7)
+        self.assertEqual(sorted(first + writer.added),
+                         sorted(str(p) for p in self._base.glob('*/*/cbor/pending/*')))
+
+    @patch.object(dbf, 'BACKFILL_POLL_INTERVAL', 0)
+    def test_duplicates(self):
+        # Jobs not added as duplicates don't end the backfill early.
+        writer = FakeWriter()
+        add_many = writer.add_many
+        writer.add_many = lambda queue, jobs, precedence: add_many(queue, jobs, precedence) - 1
+        self.assertEqual(self._backfill(writer), 6)
+        self.assertEqual(len(writer.added), 10)
+
+    @patch.object(dbf, 'BACKFILL_POLL_INTERVAL', 0)
+    def test_progress(self):
+        # The total is unknown until every directory has been read.
+        args = common.get_args(di, ['-s', 'cbor', '--backfill', '--queue-depth', '1'])
+        with self.assertLogs(level='INFO') as logs:
+            self.assertEqual(self._backfill(FakeWriter(), args), 10)
+        progress = [r.getMessage() for r in logs.records
+                    if r.getMessage().startswith('Backfill')]
+        self.assertEqual(len(progress), 11)
+        self.assertIn('1 queued, 1/unknown files checked', progress[0])
+        self.assertIn('2 queued, 2/10 files checked', progress[1])
+        self.assertIn('10 queued, 10/10 files checked', progress[-1])
+
+    @patch.object(dbf, 'BACKFILL_POLL_INTERVAL', 0)
+    def test_skip_imported(self):
+        ledger = Mock()
+        ledger.imported.side_effect = \
+            lambda fpath: fpath.node == 'n1' and fpath.path.name < '20210101-000002'
+        writer = FakeWriter()
+        with patch.object(di, 'import_ledger', ledger):
+            self.assertEqual(self._backfill(writer), 8)
+        self.assertFalse(any('20210101-000000-n1' in p or '20210101-000001-n1' in p
+                             for p in writer.added))
+
+    def test_checkpoint_key(self):
+        cp = dbf.BackfillCheckpoint(self._checkpoint, 'cbor||')
+        cp.record('/a/b/20210101-000003-n1.cbor.xz')
+        cp.queued = 1
+        cp.save()
+        cp = dbf.BackfillCheckpoint(self._checkpoint, 'cbor||')
+        self.assertTrue(cp.seen('/a/b/20210101-000004-n1.cbor.xz'))
+        self.assertFalse(cp.seen('/a/b/20210101-000002-n1.cbor.xz'))
+        self.assertEqual(cp.queued, 1)
+        cp = dbf.BackfillCheckpoint(self._checkpoint, 'pcap||')
+        self.assertFalse(cp.seen('/a/b/20210101-000004-n1.cbor.xz'))
+        self.assertEqual(cp.queued, 0)
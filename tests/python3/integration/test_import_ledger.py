@@ -0,0 +1,70 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import datetime
+import unittest
+
+import dsv.common.ImportLedger as dil
+import dsv.common.Path as dp
+
+class FakeClient:
+    """Client holding ledger rows in a list."""
+    def __init__(self, fail=False):
+        self.rows = []
+        self.queries = 0
+        self._fail = fail
+
+    def execute(self, query, params=None, settings=None):
+        if self._fail:
+            raise EOFError('Connection closed')
+        if query.startswith('INSERT'):
+            self.rows.extend(params)
+            return None
+        self.queries += 1
+        names = params.get('names')
+        return [(r['FileName'],) for r in self.rows
+                if r['NodeID'] == params['nodeid'] and (names is None or r['FileName'] in names)]
+
+class FakeResolver:
+    def node_id(self, server, node):
+        return {'n1': 1, 'n2': 2}.get(node)
+
+class TestImportLedger(unittest.TestCase):
+    def test_source_name(self):
+        self.assertEqual(dil.source_name('20210101-000000-n1.cdns.xz'), '20210101-000000-n1.cdns')
+        self.assertEqual(dil.source_name('20210101-000000-n1.cdns.tsv'), '20210101-000000-n1.cdns')
+        self.assertEqual(dil.source_name('20210101-000000-n1.cdns'), '20210101-000000-n1.cdns')
+
+    def test_record(self):
+        client = FakeClient()
+        dil.record(client, 'dsv', 1, [('20210101-000000-n1.cdns', 10), ('n1.cdns', 5)])
+        self.assertEqual([(r['Date'], r['NodeID'], r['Rows']) for r in client.rows],
+                         [(datetime.date(2021, 1, 1), 1, 10),
+                          (datetime.date.today(), 1, 5)])
+        self.assertEqual(dil.imported(client, 'dsv', 1, ['n1.cdns', 'n2.cdns']), {'n1.cdns'})
+        self.assertEqual(dil.imported(client, 'dsv', 2, ['n1.cdns']), set())
+        self.assertEqual(dil.imported(client, 'dsv', 1, []), set())
+
+    def test_filter(self):
+        client = FakeClient()
+        dil.record(client, 'dsv', 1, [('20210101-000000-n1.cdns', 10)])
+        ledger = dil.LedgerFilter(client, 'dsv', FakeResolver())
+        self.assertTrue(ledger.imported(dp.DSVPath('/d/server/n1/cbor/20210101-000000-n1.cdns.xz')))
+        self.assertFalse(ledger.imported(dp.DSVPath('/d/server/n1/cbor/20210101-000500-n1.cdns.xz')))
+        self.assertTrue(ledger.imported(
+            dp.DSVPath('/d/server/n1/error-import-tsv/20210101-000000-n1.cdns.tsv')))
+        self.assertFalse(ledger.imported(dp.DSVPath('/d/server/n3/cbor/20210101-000000-n1.cdns.xz')))
+        # The ledger is read once for each node.
+        self.assertEqual(client.queries, 1)
+        self.assertEqual(ledger.skipped, 2)
+
+    def test_filter_unavailable(self):
+        ledger = dil.LedgerFilter(FakeClient(fail=True), 'dsv', FakeResolver())
+        with self.assertLogs(level='WARNING'):
+            self.assertFalse(ledger.imported(dp.DSVPath('/d/server/n1/cbor/a.cdns.xz')))
+        self.assertFalse(ledger.imported(dp.DSVPath('/d/server/n2/cbor/a.cdns.xz')))
@@ -0,0 +1,75 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import datetime
+import importlib
+import pathlib
+
+from unittest.mock import patch
+
+import common
+
+di = importlib.import_module('dsv.commands.import')
+
+class TestSchedule(common.DSVTestCase):
+    def setUp(self):
+        super().setUp()
+        self._base = pathlib.Path(self._datastore_path.name)
+        # Node 'busy' has 8 files, node 'quiet' has 2.
+        for node, nfiles in [('busy', 8), ('quiet', 2)]:
+            d = self._base / 'server' / node / 'cbor'
+            d.mkdir(parents=True)
+            for n in range(nfiles):
+                (d / '20210101-00000{}-{}.cbor.xz'.format(n, node)).write_bytes(b'x' * (n + 1))
+
+    def tearDown(self):
+        di.node_weighting = None
+        super().tearDown()
+
+    def _nodes(self, **kwargs):
+        return [pathlib.Path(f).parent.parent.name
+                for f in di.files_to_process(self._base, di.CDNS_DIR_PATTERN, '*.cbor.xz',
+                                             **kwargs)]
+
+    def test_round_robin(self):
+        files = list(di.files_to_process(self._base, di.CDNS_DIR_PATTERN, '*.cbor.xz'))
+        self.assertEqual(len(files), 10)
+        nodes = [pathlib.Path(f).parent.parent.name for f in files]
+        self.assertEqual(sorted(nodes[0:2]), ['busy', 'quiet'])
+        self.assertEqual(sorted(nodes[2:4]), ['busy', 'quiet'])
+        self.assertEqual(nodes[4:], ['busy'] * 6)
+        busy = [f for f in files if 'busy' in f]
+        self.assertEqual(busy, sorted(busy, reverse=True))
+
+    def test_date_range(self):
+        nodes = self._nodes(from_date=datetime.datetime(2021, 1, 1, 0, 0, 1),
+                            to_date=datetime.datetime(2021, 1, 1, 0, 0, 5))
+        self.assertEqual(sorted(nodes), ['busy'] * 4 + ['quiet'])
+
+    def test_weight_backlog(self):
+        di.node_weighting = di.WEIGHT_BACKLOG
+        nodes = self._nodes()
+        # Quiet node gets 1 in 5 turns, so finishes at the same time as busy.
+        self.assertEqual(nodes[0:5].count('quiet'), 1)
+        self.assertEqual(nodes[5:10].count('quiet'), 1)
+
+    def test_weight_bytes(self):
+        di.node_weighting = di.WEIGHT_BYTES
+        nodes = self._nodes()
+        self.assertEqual(len(nodes), 10)
+        self.assertEqual(nodes[0:5].count('quiet'), 1)
+
+    def test_weight_lazy(self):
+        # Nodes are only read when they have their first turn.
+        di.node_weighting = di.WEIGHT_BACKLOG
+        with patch.object(di, 'dir_file_names', wraps=di.dir_file_names) as names:
+            files = di.files_to_process(self._base, di.CDNS_DIR_PATTERN, '*.cbor.xz')
+            next(files)
+            self.assertEqual(names.call_count, 1)
+            self.assertEqual(len(list(files)), 9)
+            self.assertEqual(names.call_count, 2)
@@ -0,0 +1,69 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import importlib
+import pathlib
+
+from unittest.mock import Mock, patch
+
+import common
+import dsv.common.Inotify as dinotify
+
+di = importlib.import_module('dsv.commands.import')
+
+class TestWatch(common.DSVTestCase):
+    def setUp(self):
+        super().setUp()
+        self._base = pathlib.Path(self._datastore_path.name)
+        self._incoming = self._base / 'server' / 'node' / 'incoming'
+        self._incoming.mkdir(parents=True)
+        (self._incoming / 'old.cbor.xz').touch()
+        self._lock = pathlib.Path(self._config['datastore']['lockfile'].format('import'))
+        self._lock.touch()
+        self._inotify = dinotify.Inotify()
+        self._watcher = di.IncomingWatcher(self._inotify, self._base,
+                                           '*.cbor.xz', self._lock)
+
+    def tearDown(self):
+        self._inotify.close()
+        super().tearDown()
+
+    def test_new_files(self):
+        self.assertEqual(self._watcher.watch(), [str(self._incoming / 'old.cbor.xz')])
+        (self._incoming / 'new.cbor.xz').touch()
+        (self._incoming / 'ignore.tsv').touch()
+        self.assertEqual(self._watcher.events(),
+                         ([str(self._incoming / 'new.cbor.xz')], set()))
+
+    def test_new_node(self):
+        self._watcher.watch()
+        incoming = self._base / 'server2' / 'node2' / 'incoming'
+        incoming.mkdir(parents=True)
+        (incoming / 'new.cbor.xz').touch()
+        files = []
+        while not files:
+            files, _ = self._watcher.events()
+        self.assertEqual(files, [str(incoming / 'new.cbor.xz')])
+
+    def test_control(self):
+        self._watcher.watch()
+        self._lock.chmod(0o444)
+        (self._base / 'server' / 'dsv.filter').touch()
+        _, control = self._watcher.events()
+        self.assertEqual(control, {'lock', 'filter'})
+
+    def test_watch_count(self):
+        events = [(['/a', '/b'], set()), ([], {'rescan'}), KeyboardInterrupt()]
+        lock = Mock(path=self._lock)
+        lock.is_frozen.return_value = False
+        with patch.object(di.IncomingWatcher, 'events', side_effect=events), \
+             patch.object(di, 'process_incoming', return_value=2), \
+             patch.object(di, 'process_incoming_file', return_value=1):
+            # Interrupting the watch returns the number of jobs queued.
+            self.assertEqual(di.watch_incoming(None, self._base, '*.cbor.xz', lock,
+                                               False, False), 6)
@@ -0,0 +1,408 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import datetime
+import fcntl
+import os
+import pathlib
+import stat
+import subprocess
+import tempfile
+
+from unittest.mock import Mock, patch
+
+import common
+import dsv.common.JobBase as djb
+import dsv.common.JobHandlers as djh
+import dsv.common.TsvImport as dtsv
+
+# A fake inspector, which writes its standard input to the -o or --output file,
+# or fails if the input is 'fail'.
+FAKE_INSPECTOR = '''#!/bin/sh
+while [ $# -gt 1 ]; do
+    if [ "$1" = "-o" ] || [ "$1" = "--output" ]; then out=$2; fi
+    shift
+done
+cat > $out
+if [ -f $out ] && grep -q fail $out; then echo "Bad input" >&2; exit 1; fi
+exit 0
+'''
+
+# A fake clickhouse-client, which appends its standard input to
+# inserts.tsv in its directory, or fails if the input contains 'fail'.
+FAKE_CLICKHOUSE_CLIENT = '''#!/bin/sh
+data=$(cat)
+if echo "$data" | grep -q fail; then echo "Bad data" >&2; exit 1; fi
+echo "$data" >> $(dirname $0)/inserts.tsv
+echo "--" >> $(dirname $0)/inserts.tsv
+exit 0
+'''
+
+class TestJobHandlers(common.DSVTestCase):
+    def setUp(self):
+        super().setUp()
+        self._base = pathlib.Path(self._datastore_path.name)
+        self._pending = self._base / 'server' / 'node' / 'pcap' / 'pending'
+        self._pending.mkdir(parents=True)
+        self._bindir = tempfile.TemporaryDirectory(prefix='bin_')
+        inspector = pathlib.Path(self._bindir.name) / 'inspector'
+        inspector.write_text(FAKE_INSPECTOR)
+        inspector.chmod(inspector.stat().st_mode | stat.S_IXUSR)
+        client = pathlib.Path(self._bindir.name) / 'clickhouse-client'
+        client.write_text(FAKE_CLICKHOUSE_CLIENT)
+        client.chmod(client.stat().st_mode | stat.S_IXUSR)
+        self._path = os.environ['PATH']
+        os.environ['PATH'] = self._bindir.name + os.pathsep + self._path
+        self._config['worker']['import-pace-parts'] = '0'
+        self._ctx = djh.HandlerContext(self._config, None)
+
+    def tearDown(self):
+        os.environ['PATH'] = self._path
+        self._bindir.cleanup()
+        super().tearDown()
+
+    def test_tsv_check_values(self):
+        row = ['2021-01-01', '1609459200', '1609459200000000000', '3'] + ['x'] * 18 + ['1234']
+        tsv = self._base / 'test.tsv'
+        tsv.write_text('\t'.join(row) + '\n')
+        values, fmt = dtsv.check_values(tsv)
+        self.assertEqual(fmt, 'TabSeparated')
+        self.assertEqual(values['nodeid'], 3)
+        self.assertEqual(values['qid'], 1234)
+
+        header = [name for _, name in dtsv.TSV_CHECK_COLUMNS[0:4]] + ['x'] * 18 + ['ID']
+        tsv.write_text('\t'.join(header) + '\n')
+        self.assertEqual(dtsv.check_values(tsv), (None, 'TabSeparatedWithNames'))
+        tsv.write_text('\t'.join(header) + '\n' + '\t'.join(row) + '\n')
+        self.assertEqual(dtsv.check_values(tsv)[0]['datetime'], 1609459200)
+
+        header[1] = 'Time'
+        tsv.write_text('\t'.join(header) + '\n')
+        with self.assertRaises(djh.JobError) as cm:
+            dtsv.check_values(tsv)
+        self.assertEqual(cm.exception.returncode, djh.INFRASTRUCTURE_ERROR)
+
+    def test_cdns_to_pcap(self):
+        cdns = self._pending / 'test.cdns'
+        cdns.write_text('data')
+        res = djh.run_job(self._ctx, 'cdns-to-pcap', str(cdns))
+        self.assertEqual(res.returncode, djh.SUCCESS)
+        self.assertEqual((self._pending.parent / 'test.cdns.pcap').read_text(), 'data')
+
+        cdns.write_text('fail')
+        res = djh.run_job(self._ctx, 'cdns-to-pcap', str(cdns))
+        self.assertEqual(res.returncode, djh.FAILURE)
+        self.assertIn('Bad input', res.stderr.decode())
+        self.assertEqual(list(self._pending.parent.glob('*.pcap*')), [])
+
+        cdns.unlink()
+        res = djh.run_job(self._ctx, 'cdns-to-pcap', str(cdns))
+        self.assertEqual(res.returncode, djh.SUCCESS)
+
+    def test_run_job(self):
+        def handler(ctx, path):
+            raise djh.JobError(djh.TRANSIENT_FAILURE, 'Try again')
+
+        with patch.dict(djh.HANDLERS, {'import-tsv': handler}):
+            res = djh.run_job(self._ctx, 'import-tsv', '/no/such/file')
+            self.assertEqual(res.returncode, djh.TRANSIENT_FAILURE)
+            self.assertEqual(res.stderr, b'Try again')
+
+        def oserror(ctx, path):
+            raise OSError(28, 'No space left on device')
+
+        with patch.dict(djh.HANDLERS, {'import-tsv': oserror}):
+            res = djh.run_job(self._ctx, 'import-tsv', '/no/such/file')
+            self.assertEqual(res.returncode, djh.TRANSIENT_FAILURE)
+            self.assertIn(b'No space left on device', res.stderr)
+
+        with patch('dsv.common.JobHandlers.run_external') as mock_external:
+            djh.run_job(None, 'import-tsv', '/no/such/file')
+            mock_external.assert_called_once_with('import-tsv', '/no/such/file')
+
+    def test_pipeline_stderr(self):
+        # More stderr than a pipe holds, from a command not last in the
+        # pipeline, doesn't block it.
+        with tempfile.TemporaryFile() as out:
+            ok, err = djb.pipeline(
+                [['sh', '-c', 'head -c 200000 /dev/zero | tr "\\0" x >&2; echo data'],
+                 ['sh', '-c', 'cat; echo done >&2']],
+                subprocess.DEVNULL, out)
+            out.seek(0)
+            self.assertEqual(out.read(), b'data\n')
+        self.assertTrue(ok)
+        self.assertEqual(len(err), 200005)
+        self.assertTrue(err.endswith('x\ndone'))
+
+    def _inserts(self):
+        inserts = pathlib.Path(self._bindir.name) / 'inserts.tsv'
+        if not inserts.exists():
+            return []
+        return [i.strip('\n').split('\n') for i in inserts.read_text().split('--\n') if i]
+
+    def test_import_tsv_batch(self):
+        incoming = self._base / 'server' / 'node' / 'incoming' / 'pending'
+        incoming.mkdir(parents=True)
+        # Two files in one week, one in the next (weeks start on Sunday).
+        names = ['20210101-000000-a.tsv', '20210102-000000-b.tsv', '20210103-000000-c.tsv']
+        for name in names:
+            (incoming / name).write_text(name + '\n')
+        (incoming / (names[1] + '.info')).write_text('info\n')
+
+        with patch('dsv.common.TsvImport.check_values',
+                   return_value=(None, 'TabSeparated')):
+            res = djh.run_job(self._ctx, 'import-tsv', str(incoming / names[0]))
+        self.assertEqual(res.returncode, djh.SUCCESS)
+        self.assertEqual(res.rows, 2)
+        self.assertEqual(self._inserts(), [names[0:2], ['info']])
+        # The worker removes the job file; other files imported are removed.
+        self.assertEqual(sorted(p.name for p in incoming.iterdir()), [names[0], names[2]])
+
+    def test_import_tsv_batch_failure(self):
+        incoming = self._base / 'server' / 'node' / 'incoming' / 'pending'
+        incoming.mkdir(parents=True)
+        good = incoming / '20210101-000000-a.tsv'
+        bad = incoming / '20210101-000500-b.tsv'
+        good.write_text('good\n')
+        bad.write_text('fail\n')
+
+        with patch('dsv.common.TsvImport.check_values',
+                   return_value=(None, 'TabSeparated')):
+            res = djh.run_job(self._ctx, 'import-tsv', str(good))
+            self.assertEqual(res.returncode, djh.TRANSIENT_FAILURE)
+            self.assertTrue(bad.exists())
+            # On retry, and for the other file's own job, import alone.
+            res = djh.run_job(self._ctx, 'import-tsv', str(good), 1)
+            self.assertEqual(res.returncode, djh.SUCCESS)
+            res = djh.run_job(self._ctx, 'import-tsv', str(bad))
+            self.assertEqual(res.returncode, djh.TRANSIENT_FAILURE)
+        self.assertEqual(self._inserts(), [['good']])
+
+    def test_import_tsv_deferred(self):
+        tsv = self._base / 'server' / 'node' / 'incoming' / 'pending' / 'test.tsv'
+        tsv.parent.mkdir(parents=True)
+        tsv.write_text('data\n')
+        notbefore = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(seconds=10)
+        with patch('dsv.common.TsvImport.check_values',
+                   return_value=(None, 'TabSeparated')), \
+             patch.object(self._ctx, 'insert_deferral',
+                          return_value=(notbefore, 'ClickHouse parts 200')):
+            res = djh.run_job(self._ctx, 'import-tsv', str(tsv))
+        self.assertEqual(res.returncode, djh.TRANSIENT_FAILURE)
+        self.assertEqual(djh.not_before(res), notbefore)
+        self.assertEqual(self._inserts(), [])
+        self.assertTrue(tsv.exists())
+
+    def test_import_tsv_shard(self):
+        tsv = self._base / 'server' / 'node' / 'incoming' / 'pending' / 'test.cdns.tsv'
+        tsv.parent.mkdir(parents=True)
+        tsv.write_text('data\n')
+        tsv.with_name(tsv.name + '.info').write_text('info\n')
+        self._config['clickhouse']['servers'] = 'ch1,ch2,ch3'
+        self._config['clickhouse']['shard-insert'] = 'node'
+        inserts = []
+
+        def insert(client, query, blocks):
+            inserts.append((client[client.index('--host') + 1], query))
+            list(blocks)
+            return (True, '')
+
+        with patch('dsv.common.TsvImport.check_values',
+                   return_value=({'nodeid': 4}, 'TabSeparated')), \
+             patch('dsv.common.ImportLedger.imported', return_value=set()), \
+             patch('dsv.common.ImportLedger.record'), \
+             patch.object(dtsv, 'insert_blocks', side_effect=insert), \
+             patch.object(self._ctx, 'clickhouse'):
+            res = djh.run_job(self._ctx, 'import-tsv', str(tsv))
+        self.assertEqual(res.returncode, djh.SUCCESS)
+        self.assertEqual(inserts, [
+            ('ch2', 'INSERT INTO dsv.QueryResponseShard FORMAT TabSeparated'),
+            ('ch2', 'INSERT INTO dsv.PacketCountsShard FORMAT TabSeparated')])
+
+    def test_import_tsv_ledger(self):
+        incoming = self._base / 'server' / 'node' / 'incoming' / 'pending'
+        incoming.mkdir(parents=True)
+        names = ['20210101-000000-a.cdns.tsv', '20210101-000500-b.cdns.tsv']
+        for name in names:
+            (incoming / name).write_text(name + '\n')
+        def imported(client, database, node_id, sources):
+            return {s for s in sources if s.startswith('20210101-000500')}
+
+        with patch('dsv.common.TsvImport.check_values',
+                   return_value=({'nodeid': 3}, 'TabSeparated')), \
+             patch('dsv.common.ImportLedger.imported', side_effect=imported), \
+             patch('dsv.common.ImportLedger.record') as record, \
+             patch.object(self._ctx, 'clickhouse'):
+            res = djh.run_job(self._ctx, 'import-tsv', str(incoming / names[0]))
+        self.assertEqual(res.returncode, djh.SUCCESS)
+        # The file in the ledger is not imported again, but removed.
+        self.assertEqual(self._inserts(), [names[0:1]])
+        self.assertEqual(sorted(p.name for p in incoming.iterdir()), names[0:1])
+        record.assert_called_once()
+        self.assertEqual(record.call_args[0][2:], (3, [('20210101-000000-a.cdns', 1)]))
+
+    def test_cdns_to_tsv_stream(self):
+        class FakeClient:
+            def __init__(self):
+                self.rows = []
+                self.ledger = []
+
+            def execute(self, query, data=None, settings=None):
+                if query.startswith('DESCRIBE'):
+                    return [('Date', 'Date'), ('NodeID', 'UInt16')]
+                if 'ImportLedger' in query:
+                    if query.startswith('SELECT'):
+                        return [(r['FileName'],) for r in self.ledger
+                                if r['FileName'] in data['names']]
+                    self.ledger.extend(data)
+                    return None
+                self.rows.extend(data)
+                return None
+
+        template = pathlib.Path(self._bindir.name) / 'tsv.tpl'
+        template.write_text('')
+        incoming = self._base / 'server' / 'node' / 'incoming' / 'pending'
+        incoming.mkdir(parents=True)
+        cdns = incoming / 'test.cdns'
+        cdns.write_text('Date\tNodeID\n2021-01-01\t3\n2021-01-02\t3\n')
+        self._config['worker']['import-mode'] = 'stream'
+        client = FakeClient()
+        with patch.object(djh, 'TSV_TEMPLATES', [template]), \
+             patch.object(self._ctx, 'node_id', return_value=3), \
+             patch.object(self._ctx, 'clickhouse', return_value=client):
+            res = djh.run_job(self._ctx, 'cdns-to-tsv', str(cdns))
+        self.assertEqual(res.returncode, djh.SUCCESS)
+        self.assertEqual(res.rows, 2)
+        self.assertEqual(client.rows, [[datetime.date(2021, 1, 1), 3],
+                                       [datetime.date(2021, 1, 2), 3]])
+        # No TSV is written.
+        self.assertEqual([p.name for p in incoming.iterdir()], ['test.cdns'])
+        self.assertEqual([(r['NodeID'], r['FileName'], r['Rows']) for r in client.ledger],
+                         [(3, 'test.cdns', 2)])
+
+        # Once in the ledger, the file is not converted again.
+        with patch.object(djh, 'TSV_TEMPLATES', [template]), \
+             patch.object(self._ctx, 'node_id', return_value=3), \
+             patch.object(self._ctx, 'clickhouse', return_value=client):
+            res = djh.run_job(self._ctx, 'cdns-to-tsv', str(cdns))
+        self.assertEqual(res.returncode, djh.SUCCESS)
+        self.assertEqual(len(client.rows), 2)
+
+    def test_cdns_to_tsv_with_pcap(self):
+        template = pathlib.Path(self._bindir.name) / 'tsv.tpl'
+        template.write_text('')
+        incoming = self._base / 'server' / 'node' / 'incoming' / 'pending'
+        incoming.mkdir(parents=True)
+        cdns = incoming / 'test.cdns'
+        cdns.write_text('data')
+        pcap_pending = self._pending / 'test.cdns'
+        os.link(str(cdns), str(pcap_pending))
+        self._config['worker']['combine-pcap'] = 'Y'
+        self._ctx.writer = Mock()
+
+        # A cdns-to-pcap job is running for the file.
+        with pcap_pending.open('rb') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            with patch.object(djh, 'TSV_TEMPLATES', [template]), \
+                 patch.object(djh, '_source_imported', return_value=False), \
+                 patch.object(self._ctx, 'node_id', return_value=3):
+                res = djh.run_job(self._ctx, 'cdns-to-tsv', str(cdns))
+        self.assertEqual(res.returncode, djh.SUCCESS)
+        self.assertEqual((incoming / 'test.cdns.tsv').read_text(), 'data')
+        self.assertTrue(pcap_pending.exists())
+        self.assertEqual(list(self._pending.parent.glob('*.pcap*')), [])
+
+        with patch.object(djh, 'TSV_TEMPLATES', [template]), \
+             patch.object(djh, '_source_imported', return_value=False), \
+             patch.object(self._ctx, 'node_id', return_value=3):
+            res = djh.run_job(self._ctx, 'cdns-to-tsv', str(cdns))
+        self.assertEqual(res.returncode, djh.SUCCESS)
+        self.assertEqual((incoming / 'test.cdns.tsv').read_text(), 'data')
+        self.assertEqual((self._pending.parent / 'test.cdns.pcap').read_text(), 'data')
+        self.assertFalse(pcap_pending.exists())
+
+        # The cdns-to-pcap job finds nothing to do.
+        res = djh.run_job(self._ctx, 'cdns-to-pcap', str(pcap_pending))
+        self.assertEqual(res.returncode, djh.SUCCESS)
+
+    def test_import_tsv_probe(self):
+        tsv = self._base / 'server' / 'node' / 'incoming' / 'pending' / 'test.cdns.tsv'
+        tsv.parent.mkdir(parents=True)
+        tsv.write_text('data\n')
+        values = {'date': '2021-01-01', 'datetime': 1609459200, 'nanosecs': 0,
+                  'nodeid': 3, 'qid': 1}
+        # The first record is in the query table, but the file isn't in the ledger.
+        client = Mock()
+        client.execute.return_value = [(3,)]
+
+        with patch('dsv.common.TsvImport.check_values',
+                   return_value=(values, 'TabSeparated')), \
+             patch('dsv.common.ImportLedger.imported', return_value=set()), \
+             patch('dsv.common.ImportLedger.record'), \
+             patch.object(self._ctx, 'clickhouse', return_value=client):
+            # Without the probe, the file is imported again.
+            res = djh.run_job(self._ctx, 'import-tsv', str(tsv))
+            self.assertEqual(res.returncode, djh.SUCCESS)
+            client.execute.assert_not_called()
+            self.assertEqual(self._inserts(), [['data']])
+
+            self._config['worker']['import-probe'] = 'Y'
+            res = djh.run_job(self._ctx, 'import-tsv', str(tsv))
+            self.assertEqual(res.returncode, djh.SUCCESS)
+            self.assertEqual(res.rows, None)
+            client.execute.assert_called_once()
+            query, params = client.execute.call_args[0]
+            self.assertIn('FROM dsv.QueryResponse ', query)
+            self.assertEqual(params, values)
+        self.assertEqual(self._inserts(), [['data']])
+
+    def test_import_tsv_chunked(self):
+        tsv = self._base / 'server' / 'node' / 'incoming' / 'pending' / 'test.cdns.tsv'
+        tsv.parent.mkdir(parents=True)
+        tsv.write_text('h\na\nb\nc\nd\ne')
+        progress = tsv.with_suffix('.progress')
+        self._config['worker']['import-chunk-rows'] = '2'
+        self._config['worker']['import-probe'] = 'Y'
+        insert_blocks = dtsv.insert_blocks
+        calls = []
+
+        def insert(client, query, blocks):
+            # The second chunk fails the first time.
+            calls.append(query)
+            if len(calls) == 2:
+                return (False, 'Memory limit exceeded')
+            return insert_blocks(client, query, blocks)
+
+        with patch('dsv.common.TsvImport.check_values',
+                   return_value=({'nodeid': 3}, 'TabSeparatedWithNames')), \
+             patch('dsv.common.JobHandlers._already_imported',
+                   return_value=False) as probe, \
+             patch('dsv.common.ImportLedger.imported', return_value=set()), \
+             patch('dsv.common.ImportLedger.record') as record, \
+             patch.object(dtsv, 'insert_blocks', side_effect=insert), \
+             patch.object(self._ctx, 'clickhouse'):
+            res = djh.run_job(self._ctx, 'import-tsv', str(tsv))
+            self.assertEqual(res.returncode, djh.TRANSIENT_FAILURE)
+            self.assertIn('after 2 rows', res.stderr.decode())
+            self.assertEqual(progress.read_text().split()[3:], ['6', '2'])
+            record.assert_not_called()
+
+            # The retry resumes with the second chunk, without probing.
+            res = djh.run_job(self._ctx, 'import-tsv', str(tsv), 1)
+            self.assertEqual(res.returncode, djh.SUCCESS)
+            self.assertEqual(res.rows, 3)
+        self.assertEqual(self._inserts(), [['h', 'a', 'b'], ['h', 'c', 'd'], ['h', 'e']])
+        self.assertEqual(probe.call_count, 1)
+        self.assertEqual(record.call_args[0][2:], (3, [('test.cdns', 5)]))
+        self.assertFalse(progress.exists())
+
+        # Progress for a different file is ignored.
+        progress.write_text('1 2 3 6 2\n')
+        prog = dtsv.ImportProgress(tsv, tsv.open('rb'))
+        self.assertFalse(prog.resuming)
+        self.assertFalse(progress.exists())
@@ -0,0 +1,49 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import datetime
+import json
+import unittest
+
+import dsv.common.Queue as dq
+
+class TestJobPayload(unittest.TestCase):
+    def test_round_trip(self):
+        notbefore = datetime.datetime(2021, 1, 1, 12, 0, 5)
+        queued = datetime.datetime(2021, 1, 1, 12)
+        data = dq.JobPayload('/d/s/n/a|b.tsv', notbefore=notbefore, retry_count=2,
+                             queued=queued, size=1234, node_id=7,
+                             precedence=dq.JobPrecedence.low,
+                             files=['/d/s/n/c.tsv']).encode()
+        self.assertEqual(json.loads(data.decode())['v'], dq.PAYLOAD_VERSION)
+        payload = dq.JobPayload.decode(data.decode())
+        self.assertEqual((payload.path, payload.notbefore, payload.retry_count, payload.queued),
+                         ('/d/s/n/a|b.tsv', notbefore, 2, queued))
+        self.assertEqual((payload.size, payload.node_id, payload.precedence, payload.files),
+                         (1234, 7, dq.JobPrecedence.low, ['/d/s/n/c.tsv']))
+
+        # Fields not known are ignored, and fields not given are None.
+        payload = dq.JobPayload.decode('{"v":2,"path":"/a","new":1}')
+        self.assertEqual((payload.path, payload.notbefore, payload.retry_count), ('/a', None, 0))
+        self.assertIsNone(payload.size)
+
+    def test_old_format(self):
+        payload = dq.JobPayload.decode('/a|1609502405.0|1609502400.0|3')
+        self.assertEqual((payload.path, payload.retry_count), ('/a', 3))
+        self.assertEqual(payload.notbefore, datetime.datetime.fromtimestamp(1609502405))
+        self.assertEqual(payload.queued, datetime.datetime.fromtimestamp(1609502400))
+
+        payload = dq.JobPayload.decode('/a||1')
+        self.assertEqual((payload.path, payload.notbefore, payload.retry_count, payload.queued),
+                         ('/a', None, 1, None))
+        self.assertEqual(dq.JobPayload.decode('/a').path, '/a')
+
+    def test_malformed(self):
+        with self.assertLogs(level='WARNING'):
+            payload = dq.JobPayload.decode('{"path":')
+        self.assertEqual(payload.path, '{"path":')
@@ -0,0 +1,85 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import datetime
+import subprocess
+import unittest
+
+import dsv.common.JobHandlers as djh
+import dsv.common.JobStats as djs
+
+class FakeClient:
+    def __init__(self):
+        self.inserts = []
+        self.fail = False
+
+    def execute(self, query, rows):
+        if self.fail:
+            raise OSError('Connection refused')
+        self.inserts.append(list(rows))
+
+class FakeContext:
+    def __init__(self):
+        self.cfg = {'clickhouse': {'servers': 'ch1,'}}
+        self.client = FakeClient()
+        self.closed = False
+
+    def node_id(self, server, node):
+        return 7 if (server, node) == ('server', 'node') else None
+
+    def clickhouse(self, server):
+        return self.client
+
+    def clickhouse_failed(self, server):
+        pass
+
+    def close(self):
+        self.closed = True
+
+class TestJobStats(unittest.TestCase):
+    def setUp(self):
+        self._ctx = FakeContext()
+        self._started = datetime.datetime(2021, 1, 1, 12)
+
+    def _record(self, recorder, arg, res):
+        recorder.record('import-tsv', arg, 1, 100,
+                        self._started - datetime.timedelta(seconds=5), self._started, 2.5, res)
+
+    def test_batch(self):
+        recorder = djs.JobStatsRecorder(self._ctx, 2, 3600)
+        self._record(recorder, '/srv/server/node/incoming/f.tsv',
+                     djh.JobResult(['import-tsv'], 0, rows=42))
+        self.assertEqual(self._ctx.client.inserts, [])
+        self._record(recorder, '/srv/other/node/incoming/g.tsv',
+                     subprocess.CompletedProcess(['import-tsv'], 2))
+        self.assertEqual(len(self._ctx.client.inserts), 1)
+        first, second = self._ctx.client.inserts[0]
+        self.assertEqual(first['NodeID'], 7)
+        self.assertEqual(first['FileName'], 'f.tsv')
+        self.assertEqual(first['Rows'], 42)
+        self.assertEqual(first['QueueWait'], 5.0)
+        self.assertEqual(second['NodeID'], 0)
+        self.assertEqual(second['Rows'], 0)
+        self.assertEqual(second['ExitCode'], 2)
+
+        recorder.close()
+        self.assertTrue(self._ctx.closed)
+        self.assertEqual(len(self._ctx.client.inserts), 1)
+
+    def test_failed_insert(self):
+        recorder = djs.JobStatsRecorder(self._ctx, 1, 3600)
+        self._ctx.client.fail = True
+        for n in range(djs.MAX_PENDING_BATCHES + 5):
+            self._record(recorder, '/srv/server/node/incoming/{}.tsv'.format(n),
+                         djh.JobResult(['import-tsv'], 0))
+        self._ctx.client.fail = False
+        recorder.close()
+        # Only the most recent rows are kept.
+        rows = self._ctx.client.inserts[0]
+        self.assertEqual(len(rows), djs.MAX_PENDING_BATCHES)
+        self.assertEqual(rows[-1]['FileName'], '{}.tsv'.format(djs.MAX_PENDING_BATCHES + 4))
@@ -0,0 +1,165 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import datetime
+import threading
+import time
+
+from unittest.mock import patch
+
+import common
+import dsv.common.Queue as dq
+
+class TestLocalQueue(common.DSVTestCase):
+    def setUp(self):
+        super().setUp()
+        self._config['queue']['backend'] = 'local'
+        self._qcontext = dq.QueueContext(self._config, 'test')
+
+    def test_order(self):
+        with self._qcontext.writer() as writer:
+            writer.add('cdns-to-tsv', '/t1')
+            writer.add_many('cdns-to-pcap', ['/p1', '/p2'], dq.JobPrecedence.low)
+            writer.add('cdns-to-pcap', '/p3', dq.JobPrecedence.high, retry_count=2)
+            self.assertEqual(writer.add_many('cdns-to-tsv', iter(['/t2', '/t3'])), 2)
+            self.assertEqual(writer.status(), [('cdns-to-pcap', 3, 0, 0),
+                                               ('cdns-to-tsv', 3, 0, 0)])
+
+        with self._qcontext.reader() as reader:
+            reader.register('cdns-to-tsv')
+            reader.register('cdns-to-pcap')
+            # The last registered queue first, then by precedence.
+            got = []
+            for _ in range(6):
+                job = reader.get(0)
+                got.append(job.arg)
+                job.done()
+            self.assertEqual(got, [('/p3', None, 2), ('/p1', None, 0), ('/p2', None, 0),
+                                   ('/t1', None, 0), ('/t2', None, 0), ('/t3', None, 0)])
+            self.assertIsNone(reader.get(0))
+            self.assertEqual(self._qcontext.status(), [('cdns-to-pcap', 0, 0, 1),
+                                                       ('cdns-to-tsv', 0, 0, 1)])
+
+    def test_notbefore(self):
+        later = datetime.datetime.now() + datetime.timedelta(hours=1)
+        with self._qcontext.writer() as writer:
+            writer.add('import-tsv', '/later', notbefore=later)
+            writer.add('import-tsv', '/now', notbefore=datetime.datetime.now())
+        with self._qcontext.reader() as reader:
+            reader.register('import-tsv')
+            job = reader.get(0)
+            self.assertEqual(job.arg, ('/now', None, 0))
+            self.assertIsNotNone(job.queued)
+            self.assertIsNone(reader.get(0))
+
+    def test_payload(self):
+        tsv = self._datastore_path.name + '/a.tsv'
+        with open(tsv, 'w') as f:
+            f.write('data\n')
+        with self._qcontext.writer() as writer:
+            writer.add('import-tsv', tsv, node_id=3)
+        with self._qcontext.reader() as reader:
+            reader.register('import-tsv')
+            job = reader.get(0)
+            self.assertEqual((job.arg[0], job.size, job.node_id), (tsv, 5, 3))
+
+    def test_promote(self):
+        self._config['queue']['promote-after'] = '60'
+        qcontext = dq.QueueContext(self._config, 'test')
+        with qcontext.writer() as writer:
+            writer.add('cdns-to-pcap', '/old', dq.JobPrecedence.low)
+            writer.add('cdns-to-pcap', '/p1')
+        later = time.time() + 120
+        with qcontext.writer() as writer, patch('time.time', return_value=later):
+            writer.add('cdns-to-pcap', '/new', dq.JobPrecedence.low)
+            writer.add('cdns-to-pcap', '/p2')
+        # The old low precedence job has waited long enough to be
+        # promoted, and so goes ahead of normal jobs queued after it.
+        with qcontext.reader() as reader, patch('time.time', return_value=later):
+            reader.register('cdns-to-pcap')
+            got = []
+            for _ in range(4):
+                job = reader.get(0)
+                got.append(job.arg[0])
+                job.done()
+            self.assertEqual(got, ['/old', '/p1', '/p2', '/new'])
+
+    def test_duplicates(self):
+        with self._qcontext.writer() as writer:
+            writer.add('cdns-to-tsv', '/a')
+            self.assertEqual(writer.add_many('cdns-to-tsv', ['/a', '/b', '/b']), 1)
+            # The same file on another queue is a different job.
+            writer.add('cdns-to-pcap', '/a')
+            self.assertEqual(self._qcontext.status(), [('cdns-to-pcap', 1, 0, 0),
+                                                       ('cdns-to-tsv', 2, 0, 0)])
+        self.assertEqual(self._qcontext.duplicates(), {'cdns-to-tsv': 2})
+
+        with self._qcontext.reader() as reader, self._qcontext.writer() as writer:
+            reader.register('cdns-to-tsv')
+            job = reader.get(0)
+            # A running job is not queued again, but may be re-queued
+            # by the worker.
+            self.assertEqual(writer.add_many('cdns-to-tsv', ['/a']), 0)
+            writer.add('cdns-to-tsv', '/a', retry_count=1)
+            job.done()
+            self.assertEqual(reader.get(0).arg, ('/b', None, 0))
+            self.assertEqual(reader.get(0).arg, ('/a', None, 1))
+            # Once done, the file can be queued again.
+            self.assertEqual(writer.add_many('cdns-to-tsv', ['/a']), 1)
+        self.assertEqual(self._qcontext.duplicates(), {'cdns-to-tsv': 3})
+
+    def test_not_unique(self):
+        with self._qcontext.writer() as writer:
+            writer.add('cdns-to-tsv', '/a', dq.JobPrecedence.low)
+            # A delayed job now due isn't merged with the queued job.
+            self.assertEqual(writer.add_many('cdns-to-tsv', ['/a'], dq.JobPrecedence.high,
+                                             unique=False), 1)
+        with self._qcontext.reader() as reader:
+            reader.register('cdns-to-tsv')
+            job = reader.get(0)
+            self.assertEqual(job.precedence, dq.JobPrecedence.high)
+            job.done()
+            self.assertEqual(reader.get(0).precedence, dq.JobPrecedence.low)
+
+    def test_release(self):
+        with self._qcontext.writer() as writer:
+            writer.add('import-tsv', '/a')
+            writer.add('import-tsv', '/b')
+        with self._qcontext.reader() as reader:
+            reader.register('import-tsv')
+            reader.get(0).failed()
+            reader.get(0)
+            self.assertEqual(self._qcontext.status(), [('import-tsv', 1, 1, 1)])
+        # A job taken but not finished returns to the queue.
+        self.assertEqual(self._qcontext.status(), [('import-tsv', 1, 0, 0)])
+
+        # As do jobs taken by a process that has gone away.
+        with self._qcontext.reader() as reader, \
+             patch('dsv.common.Queue._process_exists', return_value=False):
+            reader.register('import-tsv')
+            job = reader.get(0)
+            with self._qcontext.reader():
+                self.assertEqual(self._qcontext.status(), [('import-tsv', 1, 0, 0)])
+            self.assertEqual(job.arg[0], '/b')
+
+    def test_idle(self):
+        # An idle reader doesn't take the write lock.
+        with self._qcontext.reader() as reader:
+            reader.register('import-tsv')
+            statements = []
+            reader._store._db.set_trace_callback(statements.append)
+            self.assertIsNone(reader.get(0.3))
+            self.assertTrue(statements)
+            self.assertFalse([s for s in statements if s.startswith('BEGIN')])
+
+    def test_interrupt(self):
+        with self._qcontext.reader() as reader:
+            reader.register('import-tsv')
+            self.assertIsNone(reader.get(0.05))
+            threading.Timer(0.05, reader.interrupt).start()
+            self.assertIsNone(reader.get())
@@ -0,0 +1,69 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import datetime
+import unittest
+
+import dsv.common.NativeInsert as dni
+
+COLUMNS = [('Date', 'Date'), ('DateTime', 'DateTime'), ('NodeID', 'UInt16'),
+           ('ClientAddress', 'FixedString(16)'), ('QueryName', 'String')]
+
+class FakeClient:
+    def __init__(self, fail_after=None):
+        self.queries = []
+        self.rows = []
+        self._fail_after = fail_after
+
+    def execute(self, query, data=None, settings=None):
+        if query.startswith('DESCRIBE'):
+            return COLUMNS
+        self.queries.append(query)
+        for row in data:
+            if self._fail_after is not None and len(self.rows) == self._fail_after:
+                raise EOFError('Connection lost')
+            self.rows.append(row)
+        return None
+
+class TestNativeInsert(unittest.TestCase):
+    def test_unescape(self):
+        self.assertEqual(dni.unescape(b'plain'), b'plain')
+        self.assertEqual(dni.unescape(b'a\\tb\\\\c\\x41\\n'), b'a\tb\\cA\n')
+
+    def test_converter(self):
+        self.assertEqual(dni.converter('UInt8')(b'7'), 7)
+        self.assertEqual(dni.converter('Int64')(b''), 0)
+        self.assertEqual(dni.converter('Date')(b'2021-01-01'), datetime.date(2021, 1, 1))
+        self.assertEqual(dni.converter('FixedString(16)')(b'00ff'), b'\x00\xff')
+        with self.assertRaises(dni.ConversionError):
+            dni.converter('Array(String)')
+
+    def test_insert(self):
+        client = FakeClient()
+        inserter = dni.TSVInserter(client, 'dsv.QueryResponse', 10)
+        lines = [b'NodeID\tQueryName\tDate\n', b'3\twww\\x2e\t2021-01-01\n']
+        self.assertEqual(inserter.insert(lines, with_names=True), 1)
+        self.assertEqual(client.queries,
+                         ['INSERT INTO dsv.QueryResponse (NodeID, QueryName, Date) VALUES'])
+        self.assertEqual(client.rows, [[3, b'www.', datetime.date(2021, 1, 1)]])
+
+        with self.assertRaises(dni.ConversionError):
+            inserter.insert([b'Nope\n'], with_names=True)
+        with self.assertRaises(dni.ConversionError):
+            inserter.insert([b'2021-01-01\t1609459200\t3\n'])
+
+    def test_partial(self):
+        line = b'2021-01-01\t1609459200\t3\t00\tname\n'
+        inserter = dni.TSVInserter(FakeClient(fail_after=2), 'dsv.QueryResponse', 5)
+        with self.assertRaises(EOFError):
+            inserter.insert([line] * 10)
+        self.assertFalse(inserter.partial)
+        inserter = dni.TSVInserter(FakeClient(fail_after=7), 'dsv.QueryResponse', 5)
+        with self.assertRaises(EOFError):
+            inserter.insert([line] * 10)
+        self.assertTrue(inserter.partial)
@@ -0,0 +1,89 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import pathlib
+import tempfile
+import time
+import unittest
+
+from unittest.mock import patch
+
+import dsv.common.NodeIds as dnid
+
+class TestNodeIds(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory(prefix='nodeids_')
+        self._snapshot = str(pathlib.Path(self._dir.name) / '.node-ids.json')
+        self._nodes = {('server', 'node'): 1, ('server', 'nodealt'): 1, ('srvalt', 'node'): 1}
+        self._queries = 0
+        patcher = patch.object(dnid, 'query_node_ids', side_effect=self._query)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(dnid, 'CHECK_INTERVAL', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _query(self, pgcfg):
+        self._queries += 1
+        return dict(self._nodes)
+
+    def test_snapshot(self):
+        first = dnid.NodeIdResolver({}, self._snapshot)
+        self.assertEqual(first.node_id('srvalt', 'node'), 1)
+        self.assertEqual(self._queries, 1)
+        self.assertEqual(first.node_id('server', 'nodealt'), 1)
+        self.assertEqual(self._queries, 1)
+
+        # A new resolver reads the snapshot.
+        second = dnid.NodeIdResolver({}, self._snapshot)
+        self.assertEqual(second.node_id('server', 'node'), 1)
+        self.assertEqual(self._queries, 1)
+
+        # A miss reloads, but doesn't write a new version if nothing changed.
+        self.assertIsNone(second.node_id('server', 'other'))
+        self.assertEqual(self._queries, 2)
+        self.assertEqual(dnid.read_snapshot(self._snapshot)[0], 1)
+
+        # Nodes update writes a new version, seen by other resolvers.
+        self._nodes[('server', 'node')] = 2
+        updater = dnid.NodeIdResolver({}, self._snapshot)
+        self.assertEqual(updater.reload(new_version=True), 2)
+        self.assertEqual(first.node_id('server', 'node'), 2)
+        self.assertEqual(self._queries, 3)
+
+    def test_no_snapshot(self):
+        resolver = dnid.NodeIdResolver({}, '')
+        self.assertEqual(resolver.node_id('server', 'node'), 1)
+        self.assertEqual(resolver.node_id('server', 'node'), 1)
+        self.assertEqual(self._queries, 1)
+
+    def test_bad_snapshot(self):
+        pathlib.Path(self._snapshot).write_text('{')
+        resolver = dnid.NodeIdResolver({}, self._snapshot)
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(resolver.node_id('server', 'node'), 1)
+        self.assertEqual(self._queries, 1)
+        self.assertEqual(dnid.read_snapshot(self._snapshot)[1], self._nodes)
+
+    def test_miss(self):
+        resolver = dnid.NodeIdResolver({}, self._snapshot)
+        self.assertIsNone(resolver.node_id('server', 'other'))
+        self.assertIsNone(resolver.node_id('server', 'other'))
+        self.assertIsNone(resolver.node_id('server', 'another'))
+        self.assertEqual(self._queries, 1)
+
+        # Once the interval is over, a miss reloads again.
+        self._nodes[('server', 'other')] = 3
+        self.assertIsNone(resolver.node_id('server', 'other'))
+        later = time.monotonic() + dnid.MISS_RELOAD_INTERVAL
+        with patch('time.monotonic', return_value=later):
+            self.assertEqual(resolver.node_id('server', 'other'), 3)
+        self.assertEqual(self._queries, 2)
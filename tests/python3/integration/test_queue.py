@@ -7,6 +7,7 @@
 # Developed by Sinodun IT (sinodun.com)
 
 import importlib
+import io
 import pdb
 import sys
 
@@ -22,3 +23,13 @@ class TestRun(common.DSVTestCase):
         with patch('dsv.common.Queue.QueueWriter', autospec=True) as MockQueueWriter:
             args = common.get_args(cmd, ['-q', 'import-tsv', 'job1'])
             self.assertEqual(cmd.main(args, self._config), 0)
+
+    def test_queue_stdin(self):
+        with patch('dsv.common.Queue.QueueWriter', autospec=True) as MockQueueWriter:
+            added = []
+            writer = MockQueueWriter.return_value.__enter__.return_value
+            writer.add_many.side_effect = lambda queue, jobs, **kwargs: added.extend(jobs)
+            args = common.get_args(cmd, ['-q', 'import-tsv', 'job1', '-', 'job4'])
+            with patch('sys.stdin', io.StringIO('job2\n\njob3\n')):
+                self.assertEqual(cmd.main(args, self._config), 0)
+            self.assertEqual(added, ['job1', 'job2', 'job3', 'job4'])
@@ -0,0 +1,87 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import importlib
+import os
+import pathlib
+
+import common
+import dsv.common.ScanIndex as dsi
+
+dsc = importlib.import_module('dsv.commands.scan_index')
+di = importlib.import_module('dsv.commands.import')
+
+class TestScanIndex(common.DSVTestCase):
+    def setUp(self):
+        super().setUp()
+        self._base = pathlib.Path(self._datastore_path.name)
+        self._cbor = self._base / 'server' / 'node' / 'cbor'
+        self._cbor.mkdir(parents=True)
+        for n in range(5):
+            (self._cbor / '20210101-00000{}-node.cbor.xz'.format(n)).touch()
+        (self._cbor / 'pending').mkdir()
+        self._index_path = self._config['datastore']['scan_index']
+
+    def tearDown(self):
+        di.scan_index = None
+        super().tearDown()
+
+    def _age_dir(self, dpath):
+        # Make directory mtime old enough to be trusted.
+        st = dpath.stat()
+        os.utime(str(dpath), ns=(st.st_atime_ns, st.st_mtime_ns - 10 * 1000 * 1000 * 1000))
+
+    def test_listing(self):
+        with dsi.ScanIndex(self._index_path) as index:
+            self._age_dir(self._cbor)
+            names = index.listing(self._cbor)
+            self.assertEqual(len(names), 5)
+            self.assertNotIn('pending', names)
+            self.assertEqual(len(index.files(self._cbor, '*.cbor.xz')), 5)
+            self.assertEqual(len(index.files(self._cbor, '*.tsv')), 0)
+
+            # Unchanged directory is not re-read. Sneak in a file without
+            # changing the directory mtime and check it isn't seen.
+            st = self._cbor.stat()
+            (self._cbor / '20210101-000010-node.cbor.xz').touch()
+            os.utime(str(self._cbor), ns=(st.st_atime_ns, st.st_mtime_ns))
+            self.assertEqual(len(index.listing(self._cbor)), 5)
+            self.assertEqual(index.verify(self._cbor),
+                             ({'20210101-000010-node.cbor.xz'}, set()))
+
+            # Changed directory is re-read.
+            (self._cbor / '20210101-000000-node.cbor.xz').unlink()
+            self.assertEqual(len(index.listing(self._cbor)), 5)
+            self.assertEqual(index.verify(self._cbor), (set(), set()))
+
+    def test_recent_dir_rescanned(self):
+        with dsi.ScanIndex(self._index_path) as index:
+            index.listing(self._cbor)
+            st = self._cbor.stat()
+            (self._cbor / '20210101-000010-node.cbor.xz').touch()
+            os.utime(str(self._cbor), ns=(st.st_atime_ns, st.st_mtime_ns))
+            self.assertEqual(len(index.listing(self._cbor)), 6)
+
+    def test_files_to_process(self):
+        unindexed = list(di.files_to_process(self._base, di.CDNS_DIR_PATTERN, '*.cbor.xz'))
+        di.scan_index = dsi.ScanIndex(self._index_path)
+        try:
+            indexed = list(di.files_to_process(self._base, di.CDNS_DIR_PATTERN, '*.cbor.xz'))
+            self.assertEqual(indexed, unindexed)
+            indexed = list(di.files_to_process(self._base, di.CDNS_DIR_PATTERN, '*.cbor.xz'))
+            self.assertEqual(indexed, unindexed)
+        finally:
+            di.scan_index.close()
+
+    def test_command(self):
+        args = common.get_args(dsc, ['--rebuild'])
+        self.assertEqual(dsc.main(args, self._config), 0)
+        args = common.get_args(dsc, ['--verify'])
+        self.assertEqual(dsc.main(args, self._config), 0)
+        (self._cbor / '20210101-000010-node.cbor.xz').touch()
+        self.assertNotEqual(dsc.main(args, self._config), 0)
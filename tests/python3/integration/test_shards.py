@@ -0,0 +1,55 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import collections
+import unittest
+
+from unittest.mock import patch
+
+import dsv.common.Shards as dsh
+
+class FakeMonitor:
+    def __init__(self, parts):
+        self.parts = parts
+
+    def server_parts(self):
+        return self.parts
+
+    def close(self):
+        pass
+
+class TestShards(unittest.TestCase):
+    def test_servers(self):
+        self.assertEqual(dsh.servers({'servers': 'a, b,c'}), ['a', 'b', 'c'])
+        self.assertEqual(dsh.shard_table('QueryResponse'), 'QueryResponseShard')
+
+    def test_node(self):
+        chooser = dsh.ShardChooser(dsh.NODE, ['a', 'b', 'c'])
+        self.assertEqual([chooser.choose(n) for n in range(5)], ['a', 'b', 'c', 'a', 'b'])
+        self.assertEqual(chooser.choose(None), 'a')
+
+    def test_round_robin(self):
+        chooser = dsh.ShardChooser(dsh.ROUND_ROBIN, ['a', 'b', 'c'])
+        counts = collections.Counter(chooser.choose(1) for _ in range(9))
+        self.assertEqual(counts, {'a': 3, 'b': 3, 'c': 3})
+
+    def test_least_loaded(self):
+        monitor = FakeMonitor({'a': 100, 'b': 20, 'c': 50})
+        with patch.object(dsh, 'LOAD_SAMPLE_INTERVAL', 0):
+            chooser = dsh.ShardChooser(dsh.LEAST_LOADED, ['a', 'b', 'c'], monitor)
+            self.assertEqual(chooser.choose(1), 'b')
+            monitor.parts = {'a': 10, 'b': 20, 'c': 50}
+            self.assertEqual(chooser.choose(1), 'a')
+            # Without part counts, take shards in turn.
+            monitor.parts = None
+            self.assertEqual(len({chooser.choose(1) for _ in range(3)}), 3)
+
+    def test_bad_mode(self):
+        for mode in [dsh.DISTRIBUTED, 'nearest']:
+            with self.assertRaises(ValueError):
+                dsh.ShardChooser(mode, ['a'])
@@ -0,0 +1,51 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import datetime
+import os
+import pathlib
+import tempfile
+import unittest
+
+import dsv.common.TimeIndex as dti
+
+class TestTimeIndex(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._names = ['20210101-00{:02d}00-node.cdns.xz'.format(n) for n in range(0, 60, 5)]
+        # A file without a timestamp name, dated by modification time.
+        self._odd = 'odd.cdns.xz'
+        odd = pathlib.Path(self._dir.name) / self._odd
+        odd.touch()
+        t = datetime.datetime(2021, 1, 1, 0, 12, tzinfo=datetime.timezone.utc).timestamp()
+        os.utime(str(odd), (t, t))
+        self._index = dti.TimeIndex(self._dir.name, list(reversed(self._names)) + [self._odd])
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_select(self):
+        self.assertEqual(len(self._index), 13)
+        self.assertEqual(self._index.select(), self._names + [self._odd])
+        self.assertEqual(self._index.select(datetime.datetime(2021, 1, 1, 0, 10),
+                                            datetime.datetime(2021, 1, 1, 0, 20)),
+                         self._names[2:4] + [self._odd])
+        self.assertEqual(self._index.select(from_date=datetime.datetime(2021, 1, 1, 0, 50)),
+                         self._names[10:])
+        self.assertEqual(self._index.select(to_date=datetime.datetime(2021, 1, 1, 0, 5)),
+                         self._names[0:1])
+        # Fractional seconds.
+        self.assertEqual(self._index.select(datetime.datetime(2021, 1, 1, 0, 5, 0, 500),
+                                            datetime.datetime(2021, 1, 1, 0, 10, 0, 500)),
+                         self._names[2:3])
+        self.assertEqual(self._index.select(datetime.datetime(2022, 1, 1)), [])
+
+    def test_span(self):
+        self.assertEqual(self._index.span(),
+                         (datetime.datetime(2021, 1, 1, 0, 0), datetime.datetime(2021, 1, 1, 0, 55)))
+        self.assertEqual(dti.TimeIndex(self._dir.name, []).span(), (None, None))
@@ -0,0 +1,154 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import argparse
+import asyncio
+import collections
+import datetime
+import importlib
+import subprocess
+
+from unittest.mock import MagicMock, patch
+
+import common
+
+import dsv.common.DelayedJobs as ddj
+import dsv.common.Queue as dq
+
+cmd = importlib.import_module('dsv.commands.worker')
+
+class FakeJob:
+    def __init__(self, queue, arg):
+        self.queue = queue
+        self.arg = (arg, None, 0)
+        self.queued = None
+        self.size = None
+        self.node_id = None
+        self.precedence = None
+        self.result = None
+
+    def done(self):
+        self.result = 'done'
+
+    def failed(self):
+        self.result = 'failed'
+
+class FakeReader:
+    def __init__(self, jobs):
+        self._jobs = collections.deque(jobs)
+        self.registered = []
+
+    def register_clear(self):
+        self.registered = []
+
+    def register(self, queue):
+        self.registered.append(queue)
+
+    def get(self, timeout=None):
+        # Return the first job on a registered queue.
+        for job in self._jobs:
+            if job.queue in self.registered:
+                self._jobs.remove(job)
+                return job
+        return None
+
+    def interrupt(self):
+        pass
+
+class TestWorker(common.DSVTestCase):
+    def test_queue_limit_arg(self):
+        self.assertEqual(cmd.queue_limit_arg('cdns-to-pcap=2'), ('cdns-to-pcap', 2))
+        for bad in ['cdns-to-pcap', 'cdns-to-pcap=x', 'cdns-to-pcap=-1']:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                cmd.queue_limit_arg(bad)
+
+    def test_deferred(self):
+        writer = MagicMock()
+        args = common.get_args(cmd, [])
+        job = FakeJob('import-tsv', '/no/tsv')
+        notbefore = datetime.datetime(2021, 1, 1, 0, 5)
+        res = subprocess.CompletedProcess(
+            ['import-tsv', '/no/tsv'], 2,
+            'Not before: {}\n'.format(notbefore.timestamp()).encode(), b'ClickHouse parts 200')
+        # Deferral is not a failure, and doesn't use up a retry.
+        self.assertFalse(cmd.complete_job(writer, args, job, '/no/tsv', 5, res, 0))
+        self.assertEqual(job.result, 'done')
+        writer.add.assert_called_once_with('import-tsv', '/no/tsv',
+                                           notbefore=notbefore, retry_count=5,
+                                           size=None, node_id=None)
+
+        # A retry keeps what is known about the job.
+        job = FakeJob('import-tsv', '/no/tsv')
+        job.size = 100
+        job.node_id = 3
+        res = subprocess.CompletedProcess(['import-tsv', '/no/tsv'], 2, b'', b'Failed')
+        writer.reset_mock()
+        self.assertTrue(cmd.complete_job(writer, args, job, '/no/tsv', 1, res, 0))
+        self.assertEqual(job.result, 'failed')
+        writer.add.assert_called_once_with('import-tsv', '/no/tsv', retry_count=2,
+                                           size=100, node_id=3)
+
+    def test_slot_usage(self):
+        usage = cmd.SlotUsage(4, ['a', 'b'])
+        usage.start('a')
+        usage.start('b')
+        self.assertEqual(usage.busy, 2)
+        usage.finish('a')
+        self.assertEqual(usage.running['a'], 0)
+        self.assertIn('Slots 1/4 busy (a:0, b:1)', usage.report())
+
+    def test_wait_stats(self):
+        waits = cmd.WaitStats()
+        now = datetime.datetime(2021, 1, 1, 12)
+        for n in range(1, 11):
+            job = FakeJob('import-tsv', '/no/tsv')
+            job.queued = now - datetime.timedelta(seconds=n)
+            waits.record(job, now)
+        job = FakeJob('cdns-to-pcap', '/no/pcap')
+        job.queued = now - datetime.timedelta(seconds=60)
+        job.precedence = dq.JobPrecedence.low
+        waits.record(job, now)
+        # Jobs with no queued time are not counted.
+        waits.record(FakeJob('import-tsv', '/no/tsv'), now)
+        self.assertEqual(waits.report(),
+                         'Queue waits cdns-to-pcap/low 1 jobs p50:60.0s p90:60.0s p99:60.0s, '
+                         'import-tsv/- 10 jobs p50:5.0s p90:9.0s p99:10.0s')
+        self.assertIsNone(waits.report())
+
+    def test_slots(self):
+        jobs = [FakeJob('cdns-to-pcap', '/no/pcap{}'.format(n)) for n in range(6)] + \
+               [FakeJob('import-tsv', '/no/tsv{}'.format(n)) for n in range(6)]
+        last = FakeJob('import-tsv', '/no/last')
+        reader = FakeReader(jobs + [last])
+        running = collections.Counter()
+        peak = collections.Counter()
+
+        async def fake_run(loop, executor, handler_context, queue, arg, retry_count):
+            running[queue] += 1
+            peak[queue] = max(peak[queue], running[queue])
+            await asyncio.sleep(0.02)
+            running[queue] -= 1
+            # Infrastructure error on the last job stops the worker.
+            return subprocess.CompletedProcess([queue, arg], 99 if arg == '/no/last' else 0,
+                                               b'', b'')
+
+        args = common.get_args(cmd, ['--slots', '4', '--queue-limit', 'cdns-to-pcap=2'])
+        limits = collections.OrderedDict([('cdns-to-pcap', 2), ('cdns-to-tsv', None),
+                                          ('import-tsv', None)])
+        loop = asyncio.new_event_loop()
+        try:
+            with patch.object(cmd, 'run_job_async', fake_run):
+                loop.run_until_complete(cmd.run_slots(
+                    loop, None, args, reader, None, ddj.DelayedJobs(),
+                    lambda: list(limits.keys()), limits, []))
+        finally:
+            loop.close()
+        self.assertTrue(all(job.result == 'done' for job in jobs))
+        self.assertEqual(peak['cdns-to-pcap'], 2)
+        self.assertLessEqual(peak['cdns-to-pcap'] + peak['import-tsv'], 4)
+        self.assertGreater(peak['import-tsv'], 1)
@@ -0,0 +1,62 @@
+# Copyright 2021 Internet Corporation for Assigned Names and Numbers.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, you can obtain one at https://mozilla.org/MPL/2.0/.
+#
+# Developed by Sinodun IT (sinodun.com)
+
+import os
+import pathlib
+import random
+import subprocess
+import tempfile
+import unittest
+
+import dsv.common.Xz as dxz
+
+class TestXz(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory(prefix='xz_')
+        self._path = pathlib.Path(self._dir.name) / '20210101-000000_300-node.cdns.xz'
+        rnd = random.Random(42)
+        self._data = bytes(rnd.getrandbits(8) for _ in range(256 * 1024)) * 4
+        with self._path.open('wb') as f:
+            subprocess.run(['xz', '--compress', '--stdout', '--threads=1'],
+                           input=self._data, stdout=f, check=True)
+        os.utime(str(self._path), (1000000000, 1000000000))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _decompress(self, threads):
+        cmd = dxz.decompress_command(self._path, threads)
+        return (cmd, subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout)
+
+    def test_single_block(self):
+        self.assertEqual(dxz.block_count(self._path), 1)
+        cmd, data = self._decompress(0)
+        self.assertFalse(any(arg.startswith('--threads') for arg in cmd))
+        self.assertEqual(data, self._data)
+
+    def test_recompress(self):
+        self.assertTrue(dxz.recompress(self._path, 2, '256KiB', level=1))
+        self.assertEqual(dxz.block_count(self._path), 4)
+        self.assertEqual(self._path.stat().st_mtime, 1000000000)
+        self.assertEqual(os.listdir(self._dir.name), [self._path.name])
+        cmd, data = self._decompress(0)
+        self.assertIn('--threads=0', cmd)
+        self.assertEqual(data, self._data)
+        cmd, _ = self._decompress(1)
+        self.assertNotIn('--threads=1', cmd)
+
+        # Already in blocks.
+        self.assertFalse(dxz.recompress(self._path, 2, '256KiB'))
+
+    def test_bad_file(self):
+        bad = pathlib.Path(self._dir.name) / 'bad.cdns.xz'
+        bad.write_bytes(b'not xz')
+        self.assertIsNone(dxz.block_count(bad))
+        with self.assertRaises(dxz.XzError):
+            dxz.recompress(bad, 1, '1MiB')
+        self.assertEqual(bad.read_bytes(), b'not xz')